@@ -0,0 +1,258 @@
+"""
+Adaptive per-query refresh intervals.
+
+Every normal query used to scan at the same global query_refresh_delay, whether
+it finds 50 items an hour or one a week. This module estimates the new-item
+arrival rate of each query (EWMA of new items per second) and spreads a global
+request budget over the queries so that the expected discovery delay is minimal.
+
+Math: with Poisson arrivals (rate λ_i) and scan interval T_i an item waits T_i/2
+on average. Minimizing Σ λ_i·T_i/2 subject to the budget Σ 1/T_i = B gives
+T_i = c / sqrt(λ_i), with c = Σ sqrt(λ_j) / B. Intervals are clamped to
+[min, max] and the remaining budget is redistributed over unclamped queries.
+"""
+import math
+import threading
+import time
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Lowest arrival rate we assume for a query (1 item per day) - avoids infinite intervals
+RATE_FLOOR = 1.0 / 86400
+# How often the allocation over all queries is recomputed (seconds)
+RECOMPUTE_INTERVAL = 10
+
+# Defaults for the DB parameters
+DEFAULT_MIN_DELAY = 15
+DEFAULT_MAX_DELAY = 600
+DEFAULT_EWMA_ALPHA = 0.3
+
+
+class _QueryRate:
+    """Arrival rate estimate of ONE query"""
+    def __init__(self):
+        self.rate = None  # new items per second (EWMA), None until first sample
+        self.last_scan_time = None
+        self.samples = 0
+        self.total_new_items = 0
+
+
+class AdaptiveRefreshController:
+    """
+    Computes refresh intervals of normal queries from observed arrival rates.
+
+    Features:
+    - EWMA of new items per second per query
+    - Square-root allocation of a global request budget (min expected delay)
+    - Configurable min/max interval bounds
+    - Queries without samples yet keep the global query_refresh_delay
+    """
+
+    def __init__(self):
+        self.queries = {}
+        self.lock = threading.Lock()
+        self.intervals = {}
+        self.last_recompute = 0
+        self.config = {}
+        # Rates restored from a shutdown snapshot, applied when the query registers
+        self._restored = {}
+
+    def register(self, query_id):
+        """Register a normal query for budget allocation"""
+        with self.lock:
+            if query_id not in self.queries:
+                self.queries[query_id] = self._restored.pop(query_id, None) or _QueryRate()
+            self.last_recompute = 0
+
+    def export_state(self):
+        """Snapshot of the arrival rate estimates (graceful shutdown)"""
+        with self.lock:
+            return {query_id: {"rate": state.rate, "last_scan_time": state.last_scan_time,
+                               "samples": state.samples, "total_new_items": state.total_new_items}
+                    for query_id, state in self.queries.items()}
+
+    def import_state(self, snapshot):
+        """Restore rate estimates - no cold start after a restart"""
+        with self.lock:
+            for query_id, data in snapshot.items():
+                state = _QueryRate()
+                state.rate = data.get("rate")
+                state.last_scan_time = data.get("last_scan_time")
+                state.samples = data.get("samples") or 0
+                state.total_new_items = data.get("total_new_items") or 0
+                if query_id in self.queries:
+                    self.queries[query_id] = state
+                else:
+                    self._restored[query_id] = state
+            self.last_recompute = 0
+
+    def forget(self, query_id):
+        """Remove a query from budget allocation"""
+        with self.lock:
+            self.queries.pop(query_id, None)
+            self.intervals.pop(query_id, None)
+            self.last_recompute = 0
+
+    def record_scan(self, query_id, new_items, now=None):
+        """
+        Update the arrival rate of a query after a successful scan.
+
+        Args:
+            query_id: Query identifier
+            new_items: Number of items not seen before (None for a baseline scan)
+            now: Scan time (default: now)
+        """
+        if now is None:
+            now = time.time()
+        alpha = self.config.get("alpha", DEFAULT_EWMA_ALPHA)
+        with self.lock:
+            state = self.queries.get(query_id)
+            if state is None:
+                # Not a registered normal query (e.g. priority query) - ignore
+                return
+            if new_items is not None and state.last_scan_time is not None:
+                elapsed = max(1.0, now - state.last_scan_time)
+                sample = new_items / elapsed
+                if state.rate is None:
+                    state.rate = sample
+                else:
+                    state.rate = alpha * sample + (1 - alpha) * state.rate
+                state.samples += 1
+                state.total_new_items += new_items
+            state.last_scan_time = now
+
+    def _load_config(self, base_delay):
+        """Read bounds and budget from DB parameters (with defaults)"""
+        import db
+        try:
+            min_delay = float(db.get_parameter("adaptive_min_refresh_delay") or DEFAULT_MIN_DELAY)
+            max_delay = float(db.get_parameter("adaptive_max_refresh_delay") or DEFAULT_MAX_DELAY)
+            alpha = float(db.get_parameter("adaptive_ewma_alpha") or DEFAULT_EWMA_ALPHA)
+            # Budget in requests per minute for ALL normal queries (0 = same as fixed delay)
+            budget_per_minute = float(db.get_parameter("adaptive_request_budget") or 0)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"[ADAPTIVE] Invalid adaptive parameters, using defaults: {e}")
+            min_delay, max_delay, alpha, budget_per_minute = DEFAULT_MIN_DELAY, DEFAULT_MAX_DELAY, DEFAULT_EWMA_ALPHA, 0
+        return {
+            "min_delay": min_delay,
+            "max_delay": max(min_delay, max_delay),
+            "alpha": alpha,
+            "budget_per_minute": budget_per_minute,
+            "base_delay": base_delay,
+        }
+
+    def _recompute(self, base_delay):
+        """Allocate the request budget over all registered queries"""
+        config = self._load_config(base_delay)
+        min_delay = config["min_delay"]
+        max_delay = config["max_delay"]
+
+        with self.lock:
+            self.config = config
+            query_ids = list(self.queries.keys())
+            if not query_ids:
+                self.intervals = {}
+                return
+
+            # Total budget (requests per second); default = what the fixed delay would cost
+            if config["budget_per_minute"] > 0:
+                budget = config["budget_per_minute"] / 60.0
+            else:
+                budget = len(query_ids) / float(base_delay)
+
+            intervals = {}
+            # Queries without rate samples keep the base delay and consume their share of budget
+            weights = {}
+            for query_id in query_ids:
+                state = self.queries[query_id]
+                if state.rate is None:
+                    intervals[query_id] = base_delay
+                    budget -= 1.0 / base_delay
+                else:
+                    weights[query_id] = math.sqrt(max(state.rate, RATE_FLOOR))
+
+            # Square-root allocation, clamping to [min, max] and redistributing the rest
+            free = dict(weights)
+            for _ in range(len(weights) + 1):
+                if not free:
+                    break
+                if budget <= 0:
+                    for query_id in free:
+                        intervals[query_id] = max_delay
+                    break
+                c = sum(free.values()) / budget
+                clamped = {}
+                for query_id, weight in free.items():
+                    interval = c / weight
+                    if interval < min_delay:
+                        clamped[query_id] = min_delay
+                    elif interval > max_delay:
+                        clamped[query_id] = max_delay
+                if not clamped:
+                    for query_id, weight in free.items():
+                        intervals[query_id] = c / weight
+                    break
+                for query_id, interval in clamped.items():
+                    intervals[query_id] = interval
+                    budget -= 1.0 / interval
+                    del free[query_id]
+
+            self.intervals = intervals
+            self.last_recompute = time.time()
+
+    def get_interval(self, query_id, base_delay):
+        """
+        Get the refresh interval for a normal query.
+
+        Args:
+            query_id: Query identifier
+            base_delay: Global query_refresh_delay (fallback and default budget)
+
+        Returns:
+            float: Interval in seconds
+        """
+        if time.time() - self.last_recompute >= RECOMPUTE_INTERVAL or self.config.get("base_delay") != base_delay:
+            self._recompute(base_delay)
+        with self.lock:
+            return self.intervals.get(query_id, base_delay)
+
+    def get_stats(self):
+        """Get adaptive refresh statistics (rates in items/hour, intervals in seconds)"""
+        with self.lock:
+            queries = {}
+            for query_id, state in self.queries.items():
+                queries[query_id] = {
+                    "rate_items_per_hour": round(state.rate * 3600, 2) if state.rate is not None else None,
+                    "interval_seconds": round(self.intervals.get(query_id, self.config.get("base_delay") or 0), 1),
+                    "samples": state.samples,
+                    "total_new_items": state.total_new_items,
+                }
+            requests_per_minute = sum(60.0 / i for i in self.intervals.values() if i)
+            return {
+                "min_delay": self.config.get("min_delay"),
+                "max_delay": self.config.get("max_delay"),
+                "budget_per_minute": self.config.get("budget_per_minute"),
+                "planned_requests_per_minute": round(requests_per_minute, 2),
+                "queries": queries,
+            }
+
+
+def is_adaptive_refresh_enabled():
+    """Adaptive intervals are ON unless adaptive_refresh_enabled is set to False"""
+    import db
+    return (db.get_parameter("adaptive_refresh_enabled") or "True") == "True"
+
+
+# Global controller instance
+_global_controller = None
+_global_controller_lock = threading.Lock()
+
+
+def get_adaptive_refresh_controller():
+    """Get or create global adaptive refresh controller"""
+    global _global_controller
+    with _global_controller_lock:
+        if _global_controller is None:
+            _global_controller = AdaptiveRefreshController()
+        return _global_controller
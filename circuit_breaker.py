@@ -0,0 +1,228 @@
+"""
+Circuit breakers for Token+Proxy pairs.
+
+A failing proxy used to be retried every cycle by its worker, and the 403
+retry loop then paid a full homepage fetch per fresh pair - often through
+the same bad proxies. Each proxy endpoint (the network side of a pair) now
+has a breaker:
+
+- CLOSED: requests flow, consecutive failures are counted
+- OPEN: failure threshold reached - the proxy is skipped instantly until the
+  cooldown expires (cooldown doubles on every re-trip, up to a maximum)
+- HALF_OPEN: cooldown expired - exactly ONE request is let through as a probe;
+  success closes the circuit, failure opens it again
+
+Breakers are per process. Worker shards share the proxy list, so a bad
+proxy's failures are spread over the shards - each shard trips after its
+share of circuit_failure_threshold (rate_limiter.get_budget_share()), so the
+proxy is cut off after about the same total number of failures as with one
+process. Cooldowns are kept; every shard sends its own half-open probe.
+"""
+import math
+import threading
+import time
+from rate_limiter import get_budget_share
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Direct connection (no proxy) gets its own breaker
+DIRECT_KEY = "direct"
+# A probe that never reports back is given up after this many seconds
+PROBE_TIMEOUT = 60
+
+# Defaults for the DB parameters
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN = 60
+DEFAULT_MAX_COOLDOWN = 600
+# How often thresholds/cooldowns are re-read from DB parameters (seconds)
+CONFIG_RELOAD_INTERVAL = 30
+
+
+class _Circuit:
+    """State of ONE breaker"""
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = None
+        self.cooldown = 0
+        self.probe_started = None
+        self.total_failures = 0
+        self.total_successes = 0
+        self.total_rejected = 0
+
+
+class CircuitBreakerRegistry:
+    """
+    Thread-safe registry of breakers keyed by proxy.
+
+    Features:
+    - Consecutive-failure threshold to open (circuit_failure_threshold)
+    - Exponential cooldown per re-trip (circuit_cooldown .. circuit_max_cooldown)
+    - Single half-open probe, other callers are rejected instantly
+    - Rejected/failed/succeeded counters per breaker
+    """
+
+    def __init__(self):
+        self.circuits = {}
+        self.lock = threading.Lock()
+        self.config = {}
+        self.config_loaded = 0
+        self.total_trips = 0
+
+    def _load_config(self):
+        """Read thresholds from DB parameters (with defaults)"""
+        import db
+        try:
+            config = {
+                "enabled": (db.get_parameter("circuit_breaker_enabled") or "True") == "True",
+                "failure_threshold": max(1, int(db.get_parameter("circuit_failure_threshold") or DEFAULT_FAILURE_THRESHOLD)),
+                "cooldown": float(db.get_parameter("circuit_cooldown") or DEFAULT_COOLDOWN),
+                "max_cooldown": float(db.get_parameter("circuit_max_cooldown") or DEFAULT_MAX_COOLDOWN),
+            }
+        except (ValueError, TypeError) as e:
+            logger.warning(f"[CIRCUIT] Invalid circuit breaker parameters, using defaults: {e}")
+            config = {
+                "enabled": True,
+                "failure_threshold": DEFAULT_FAILURE_THRESHOLD,
+                "cooldown": DEFAULT_COOLDOWN,
+                "max_cooldown": DEFAULT_MAX_COOLDOWN,
+            }
+        # Worker shard: this process only sees its share of a proxy's failures
+        config["failure_threshold"] = max(1, math.ceil(config["failure_threshold"] * get_budget_share()))
+        return config
+
+    def _get_config(self):
+        if not self.config or time.time() - self.config_loaded >= CONFIG_RELOAD_INTERVAL:
+            self.config = self._load_config()
+            self.config_loaded = time.time()
+        return self.config
+
+    def allow(self, proxy):
+        """
+        Check if a request through this proxy may be sent.
+        In half-open state the FIRST caller gets the probe, others are rejected.
+
+        Args:
+            proxy: Proxy string of the pair (None for direct connection)
+
+        Returns:
+            bool: True if the request may be sent
+        """
+        config = self._get_config()
+        if not config["enabled"]:
+            return True
+        key = proxy or DIRECT_KEY
+        now = time.time()
+        with self.lock:
+            circuit = self.circuits.get(key)
+            if circuit is None or circuit.state == CLOSED:
+                return True
+            if circuit.state == OPEN:
+                if now - circuit.opened_at < circuit.cooldown:
+                    circuit.total_rejected += 1
+                    return False
+                circuit.state = HALF_OPEN
+                circuit.probe_started = now
+                logger.info(f"[CIRCUIT] 🟡 {self._display(key)} half-open - sending probe")
+                return True
+            # HALF_OPEN: one probe at a time
+            if now - circuit.probe_started > PROBE_TIMEOUT:
+                circuit.probe_started = now
+                return True
+            circuit.total_rejected += 1
+            return False
+
+    def is_open(self, proxy):
+        """Check without taking the probe (for proxy selection)"""
+        key = proxy or DIRECT_KEY
+        with self.lock:
+            circuit = self.circuits.get(key)
+            if circuit is None or circuit.state == CLOSED:
+                return False
+            if circuit.state == OPEN:
+                return time.time() - circuit.opened_at < circuit.cooldown
+            return time.time() - circuit.probe_started <= PROBE_TIMEOUT
+
+    def record_success(self, proxy):
+        """Request through the proxy succeeded"""
+        key = proxy or DIRECT_KEY
+        with self.lock:
+            circuit = self.circuits.get(key)
+            if circuit is None:
+                return
+            circuit.total_successes += 1
+            circuit.failures = 0
+            if circuit.state != CLOSED:
+                circuit.state = CLOSED
+                circuit.trips = 0
+                circuit.probe_started = None
+                logger.info(f"[CIRCUIT] 🟢 {self._display(key)} closed - probe succeeded")
+
+    def record_failure(self, proxy):
+        """Request through the proxy failed (403/429/timeout/connection error)"""
+        config = self._get_config()
+        key = proxy or DIRECT_KEY
+        now = time.time()
+        with self.lock:
+            circuit = self.circuits.setdefault(key, _Circuit())
+            circuit.total_failures += 1
+            circuit.failures += 1
+            if circuit.state == HALF_OPEN or (circuit.state == CLOSED and circuit.failures >= config["failure_threshold"]):
+                circuit.trips += 1
+                circuit.state = OPEN
+                circuit.opened_at = now
+                circuit.probe_started = None
+                circuit.cooldown = min(config["cooldown"] * (2 ** (circuit.trips - 1)), config["max_cooldown"])
+                self.total_trips += 1
+                logger.warning(f"[CIRCUIT] 🔴 {self._display(key)} OPEN after {circuit.failures} failures "
+                               f"(cooldown {circuit.cooldown:.0f}s, trip #{circuit.trips})")
+
+    @staticmethod
+    def _display(key):
+        return f"Proxy {key[:30]}..." if len(key) > 30 else f"Proxy {key}"
+
+    def get_stats(self):
+        """Get breaker statistics"""
+        with self.lock:
+            now = time.time()
+            states = {CLOSED: 0, OPEN: 0, HALF_OPEN: 0}
+            open_circuits = []
+            for key, circuit in self.circuits.items():
+                states[circuit.state] += 1
+                if circuit.state != CLOSED:
+                    open_circuits.append({
+                        "proxy": key[:30],
+                        "state": circuit.state,
+                        "trips": circuit.trips,
+                        "retry_in_seconds": round(max(0.0, circuit.opened_at + circuit.cooldown - now), 1),
+                    })
+            return {
+                "enabled": self.config.get("enabled", True),
+                "tracked": len(self.circuits),
+                "closed": states[CLOSED],
+                "open": states[OPEN],
+                "half_open": states[HALF_OPEN],
+                "total_trips": self.total_trips,
+                "total_rejected": sum(c.total_rejected for c in self.circuits.values()),
+                "open_circuits": open_circuits,
+            }
+
+
+# Global registry instance
+_global_registry = None
+_global_registry_lock = threading.Lock()
+
+
+def get_circuit_breakers():
+    """Get or create global circuit breaker registry"""
+    global _global_registry
+    with _global_registry_lock:
+        if _global_registry is None:
+            _global_registry = CircuitBreakerRegistry()
+        return _global_registry
@@ -0,0 +1,230 @@
+"""
+Multi-node cluster mode with DB-backed query leases.
+
+Several instances (containers) can share ONE database to spread requests over
+more egress IPs. Without coordination every instance would scan every query
+and send duplicate notifications. In cluster mode (CLUSTER_MODE=True env or
+cluster_mode_enabled parameter):
+
+- Every node registers in cluster_nodes and heartbeats every few seconds
+- Queries are split with time-bounded leases (query_leases table); a node
+  renews its leases on every heartbeat and only scans queries it holds
+- Fair share = ceil(queries / alive nodes): nodes above it release leases,
+  nodes below it take free or expired ones -> automatic rebalancing when a
+  node joins, leaves or dies (its leases expire after cluster_lease_ttl)
+- Dedup is cluster-wide: items.item has a unique index and inserts use
+  ON CONFLICT DO NOTHING, so only the node that stored an item notifies
+"""
+import math
+import os
+import socket
+import threading
+import time
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Defaults for the DB parameters (seconds)
+DEFAULT_HEARTBEAT_INTERVAL = 10
+DEFAULT_LEASE_TTL = 30
+DEFAULT_NODE_TIMEOUT = 30
+
+
+def is_cluster_mode_enabled():
+    """Cluster mode is OFF unless CLUSTER_MODE env or cluster_mode_enabled parameter is True"""
+    import db
+    value = os.environ.get("CLUSTER_MODE") or db.get_parameter("cluster_mode_enabled") or "False"
+    return value == "True"
+
+
+def get_node_id():
+    """Stable id of this node (CLUSTER_NODE_ID env, otherwise hostname-pid)"""
+    node_id = os.environ.get("CLUSTER_NODE_ID")
+    if not node_id:
+        node_id = f"{socket.gethostname()}-{os.getpid()}"
+        # Shard processes (spawned later) inherit the same node id
+        os.environ["CLUSTER_NODE_ID"] = node_id
+    return node_id
+
+
+class ClusterNode:
+    """
+    This instance as a member of the cluster.
+
+    Features:
+    - Heartbeat in cluster_nodes
+    - Lease renewal, acquisition of free/expired leases up to the fair share
+    - Release of leases above the fair share (rebalancing)
+    - Graceful leave releases all leases immediately
+    """
+
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self.hostname = socket.gethostname()
+        self.started_at = time.time()
+        self._running = False
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Metrics
+        self.alive_nodes = []
+        self.owned = set()
+        self.fair_share = 0
+        self.total_heartbeats = 0
+        self.leases_acquired = 0
+        self.leases_released = 0
+        self.last_heartbeat = None
+
+    def _load_config(self):
+        import db
+        try:
+            return {
+                "heartbeat_interval": float(db.get_parameter("cluster_heartbeat_interval") or DEFAULT_HEARTBEAT_INTERVAL),
+                "lease_ttl": float(db.get_parameter("cluster_lease_ttl") or DEFAULT_LEASE_TTL),
+                "node_timeout": float(db.get_parameter("cluster_node_timeout") or DEFAULT_NODE_TIMEOUT),
+            }
+        except (ValueError, TypeError) as e:
+            logger.warning(f"[CLUSTER] Invalid cluster parameters, using defaults: {e}")
+            return {
+                "heartbeat_interval": DEFAULT_HEARTBEAT_INTERVAL,
+                "lease_ttl": DEFAULT_LEASE_TTL,
+                "node_timeout": DEFAULT_NODE_TIMEOUT,
+            }
+
+    def heartbeat(self):
+        """
+        One heartbeat: register, renew, rebalance.
+
+        Returns:
+            bool: True if the set of owned queries changed
+        """
+        import db
+        config = self._load_config()
+        now = time.time()
+        lease_expires = now + config["lease_ttl"]
+
+        db.cluster_heartbeat(self.node_id, self.hostname, self.started_at, now)
+        nodes = db.get_cluster_nodes()
+        alive = [n[0] for n in nodes if n[3] is not None and float(n[3]) >= now - config["node_timeout"]]
+        if self.node_id not in alive:
+            alive.append(self.node_id)
+
+        db.sync_query_leases()
+        db.renew_query_leases(self.node_id, lease_expires, now)
+        leases = db.get_query_leases()
+
+        fair_share = math.ceil(len(leases) / len(alive)) if leases else 0
+        owned = sorted(q for q, node, expires in leases
+                       if node == self.node_id and expires is not None and float(expires) >= now)
+        changed = False
+
+        if len(owned) > fair_share:
+            # Rebalance: give back the newest queries above our share
+            for query_id in owned[fair_share:]:
+                db.release_query_lease(query_id, self.node_id)
+                self.leases_released += 1
+                changed = True
+            logger.info(f"[CLUSTER] ⚖️ Released {len(owned) - fair_share} leases (fair share {fair_share})")
+            owned = owned[:fair_share]
+        elif len(owned) < fair_share:
+            free = [q for q, node, expires in leases
+                    if node is None or expires is None or float(expires) < now]
+            for query_id in free[:fair_share - len(owned)]:
+                if db.try_acquire_query_lease(query_id, self.node_id, lease_expires, now):
+                    owned.append(query_id)
+                    self.leases_acquired += 1
+                    changed = True
+            if changed:
+                logger.info(f"[CLUSTER] 📥 Now holding {len(owned)}/{fair_share} leases")
+
+        self.alive_nodes = alive
+        self.fair_share = fair_share
+        self.owned = set(owned)
+        self.total_heartbeats += 1
+        self.last_heartbeat = now
+        return changed
+
+    def start(self):
+        """First heartbeat synchronously (so workers start with leases), then the loop"""
+        try:
+            self.heartbeat()
+        except Exception as e:
+            logger.error(f"[CLUSTER] Initial heartbeat failed: {e}", exc_info=True)
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, name="cluster-heartbeat", daemon=True)
+        self._thread.start()
+        logger.info(f"[CLUSTER] 🚀 Node {self.node_id} joined the cluster "
+                    f"({len(self.alive_nodes)} nodes, holding {len(self.owned)} leases)")
+
+    def _loop(self):
+        while self._running:
+            interval = self._load_config()["heartbeat_interval"]
+            if self._stop.wait(timeout=interval):
+                return
+            try:
+                if self.heartbeat():
+                    import core
+                    core.request_worker_reconcile()
+            except Exception as e:
+                logger.error(f"[CLUSTER] Heartbeat failed: {e}", exc_info=True)
+
+    def leave(self):
+        """Graceful leave - leases are released for the other nodes immediately"""
+        import db
+        self._running = False
+        self._stop.set()
+        db.remove_cluster_node(self.node_id)
+        logger.info(f"[CLUSTER] 👋 Node {self.node_id} left the cluster")
+
+    def get_stats(self):
+        """Get cluster membership statistics"""
+        return {
+            "node_id": self.node_id,
+            "alive_nodes": self.alive_nodes,
+            "fair_share": self.fair_share,
+            "owned_queries": sorted(self.owned),
+            "total_heartbeats": self.total_heartbeats,
+            "leases_acquired": self.leases_acquired,
+            "leases_released": self.leases_released,
+            "last_heartbeat": self.last_heartbeat,
+        }
+
+
+# Global cluster node (coordinator process only)
+_cluster_node = None
+# Last known lease set per process (used if the DB is briefly unavailable)
+_owned_cache = None
+
+
+def start_cluster_node():
+    """Join the cluster (coordinator side)"""
+    global _cluster_node
+    if _cluster_node is None:
+        # Shard processes (spawned later) inherit cluster mode via env
+        os.environ["CLUSTER_MODE"] = "True"
+        _cluster_node = ClusterNode(get_node_id())
+        _cluster_node.start()
+    return _cluster_node
+
+
+def get_cluster_node():
+    """Get the cluster node, or None if cluster mode is off"""
+    return _cluster_node
+
+
+def get_owned_query_ids():
+    """
+    Query ids this node may scan (any process of the node).
+
+    Returns:
+        set or None: Leased query ids, or None if cluster mode is off (scan everything)
+    """
+    global _owned_cache
+    if _cluster_node is None and os.environ.get("CLUSTER_MODE") != "True":
+        return None
+    import db
+    owned = db.get_owned_query_ids(get_node_id(), time.time())
+    if owned is None:
+        return _owned_cache or set()
+    _owned_cache = owned
+    return owned
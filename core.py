@@ -1,10 +1,24 @@
 import db, configuration_values, requests
 from pyVintedVN import Vinted, requester
+from pyVintedVN.items.item import Item
+from pyVintedVN.settings import Urls
+from seen_items import get_seen_items_tracker
+from adaptive_refresh import get_adaptive_refresh_controller, is_adaptive_refresh_enabled
+from circuit_breaker import get_circuit_breakers
+from query_coalescing import plan_query_groups, is_query_coalescing_enabled, get_coalescing_stats
+from cluster import get_owned_query_ids
+from filter_engine import get_filter_engine
+from seller_country import get_seller_country_filter
+from hedged_requests import get_hedge_controller
+from early_exit_parser import get_early_exit_parser
+from scan_scheduler import spread_phase
 from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
 from logger import get_logger
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
+import heapq
+import queue as queue_module
 import threading
+from collections import deque
 from datetime import datetime, timezone, timedelta
 
 # Get logger for this module
@@ -18,18 +32,45 @@ _worker_stats_lock = threading.Lock()
 _active_workers_count = 0
 _active_workers_lock = threading.Lock()
 
+# Shard of THIS process in multi-process mode: (shard_index, shard_count), None = all slots
+_worker_shard = None
+
+
+def set_worker_shard(shard_index, shard_count):
+    """Restrict this process to the slots of one shard (worker_sharding.py)"""
+    global _worker_shard
+    _worker_shard = (shard_index, shard_count) if shard_count > 1 else None
+
+
+def get_worker_shard():
+    """Shard of this process: (shard_index, shard_count), None in single-process mode"""
+    return _worker_shard
+
+
+def is_own_shard(key):
+    """Check if a slot key (query id / group leader id) belongs to this process"""
+    if _worker_shard is None:
+        return True
+    shard_index, shard_count = _worker_shard
+    return key % shard_count == shard_index
+
+
+def _new_worker_stats():
+    return {
+        'last_success': None,
+        'last_error': None,
+        'total_scans': 0,
+        'total_items': 0,
+        'total_errors': 0,
+        'recent_scans': []  # Last 3 scans
+    }
+
+
 def update_worker_stats(worker_id, status, items_count=0):
     """Update global worker statistics"""
     with _worker_stats_lock:
         if worker_id not in _worker_stats:
-            _worker_stats[worker_id] = {
-                'last_success': None,
-                'last_error': None,
-                'total_scans': 0,
-                'total_items': 0,
-                'total_errors': 0,
-                'recent_scans': []  # Last 3 scans
-            }
+            _worker_stats[worker_id] = _new_worker_stats()
         
         stats = _worker_stats[worker_id]
         stats['total_scans'] += 1
@@ -48,11 +89,44 @@ def update_worker_stats(worker_id, status, items_count=0):
         # Keep only last 3 scans
         stats['recent_scans'] = stats['recent_scans'][-3:]
 
+def restore_worker_stats(totals):
+    """Add the totals handed over by the previous process (graceful shutdown snapshot)"""
+    with _worker_stats_lock:
+        for worker_id, saved in totals.items():
+            stats = _worker_stats.setdefault(worker_id, _new_worker_stats())
+            for key in ('total_scans', 'total_items', 'total_errors'):
+                stats[key] += saved.get(key, 0)
+
+
 def get_worker_stats():
     """Get worker statistics for all workers"""
     with _worker_stats_lock:
         return dict(_worker_stats)
 
+# Catch-up deep scans (page overflow) statistics
+_catchup_stats = {
+    'overflow_scans': 0,      # page 1 was full and entirely new
+    'extra_pages': 0,         # additional pages fetched
+    'items_recovered': 0,     # new items found beyond page 1
+    'truncated_scans': 0,     # catch-up stopped while still overflowing (page limit / budget)
+    'items_missed_estimate': 0,  # lower bound: one full page per truncated scan
+    'budget_skips': 0,        # catch-up pages skipped because the rate limiter had no capacity
+}
+_catchup_stats_lock = threading.Lock()
+
+
+def record_catchup(**counters):
+    """Add to the catch-up statistics"""
+    with _catchup_stats_lock:
+        for key, value in counters.items():
+            _catchup_stats[key] += value
+
+
+def get_catchup_stats():
+    """Get catch-up deep scan statistics"""
+    with _catchup_stats_lock:
+        return dict(_catchup_stats)
+
 def increment_active_workers():
     """Increment active workers counter"""
     global _active_workers_count
@@ -164,6 +238,7 @@ def process_query(query, name=None, thread_id=None):
     else:
         # add the query to the db
         db.add_query_to_db(processed_query, name, thread_id)
+        request_worker_reconcile()
         return "Query added.", True
 
 def get_formatted_query_list():
@@ -206,6 +281,7 @@ def process_remove_query(query_id):
     """
     if query_id == "all":
         db.remove_all_queries_from_db()
+        request_worker_reconcile()
         return "All queries removed.", True
 
     # Validate query_id
@@ -216,6 +292,7 @@ def process_remove_query(query_id):
 
     # Remove the query from the database
     db.remove_query_from_db(query_id)
+    request_worker_reconcile()
     return "Query removed.", True
 
 
@@ -246,6 +323,7 @@ def process_add_country(country):
 
     # Add the country to the allowlist
     db.add_to_allowlist(country.upper())
+    get_seller_country_filter().invalidate()
     return "Country added.", db.get_allowlist()
 
 
@@ -270,6 +348,7 @@ def process_remove_country(country):
 
     # Remove the country from the allowlist
     db.remove_from_allowlist(country.upper())
+    get_seller_country_filter().invalidate()
     return "Country removed.", db.get_allowlist()
 
 
@@ -287,13 +366,13 @@ def get_user_country(profile_id):
         str: The user's country code (2-letter ISO code) or "XX" if it can't be determined
     """
     # Users are shared between all Vinted platforms, so we can use whatever locale we want
-    url = f"https://www.vinted.fr/api/v2/users/{profile_id}?localize=false"
+    url = f"{Urls.base_url('www.vinted.fr')}/api/v2/users/{profile_id}?localize=false"
     response = requester.get(url)
     # That's a LOT of requests, so if we get a 429 we wait a bit before retrying once
     if response.status_code == 429:
         # In case of rate limit, we're switching the endpoint. This one is slower, but it doesn't RL as soon. 
         # We're limiting the items per page to 1 to grab as little data as possible
-        url = f"https://www.vinted.fr/api/v2/users/{profile_id}/items?page=1&per_page=1"
+        url = f"{Urls.base_url('www.vinted.fr')}/api/v2/users/{profile_id}/items?page=1&per_page=1"
         response = requester.get(url)
         try:
             user_country = response.json()["items"][0]["user"]["country_iso_code"]
@@ -305,83 +384,316 @@ def get_user_country(profile_id):
     return user_country
 
 
-def continuous_query_worker(query, queue, worker_index=0, start_delay=0, priority_worker_num=None):
+class CompiledSearchCache:
     """
-    Continuous worker that processes a SINGLE query independently.
-    Each query has its own worker running in a separate thread.
-    
-    This implements TRUE parallel processing:
-    - Query #1: scans every X sec independently with UNIQUE token & User-Agent
-    - Query #2: scans every X sec independently with UNIQUE token & User-Agent
-    - Query #N: scans every X sec independently with UNIQUE token & User-Agent
-    
-    Priority queries get 3 workers scanning every 20 seconds.
-    Normal queries get 1 worker scanning at default interval.
-    
-    Refresh delay is read from DB DYNAMICALLY on each cycle,
+    Compiled catalog searches (API URL, params, headers) per query id.
+
+    Query URLs don't change between scans: a search is compiled on the first
+    scan of a query (per page size and page) and again only after
+    invalidate() (queries edited) or when the slot's URL differs.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.hits = 0
+        self.compiles = 0
+
+    def get(self, items, query_id, url, nbr_items, page=1):
+        """
+        Args:
+            items: Items instance used to compile a missing entry
+            query_id: Query (or group leader) the search belongs to
+            url: Current search URL of the slot
+
+        Returns:
+            CompiledSearch: Cached or freshly compiled search
+        """
+        key = (query_id, nbr_items, page)
+        with self.lock:
+            compiled = self.entries.get(key)
+            if compiled is not None and compiled.url == url:
+                self.hits += 1
+                return compiled
+        compiled = items.compile_search(url, nbr_items=nbr_items, page=page)
+        with self.lock:
+            self.entries[key] = compiled
+            self.compiles += 1
+        return compiled
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self):
+        with self.lock:
+            return {"cached_searches": len(self.entries), "hits": self.hits, "compiles": self.compiles}
+
+
+_compiled_searches = CompiledSearchCache()
+
+
+def get_compiled_search_stats():
+    """Get compiled search cache statistics"""
+    return _compiled_searches.get_stats()
+
+
+class QueryScanWorker:
+    """
+    Scan slot that processes a SINGLE query with its own Token+Proxy pair.
+
+    The central ScanScheduler (scan_scheduler.py) calls scan_once() every time
+    this slot is due - the worker itself never sleeps between scans.
+
+    - Query #1: scanned every X sec with UNIQUE token & User-Agent
+    - Query #2: scanned every X sec with UNIQUE token & User-Agent
+    - Query #N: scanned every X sec with UNIQUE token & User-Agent
+
+    Priority queries get 6 slots (phase-locked 10s apart, 60s period each).
+    Normal queries get 1 slot scanning at default interval.
+
+    Refresh delay is read from DB DYNAMICALLY on each scan,
     so changes in Web UI apply immediately without restart!
-    
-    Args:
-        query: Single query tuple from database
-        queue: Queue to put the items in
-        worker_index: Sequential worker index (0, 1, 2...) for token assignment and stats
-        start_delay: Delay before starting (for staggered priority workers)
-        priority_worker_num: Priority worker number (1, 2, or 3) if this is a priority query worker
-    """
-    query_id = query[0]  # Database ID (may not be sequential!) - used for DB operations
-    query_url = query[1]
-    
-    # Worker name for logging
-    worker_name = f"[WORKER #Q{query_id}" + (f"-P{priority_worker_num}]" if priority_worker_num else "]")
-    
-    # Add delay for staggered start (priority workers)
-    if start_delay > 0:
-        logger.info(f"{worker_name} Waiting {start_delay:.1f}s before start (staggered)")
-        time.sleep(start_delay)
-    
-    logger.info(f"{worker_name} 🚀 Started - will use unique token & User-Agent")
-    if priority_worker_num:
-        logger.info(f"{worker_name} ⚡ Priority worker #{priority_worker_num}/3 - scanning every 20s")
-    logger.info(f"{worker_name} 📊 Worker lifecycle: STARTED")
-    
-    # Get dedicated session from token pool for THIS worker
-    from token_pool import get_token_pool
-    token_pool = get_token_pool()
-    
-    # Retry getting token up to 5 times (tokens might not be ready yet)
-    token_session = None
-    for retry in range(5):
-        token_session = token_pool.get_session_for_worker(worker_index)  # Use worker_index, not query_id!
-        if token_session:
-            break
-        logger.warning(f"[WORKER #{query_id}] Failed to get session, retry {retry+1}/5 in 2s...")
-        time.sleep(2)
-    
-    if not token_session:
-        logger.error(f"[WORKER #{query_id}] ❌ CRITICAL: Failed to get session after 5 retries! Worker TERMINATED!")
-        decrement_active_workers()  # Worker failed to start
-        return
-    
-    logger.info(f"[WORKER #{query_id}] Got session #{token_session.session_id} with UA: {token_session.user_agent[:50]}...")
-    
-    # Worker successfully started!
-    increment_active_workers()
-    
-    # Create Vinted instance for THIS worker (will use its own session)
-    vinted = Vinted(session=token_session.session)
-    logger.info(f"[WORKER #{query_id}] Created Vinted instance with dedicated session")
-    
-    while True:
+    """
+
+    def __init__(self, query, queue, worker_index=0, priority_worker_num=None, group=None):
+        """
+        Args:
+            query: Single query tuple from database (leader query for a coalesced group)
+            queue: Queue to put the items in
+            worker_index: Sequential worker index (0, 1, 2...) for token assignment and stats
+            priority_worker_num: Priority worker number (1-6) if this is a priority query worker
+            group: QueryGroup if this slot scans several coalesced queries with ONE request
+        """
+        self.query = query
+        self.query_id = query[0]  # Database ID (may not be sequential!) - used for DB operations
+        self.group = group
+        self.query_url = group.url if group else query[1]
+        self.queue = queue
+        self.worker_index = worker_index
+        self.priority_worker_num = priority_worker_num
+
+        # Worker name for logging
+        if group:
+            self.worker_name = f"[WORKER #G{self.query_id}x{len(group.members)}]"
+        else:
+            self.worker_name = f"[WORKER #Q{self.query_id}" + (f"-P{priority_worker_num}]" if priority_worker_num else "]")
+
+        self.token_pool = None
+        self.token_session = None
+        self.vinted = None
+        self.stopped = False
+
+        # Supervision: heartbeat after every scan, start time of the scan in flight
+        self.created_at = time.time()
+        self.last_heartbeat = None
+        self.scan_started_at = None
+        self.session_failures = 0
+
+    def stop(self):
+        """Retire this slot (query removed/edited) - pending scans become no-ops"""
+        if self.stopped:
+            return
+        self.stopped = True
+        if self.vinted is not None:
+            # Worker was counted as active in _ensure_session()
+            decrement_active_workers()
+        logger.info(f"{self.worker_name} 📊 Worker lifecycle: STOPPED")
+
+    def release_session(self):
+        """
+        Give up this slot's Token+Proxy pair (worker replaced by the supervisor).
+        The pair is retired in the pool, so the replacement gets a fresh one at
+        the slot's index instead of sharing it with a scan still hanging here.
+        """
+        if self.token_session is not None and self.token_pool is not None:
+            self.token_pool.retire_session(self.token_session)
+
+    def _fresh_pair(self):
+        """Fresh Token+Proxy pair at this slot's index (None once retired - the slot has a new owner)"""
+        if self.stopped:
+            return None
+        return self.token_pool.create_fresh_pair(self.worker_index)
+
+    def _ensure_session(self):
+        """Get dedicated session from token pool for THIS worker (first scan only)"""
+        if self.token_session:
+            return True
+
+        from token_pool import get_token_pool
+        self.token_pool = get_token_pool()
+
+        # Retry getting token up to 5 times (tokens might not be ready yet)
+        for retry in range(5):
+            self.token_session = self.token_pool.get_session_for_worker(self.worker_index)  # Use worker_index, not query_id!
+            if self.token_session:
+                break
+            logger.warning(f"[WORKER #{self.query_id}] Failed to get session, retry {retry+1}/5 in 2s...")
+            time.sleep(2)
+
+        if not self.token_session:
+            self.session_failures += 1
+            logger.error(f"[WORKER #{self.query_id}] ❌ Failed to get session after 5 retries! Will retry on next slot")
+            return False
+        self.session_failures = 0
+
+        logger.info(f"[WORKER #{self.query_id}] Got session #{self.token_session.session_id} with UA: {self.token_session.user_agent[:50]}...")
+
+        # Worker successfully started!
+        increment_active_workers()
+        logger.info(f"{self.worker_name} 📊 Worker lifecycle: STARTED")
+
+        # Create Vinted instance for THIS worker (will use its own session)
+        self.vinted = Vinted(session=self.token_session.session)
+        logger.info(f"[WORKER #{self.query_id}] Created Vinted instance with dedicated session")
+        return True
+
+    def _dispatch_items(self, items):
+        """Put scanned items into the queue - a coalesced group fans them out to its member queries"""
+        if self.group is None:
+            if items:
+                self.queue.put((items, self.query_id))
+            return
+        for member in self.group.members:
+            member_items = member.filter_items(items or [])
+            if member_items:
+                self.queue.put((member_items, member.query_id))
+        get_coalescing_stats().record_group_scan(self.group)
+
+    def _catch_up(self, items, items_per_query):
+        """
+        Catch-up deep scan: if page 1 is full and ENTIRELY newer than the query
+        watermark, more new items may sit on the next pages (after restarts, bans
+        or on busy queries). Fetch further pages up to catchup_max_pages while
+        the rate limiter has spare capacity.
+
+        Args:
+            items: Raw catalog items of page 1 (API dicts)
+            items_per_query: Page size of the scan
+
+        Returns:
+            list: Page 1 items plus new items from the extra pages (raw dicts)
+        """
+        watermark = get_seen_items_tracker().get_watermark(self.query_id)
+        if watermark is None or not items or len(items) < items_per_query:
+            return items
+        if any(item["id"] <= watermark for item in items):
+            return items
+
+        max_pages = int(db.get_parameter("catchup_max_pages") or 3)
+        if max_pages <= 1:
+            record_catchup(overflow_scans=1, truncated_scans=1, items_missed_estimate=items_per_query)
+            return items
+
+        from rate_limiter import get_rate_limiter
+        rate_limiter = get_rate_limiter()
+        locale = urlparse(self.query_url).netloc
+        session = self.token_session.session
+        # Same bucket key as Items.search()
+        proxy = session.proxies.get("https") if session.proxies else None
+        all_items = list(items)
+        extra_pages = 0
+        overflowing = True
+        budget_skip = False
+        page = 2
+        while overflowing and page <= max_pages:
+            if not rate_limiter.has_capacity(domain=locale, proxy=proxy):
+                budget_skip = True
+                break
+            result = self.vinted.items.search(self._compiled_search(items_per_query, page), json=True)
+            if isinstance(result, tuple):
+                # HTTP error - the regular scan path handles the pair next time
+                logger.warning(f"{self.worker_name} Catch-up page {page} failed with HTTP {result[1]}")
+                break
+            extra_pages += 1
+            fresh = [item for item in result if item["id"] > watermark]
+            all_items.extend(fresh)
+            overflowing = len(result) >= items_per_query and len(fresh) == len(result)
+            page += 1
+
+        recovered = len(all_items) - len(items)
+        truncated = overflowing
+        record_catchup(overflow_scans=1, extra_pages=extra_pages, items_recovered=recovered,
+                       truncated_scans=1 if truncated else 0,
+                       items_missed_estimate=items_per_query if truncated else 0,
+                       budget_skips=1 if budget_skip else 0)
+        logger.info(f"{self.worker_name} 📚 Page overflow: catch-up fetched {extra_pages} extra pages, "
+                    f"{recovered} more new items" + (" (still overflowing - some items missed)" if truncated else ""))
+        return all_items
+
+    def _compiled_search(self, nbr_items, page=1):
+        """Compiled search of this slot's query - the URL is parsed once, not on every scan"""
+        return _compiled_searches.get(self.vinted.items, self.query_id, self.query_url, nbr_items, page)
+
+    def _record_arrivals(self, items):
+        """
+        Count items not seen before and feed the adaptive refresh estimator.
+
+        Returns:
+            list or None: Ids not seen before, None for the baseline (first) scan
+        """
+        new_ids = get_seen_items_tracker().observe(self.query_id, [item["id"] for item in items or []])
+        # Baseline (first) scan only starts the clock
+        get_adaptive_refresh_controller().record_scan(self.query_id, len(new_ids) if new_ids is not None else None)
+        return new_ids
+
+    def _process_scan_result(self, raw_items, items_per_query):
+        """
+        Catch-up, dedup on the raw data, then build Item objects ONLY for new listings.
+
+        Most scanned items were already seen on the previous scan - building a
+        full Item for them (buy_url, datetime, ...) just to drop it in the
+        item processor was wasted work. Baseline scans keep every item (the
+        item processor still dedups against the items table).
+
+        With early-exit parsing raw_items may hold only the page's new items
+        (PartialPage, the seen rest was never decoded) - scanned is then the
+        page size the parser reported.
+
+        Returns:
+            tuple: (number of scanned items, list of new Item objects that were queued)
+        """
+        scanned = getattr(raw_items, "scanned", None)
+        raw_items = self._catch_up(raw_items, items_per_query)
+        new_ids = self._record_arrivals(raw_items)
+        if new_ids is None:
+            items = [Item(data) for data in raw_items]
+        else:
+            new_ids = set(new_ids)
+            items = [Item(data) for data in raw_items if data["id"] in new_ids]
+        self._dispatch_items(items)
+        return scanned if scanned is not None else len(raw_items), items
+
+    def scan_once(self):
+        """
+        Perform ONE scan of this worker's query.
+
+        Returns:
+            int: Period in seconds until this slot is due again (None if the slot was stopped)
+        """
+        if self.stopped:
+            return None
+        self.scan_started_at = time.time()
+        try:
+            return self._scan()
+        finally:
+            self.scan_started_at = None
+            self.last_heartbeat = time.time()
+
+    def _scan(self):
+        """Body of scan_once() (heartbeat is recorded by the caller)"""
+        query_id = self.query_id
+        worker_name = self.worker_name
+        worker_index = self.worker_index
+
         start_time = time.time()
         
         # 🔥 ДИНАМИЧЕСКАЯ проверка priority status из БД (может измениться в Web UI!)
-        current_query_data = None
         is_priority = False
         try:
             all_queries = db.get_queries_with_priority()
             for q in all_queries:
                 if q[0] == query_id:
-                    current_query_data = q
                     # Check is_priority if field exists (len > 5)
                     if len(q) > 5:
                         is_priority = bool(q[5])
@@ -389,51 +701,82 @@ def continuous_query_worker(query, queue, worker_index=0, start_delay=0, priorit
         except Exception as e:
             logger.debug(f"{worker_name} Failed to get priority status: {e}")
         
-        # 🔥 КРИТИЧНО: refresh_delay определяется ЗДЕСЬ, ДО try-except
         # Priority queries: 60s fixed (6 workers × 10s rotation), Normal queries: from config
         if is_priority:
             refresh_delay = 60  # Fixed 60s for priority queries (6 workers rotate every 10s)
         else:
             refresh_delay = int(db.get_parameter("query_refresh_delay") or 60)
+            # Adaptive interval from observed arrival rate: busy queries faster, idle ones slower
+            if is_adaptive_refresh_enabled():
+                refresh_delay = int(round(get_adaptive_refresh_controller().get_interval(query_id, refresh_delay)))
+
+        if not self._ensure_session():
+            return refresh_delay
+
+        token_pool = self.token_pool
         
         items_per_query = int(db.get_parameter("items_per_query") or 20)
+        if self.group:
+            # Broader request of a coalesced group returns more items
+            items_per_query = self.group.per_page(items_per_query)
         
         # Log mode (priority or normal)
         mode_str = f"⚡ Priority mode ({refresh_delay}s)" if is_priority else f"Normal mode ({refresh_delay}s)"
         logger.debug(f"{worker_name} {mode_str}")
         
         # 🔥 НОВОЕ: Автоматическая ротация каждые 5 сканов (профилактика)
-        if token_session.needs_rotation(rotation_interval=5):
-            logger.info(f"{worker_name} 🔄 Auto-rotation: {token_session.scan_count} scans completed, getting fresh Token+Proxy pair...")
-            new_session = token_pool.create_fresh_pair(worker_index)
+        if self.token_session.needs_rotation(rotation_interval=5):
+            logger.info(f"{worker_name} 🔄 Auto-rotation: {self.token_session.scan_count} scans completed, getting fresh Token+Proxy pair...")
+            new_session = self._fresh_pair()
             if new_session:
-                token_session = new_session
-                vinted = Vinted(session=token_session.session)
-                logger.info(f"[WORKER #{query_id}] ✅ Auto-rotation complete: New session #{token_session.session_id}")
+                self.token_session = new_session
+                self.vinted = Vinted(session=self.token_session.session)
+                logger.info(f"[WORKER #{query_id}] ✅ Auto-rotation complete: New session #{self.token_session.session_id}")
             else:
                 # Auto-rotation failed (probably 403 global ban)
                 # Reset counter to wait another 5 cycles before retry
-                token_session.scan_count = 0
+                self.token_session.scan_count = 0
                 logger.error(f"[WORKER #{query_id}] ❌ Auto-rotation failed, continuing with old session (will retry in 5 scans)")
         
         # 🔥 КРИТИЧНО: Проверяем токен ПЕРЕД каждым сканированием!
         # Если токен стал невалидным - заменяем его
-        elif not token_session.is_valid:
+        elif not self.token_session.is_valid:
             logger.warning(f"[WORKER #{query_id}] Token invalid - getting fresh Token+Proxy pair...")
-            new_session = token_pool.create_fresh_pair(worker_index)
+            new_session = self._fresh_pair()
             if new_session:
-                token_session = new_session
-                vinted = Vinted(session=token_session.session)
-                logger.info(f"[WORKER #{query_id}] ✅ Got fresh pair: session #{token_session.session_id}")
+                self.token_session = new_session
+                self.vinted = Vinted(session=self.token_session.session)
+                logger.info(f"[WORKER #{query_id}] ✅ Got fresh pair: session #{self.token_session.session_id}")
             else:
                 # Failed to create new pair - continue with invalid session (will try again next cycle)
                 logger.error(f"[WORKER #{query_id}] ❌ Failed to get fresh pair, continuing with invalid session")
         
+        # Circuit breaker: a pair whose proxy is known to be bad is skipped instantly
+        if not get_circuit_breakers().allow(self.token_session.proxy):
+            logger.info(f"{worker_name} ⛔ Circuit open for current proxy - switching to a fresh Token+Proxy pair")
+            new_session = self._fresh_pair()
+            if not new_session:
+                logger.warning(f"{worker_name} ⛔ No pair with a healthy proxy available - skipping this scan")
+                return refresh_delay
+            self.token_session = new_session
+            self.vinted = Vinted(session=self.token_session.session)
+        
         try:
             # Scan this query using THIS worker's dedicated Vinted instance
             logger.debug(f"[WORKER #{query_id}] 🔍 Starting Vinted API request...")
-            search_result = vinted.items.search(query_url, nbr_items=items_per_query)
+            if is_priority:
+                # Priority scans: a slow primary is hedged via another Token+Proxy pair
+                search_result = get_hedge_controller().search(self.vinted.items, self._compiled_search(items_per_query),
+                                                              self.token_session, token_pool, seen_key=query_id)
+            else:
+                # seen_key: items this query has already seen are not decoded (early-exit parsing)
+                search_result = self.vinted.items.search(self._compiled_search(items_per_query), json=True,
+                                                         seen_key=query_id)
             logger.debug(f"[WORKER #{query_id}] ✅ Vinted API request completed")
+            if self.stopped:
+                # Replaced while the request hung - the new worker owns the slot and its items
+                logger.info(f"{worker_name} Retired during the scan - dropping its result")
+                return refresh_delay
 
             elapsed = time.time() - start_time
 
@@ -455,7 +798,7 @@ def continuous_query_worker(query, queue, worker_index=0, start_delay=0, priorit
                     logger.warning(f"[WORKER #{query_id}] 429 error reported to redeploy system")
 
                 # Report error to token pool as well
-                token_pool.report_error(token_session)
+                token_pool.report_error(self.token_session, status_code)
 
                 # Update worker stats (error) - use worker_index for correct counting
                 update_worker_stats(worker_index, 'error')
@@ -469,28 +812,30 @@ def continuous_query_worker(query, queue, worker_index=0, start_delay=0, priorit
                     for retry_attempt in range(3):
                         # Получаем НОВУЮ ПАРУ (Token + Proxy)
                         logger.info(f"[WORKER #{query_id}] 🔑 Getting fresh Token+Proxy pair (retry {retry_attempt + 1}/3)...")
-                        new_session = token_pool.create_fresh_pair(worker_index)  # Fresh pair!
+                        new_session = self._fresh_pair()  # Fresh pair!
                         
                         if not new_session:
-                            logger.warning(f"[WORKER #{query_id}] Failed to get fresh pair for retry {retry_attempt + 1}/3")
-                            time.sleep(1)  # Короткая пауза перед следующей попыткой
-                            continue
+                            # Нет здоровой пары (открытые circuits / bootstrap не прошёл) - следующие попытки
+                            # упрутся в то же самое, повторим на следующем скане
+                            logger.warning(f"[WORKER #{query_id}] Failed to get fresh pair for retry {retry_attempt + 1}/3 - giving up retries")
+                            break
                         
                         # Обновляем токен и сессию
-                        token_session = new_session
-                        vinted = Vinted(session=token_session.session)
-                        logger.info(f"[WORKER #{query_id}] ✅ Got new token #{token_session.session_id}, retrying request...")
+                        self.token_session = new_session
+                        self.vinted = Vinted(session=self.token_session.session)
+                        logger.info(f"[WORKER #{query_id}] ✅ Got new token #{self.token_session.session_id}, retrying request...")
                         
                         # Повторяем запрос с новым токеном
                         retry_start = time.time()
-                        retry_result = vinted.items.search(query_url, nbr_items=items_per_query)
+                        retry_result = self.vinted.items.search(self._compiled_search(items_per_query), json=True,
+                                                                seen_key=query_id)
                         retry_elapsed = time.time() - retry_start
                         
                         # Проверяем результат retry
                         if isinstance(retry_result, tuple) and len(retry_result) == 2:
                             retry_response, retry_status = retry_result
                             logger.warning(f"[WORKER #{query_id}] Retry {retry_attempt + 1}/3 failed with HTTP {retry_status} ({retry_elapsed:.2f}s)")
-                            token_pool.report_error(token_session)
+                            token_pool.report_error(self.token_session, retry_status)
                             
                             # Если снова 403/401 - пробуем следующий токен
                             if retry_status in (403, 401):
@@ -504,64 +849,62 @@ def continuous_query_worker(query, queue, worker_index=0, start_delay=0, priorit
                             elapsed = retry_elapsed
                             retry_success = True
                             logger.info(f"[WORKER #{query_id}] 🎉 Retry successful with new token after {retry_elapsed:.2f}s!")
-                            token_pool.report_success(token_session)
+                            token_pool.report_success(self.token_session)
                             break
                     
                     # Если retry успешен - обрабатываем результат как обычно (переходим к блоку else ниже)
                     if not retry_success:
-                        logger.error(f"[WORKER #{query_id}] ❌ All 3 retry attempts failed - will wait {refresh_delay}s before next scan")
+                        logger.error(f"[WORKER #{query_id}] ❌ Retry with a fresh pair failed - will wait {refresh_delay}s before next scan")
                     else:
                         # Перенаправляем в success блок
-                        all_items = search_result
-                        token_pool.report_success(token_session)
+                        token_pool.report_success(self.token_session)
                         from railway_redeploy import report_success
                         report_success()
+                        scanned, new_items = self._process_scan_result(search_result, items_per_query)
                         
-                        if all_items:
-                            queue.put((all_items, query_id))
-                            logger.info(f"[WORKER #{query_id}] ✅ Found {len(all_items)} items after retry in {elapsed:.2f}s (next scan in {refresh_delay}s)")
-                            update_worker_stats(worker_index, 'success', len(all_items))
+                        if scanned:
+                            logger.info(f"[WORKER #{query_id}] ✅ Found {scanned} items ({len(new_items)} new) after retry in {elapsed:.2f}s (next scan in {refresh_delay}s)")
+                            update_worker_stats(worker_index, 'success', scanned)
                         else:
                             logger.info(f"[WORKER #{query_id}] 📭 No new items after retry ({elapsed:.2f}s, next scan in {refresh_delay}s)")
                             update_worker_stats(worker_index, 'success', 0)
                         
                         # 🔥 Инкрементируем счетчик сканов после успешного retry
-                        token_session.increment_scan()
-                        logger.debug(f"[WORKER #{query_id}] Scan counter after retry: {token_session.scan_count}/5")
+                        self.token_session.increment_scan()
+                        logger.debug(f"[WORKER #{query_id}] Scan counter after retry: {self.token_session.scan_count}/5")
                 else:
                     # Для 429 и других ошибок - просто ждем refresh_delay
                     logger.error(f"[WORKER #{query_id}] ❌ HTTP {status_code} error after {elapsed:.2f}s - will retry in {refresh_delay}s")
             else:
-                # Successful scan - got items list
-                all_items = search_result
+                # Successful scan - got raw items list
 
                 # Report successful request to token pool AND redeploy system
-                token_pool.report_success(token_session)
+                token_pool.report_success(self.token_session)
 
                 # Report success to redeploy system for success streak
                 from railway_redeploy import report_success
                 report_success()
 
-                # Put items into queue
-                if all_items:
-                    queue.put((all_items, query_id))
-                    logger.info(f"[WORKER #{query_id}] ✅ Found {len(all_items)} items in {elapsed:.2f}s (next scan in {refresh_delay}s)")
+                # Dedup, then put NEW items into queue (fanned out to members for a coalesced group)
+                scanned, new_items = self._process_scan_result(search_result, items_per_query)
+                if scanned:
+                    logger.info(f"[WORKER #{query_id}] ✅ Found {scanned} items ({len(new_items)} new) in {elapsed:.2f}s (next scan in {refresh_delay}s)")
                     # Update worker stats - use worker_index for correct counting
-                    update_worker_stats(worker_index, 'success', len(all_items))
+                    update_worker_stats(worker_index, 'success', scanned)
                 else:
                     logger.info(f"[WORKER #{query_id}] 📭 No new items ({elapsed:.2f}s, next scan in {refresh_delay}s)")
                     # Update worker stats (successful scan, but no items) - use worker_index
                     update_worker_stats(worker_index, 'success', 0)
                 
                 # 🔥 НОВОЕ: Инкрементируем счетчик сканов (для автоматической ротации)
-                token_session.increment_scan()
-                logger.debug(f"[WORKER #{query_id}] Scan counter: {token_session.scan_count}/5")
+                self.token_session.increment_scan()
+                logger.debug(f"[WORKER #{query_id}] Scan counter: {self.token_session.scan_count}/5")
 
         except Exception as e:
             elapsed = time.time() - start_time
             
-            # Report error to token pool
-            token_pool.report_error(token_session)
+            # Report error to token pool (only network errors count against the proxy)
+            token_pool.report_error(self.token_session, error=e)
 
             # Update worker stats (error) - use worker_index for correct counting
             update_worker_stats(worker_index, 'error')
@@ -575,36 +918,505 @@ def continuous_query_worker(query, queue, worker_index=0, start_delay=0, priorit
             # Token pool automatically replaces invalid tokens on next get_session_for_worker() call
             # No need to manually check is_valid here - will be checked on next iteration
         
-        # 🔥 КРИТИЧНО: Sleep ВСЕГДА с одинаковой задержкой
-        # refresh_delay определен ДО try-except, поэтому ВСЕГДА доступен
-        time.sleep(refresh_delay)
+        # Scheduler computes the next deadline from THIS slot's previous deadline
+        # (not from the end of the scan) - no drift!
+        return refresh_delay
+
+
+class WorkerReconciler:
+    """
+    Keeps scan slots in sync with the queries table - no restart needed.
+
+    Every reconcile pass diffs the queries table against running slots:
+    - New query        -> start slots (1 normal / 6 priority)
+    - Removed query    -> stop its slots (no zombie scans)
+    - URL edited       -> restart its slots with the new URL
+    - Priority toggled -> resize 1 <-> 6 slots
+    - Coalescing plan changed -> restart the affected group slots
+    Token pool capacity follows the number of slots.
+
+    Passes run every query_reconcile_interval seconds and immediately
+    when request_worker_reconcile() is called (Web UI / Telegram changes).
+    """
+
+    def __init__(self, scheduler, queue):
+        self.scheduler = scheduler
+        self.queue = queue
+        # query_id (leader id for a coalesced group) -> {"signature", "is_priority", "group", "workers": [QueryScanWorker]}
+        self.slots = {}
+        self.free_indexes = []  # heap of released worker indexes (reused -> token indexes stay compact)
+        self.next_index = 0
+        self.lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+
+        # Metrics
+        self.total_reconciles = 0
+        self.queries_started = 0
+        self.queries_stopped = 0
+        self.queries_resized = 0
+        self.queries_restarted = 0
+        self.last_reconcile = None
+        self.last_changes = {}
+
+    def _allocate_index(self):
+        if self.free_indexes:
+            return heapq.heappop(self.free_indexes)
+        index = self.next_index
+        self.next_index += 1
+        return index
+
+    def _release_index(self, index):
+        heapq.heappush(self.free_indexes, index)
+        with _worker_stats_lock:
+            _worker_stats.pop(index, None)
+
+    def _start_query(self, query, is_priority, anchor, group=None):
+        """Create and schedule the slots of one query (or of one coalesced group)"""
+        query_id = query[0]
+        workers = []
+        if is_priority:
+            # 6 slots for priority query: 60s period, phases 0s, 10s, 20s, 30s, 40s, 50s
+            for priority_idx in range(6):
+                worker_index = self._allocate_index()
+                worker = QueryScanWorker(query, self.queue, worker_index=worker_index,
+                                         priority_worker_num=priority_idx + 1)
+                self.scheduler.add_job(worker_index, worker, period=60, phase=priority_idx * 10, anchor=anchor)
+                workers.append(worker)
+        else:
+            # 1 slot for normal query (interval adapts to its arrival rate)
+            refresh_delay = int(db.get_parameter("query_refresh_delay") or 60)
+            get_adaptive_refresh_controller().register(query_id)
+            worker_index = self._allocate_index()
+            worker = QueryScanWorker(query, self.queue, worker_index=worker_index, group=group)
+            # Phases spread over the period - otherwise every normal query fires in the same tick
+            self.scheduler.add_job(worker_index, worker, period=refresh_delay,
+                                   phase=spread_phase(query_id, refresh_delay), anchor=anchor)
+            workers.append(worker)
+
+        self.slots[query_id] = {
+            "signature": group.signature if group else query[1],
+            "is_priority": is_priority,
+            "group": group,
+            "workers": workers,
+        }
+
+    def _stop_query(self, query_id, forget=True):
+        """Unschedule and retire all slots of one query"""
+        state = self.slots.pop(query_id, None)
+        if not state:
+            return
+        for worker in state["workers"]:
+            self.scheduler.remove_job(worker.worker_index)
+            worker.stop()
+            self._release_index(worker.worker_index)
+        get_adaptive_refresh_controller().forget(query_id)
+        if forget:
+            get_seen_items_tracker().forget(query_id)
+            get_early_exit_parser().forget(query_id)
+
+    def replace_worker(self, old_worker):
+        """
+        Swap a slot's worker for a fresh one (used by the supervisor).
+        The slot keeps its index, period and phase.
+
+        Returns:
+            QueryScanWorker or None if the slot no longer exists
+        """
+        with self.lock:
+            state = self.slots.get(old_worker.query_id)
+            if not state or old_worker not in state["workers"]:
+                return None
+            job = self.scheduler.jobs.get(old_worker.worker_index)
+            now = time.time()
+            if job is not None:
+                period = job.period
+                # Keep phase: next deadline on the slot's grid that is still ahead
+                next_due = job.next_due
+                if next_due <= now:
+                    next_due += (int((now - next_due) // period) + 1) * period
+            else:
+                period = 60 if state["is_priority"] else int(db.get_parameter("query_refresh_delay") or 60)
+                next_due = now
+            # Retire the old worker first: a scan still hanging in it drops its result when it
+            # returns, and its pair is taken out of service so the slot's index gets a fresh one
+            old_worker.stop()
+            old_worker.release_session()
+            new_worker = QueryScanWorker(old_worker.query, self.queue, worker_index=old_worker.worker_index,
+                                         priority_worker_num=old_worker.priority_worker_num, group=old_worker.group)
+            # Cancels the old job
+            self.scheduler.add_job(old_worker.worker_index, new_worker, period=period, phase=0, anchor=next_due)
+            state["workers"][state["workers"].index(old_worker)] = new_worker
+            return new_worker
+
+    def get_workers(self):
+        """Snapshot of all running slot workers"""
+        with self.lock:
+            return [w for state in self.slots.values() for w in state["workers"]]
+
+    def _resize_token_pool(self):
+        """Match token pool capacity to the highest worker index in use"""
+        used = [w.worker_index for state in self.slots.values() for w in state["workers"]]
+        required = max(used) + 1 if used else 0
+        # Indexes above the highest used one will be allocated again from scratch
+        self.free_indexes = [i for i in self.free_indexes if i < required]
+        heapq.heapify(self.free_indexes)
+        self.next_index = required
+        from token_pool import get_token_pool
+        get_token_pool().resize(required)
+
+    def _desired_slots(self, queries):
+        """
+        Slot units wanted for the current queries table.
+
+        Returns:
+            dict: key -> (query, is_priority, group); key is the query id (leader id for a group)
+        """
+        # Cluster mode: only queries leased by this node
+        owned = get_owned_query_ids()
+        if owned is not None:
+            queries = [q for q in queries if q[0] in owned]
+
+        desired = {}
+        normal_queries = []
+        for q in queries:
+            if len(q) > 5 and bool(q[5]):
+                desired[q[0]] = (q, True, None)
+            else:
+                normal_queries.append(q)
+
+        if is_query_coalescing_enabled():
+            # Normal queries differing only in locally evaluable filters share ONE slot
+            groups, solo = plan_query_groups(normal_queries)
+            for group in groups:
+                desired[group.leader_id] = (group.leader.query, False, group)
+        else:
+            plan_query_groups([])
+            solo = normal_queries
+        for q in solo:
+            desired[q[0]] = (q, False, None)
+        # Multi-process mode: only the slots of this shard
+        return {key: unit for key, unit in desired.items() if is_own_shard(key)}
+
+    def reconcile(self, anchor=None):
+        """
+        Diff the queries table against running slots and apply the changes.
+
+        Args:
+            anchor: Common time origin for new slots (default: now)
+
+        Returns:
+            dict: Number of started/stopped/resized/restarted queries
+        """
+        queries = db.get_queries_with_priority()
+        if anchor is None:
+            anchor = time.time()
+        desired = self._desired_slots(queries)
+        changes = {"started": 0, "stopped": 0, "resized": 0, "restarted": 0}
+
+        with self.lock:
+            for query_id in list(self.slots.keys()):
+                if query_id not in desired:
+                    logger.info(f"[RECONCILE] 🗑️ Query #{query_id} removed or regrouped - stopping {len(self.slots[query_id]['workers'])} slot(s)")
+                    self._stop_query(query_id)
+                    changes["stopped"] += 1
+
+            for query_id, (query, is_priority, group) in desired.items():
+                state = self.slots.get(query_id)
+                signature = group.signature if group else query[1]
+                if state is None:
+                    if group:
+                        logger.info(f"[RECONCILE] ➕ New coalesced group #{query_id} - 1 slot for queries {[m.query_id for m in group.members]}")
+                    else:
+                        logger.info(f"[RECONCILE] ➕ New query #{query_id} - starting {6 if is_priority else 1} slot(s)")
+                    self._start_query(query, is_priority, anchor, group)
+                    changes["started"] += 1
+                elif state["signature"] != signature:
+                    logger.info(f"[RECONCILE] ✏️ Query #{query_id} URL or group changed - restarting its slot(s)")
+                    self._stop_query(query_id)
+                    self._start_query(query, is_priority, anchor, group)
+                    changes["restarted"] += 1
+                elif state["is_priority"] != is_priority:
+                    logger.info(f"[RECONCILE] ⚡ Query #{query_id} priority {'ON' if is_priority else 'OFF'} - "
+                                f"resizing {len(state['workers'])} -> {6 if is_priority else 1} slot(s)")
+                    # Same search - keep the seen items so nothing is re-reported as new
+                    self._stop_query(query_id, forget=False)
+                    self._start_query(query, is_priority, anchor, group)
+                    changes["resized"] += 1
+
+            if any(changes.values()) or self.total_reconciles == 0:
+                self._resize_token_pool()
+
+            self.total_reconciles += 1
+            self.queries_started += changes["started"]
+            self.queries_stopped += changes["stopped"]
+            self.queries_resized += changes["resized"]
+            self.queries_restarted += changes["restarted"]
+            self.last_reconcile = time.time()
+            self.last_changes = changes
+
+        if any(changes.values()):
+            logger.info(f"[RECONCILE] ✅ Applied changes: {changes} ({self.get_slots_count()} slots total)")
+        return changes
+
+    def request_reconcile(self):
+        """Wake the reconcile loop up immediately"""
+        self._wakeup.set()
+
+    def start(self):
+        """Start the background reconcile loop"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, name="worker-reconciler", daemon=True)
+        self._thread.start()
+        logger.info("[RECONCILE] 🚀 Reconcile loop started")
+
+    def stop(self):
+        """Stop the background reconcile loop"""
+        self._running = False
+        self._wakeup.set()
+
+    def _loop(self):
+        while self._running:
+            interval = int(db.get_parameter("query_reconcile_interval") or 10)
+            self._wakeup.wait(timeout=interval)
+            self._wakeup.clear()
+            if not self._running:
+                return
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.error(f"[RECONCILE] Reconcile pass failed: {e}", exc_info=True)
+
+    def get_slots_count(self):
+        with self.lock:
+            return sum(len(state["workers"]) for state in self.slots.values())
+
+    def get_stats(self):
+        """Get reconciler statistics"""
+        with self.lock:
+            priority_queries = sum(1 for state in self.slots.values() if state["is_priority"])
+            return {
+                "queries": sum(len(state["group"].members) if state["group"] else 1 for state in self.slots.values()),
+                "priority_queries": priority_queries,
+                "coalesced_groups": sum(1 for state in self.slots.values() if state["group"]),
+                "slots": sum(len(state["workers"]) for state in self.slots.values()),
+                "total_reconciles": self.total_reconciles,
+                "queries_started": self.queries_started,
+                "queries_stopped": self.queries_stopped,
+                "queries_resized": self.queries_resized,
+                "queries_restarted": self.queries_restarted,
+                "last_reconcile": self.last_reconcile,
+                "last_changes": self.last_changes,
+            }
+
+
+class WorkerSupervisor:
+    """
+    Watches every scan slot and restarts broken ones.
+
+    - Heartbeat: each worker records the end time of its last scan
+    - Stalled: a scan has been in flight longer than worker_stall_timeout
+    - Dead: the worker can't get a session (worker_max_session_failures slots in a row)
+      or its heartbeat is older than 3 periods (slot is no longer dispatched)
+    - Restart: the slot gets a fresh worker (same index and phase) and a fresh
+      Token+Proxy pair, with exponential backoff per slot (30s, 60s, 120s ... max 10 min);
+      the old worker is stopped and its pair retired first
+    """
 
+    BACKOFF_BASE = 30
+    BACKOFF_MAX = 600
+    # Restart counter of a slot is reset after it stays healthy this long
+    HEALTHY_RESET = 600
+
+    def __init__(self, reconciler, scheduler):
+        self.reconciler = reconciler
+        self.scheduler = scheduler
+        self.restarts = {}  # worker_index -> {"count", "last_restart", "next_allowed"}
+        self.events = deque(maxlen=100)
+        self.total_restarts = 0
+        self.last_check = None
+        self.last_health = {}
+        self._running = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _check_worker(self, worker, now, stall_timeout, max_session_failures):
+        """Return the failure reason of a worker, or None if healthy"""
+        job = self.scheduler.jobs.get(worker.worker_index)
+        scan_started_at = worker.scan_started_at
+        if scan_started_at is not None and now - scan_started_at > stall_timeout:
+            return f"stalled ({int(now - scan_started_at)}s in one scan)"
+        if worker.session_failures >= max_session_failures:
+            return f"dead (no session after {worker.session_failures} attempts)"
+        if job is not None and not job.running:
+            last_seen = worker.last_heartbeat or worker.created_at
+            silence_limit = max(3 * job.period, stall_timeout)
+            if now - last_seen > silence_limit and job.next_due < now - job.period:
+                return f"dead (no heartbeat for {int(now - last_seen)}s)"
+        return None
 
-def start_continuous_workers(queue):
+    def check(self):
+        """One supervision pass over all slots"""
+        now = time.time()
+        stall_timeout = int(db.get_parameter("worker_stall_timeout") or 180)
+        max_session_failures = int(db.get_parameter("worker_max_session_failures") or 3)
+        health = {"healthy": 0, "stalled": 0, "dead": 0, "backoff": 0}
+
+        for worker in self.reconciler.get_workers():
+            reason = self._check_worker(worker, now, stall_timeout, max_session_failures)
+            restart = self.restarts.get(worker.worker_index)
+            if reason is None:
+                health["healthy"] += 1
+                if restart and now - restart["last_restart"] > self.HEALTHY_RESET:
+                    del self.restarts[worker.worker_index]
+                continue
+
+            health["stalled" if reason.startswith("stalled") else "dead"] += 1
+            if restart and now < restart["next_allowed"]:
+                health["backoff"] += 1
+                continue
+            self._restart(worker, reason, now)
+
+        self.last_check = now
+        self.last_health = health
+
+    def _restart(self, worker, reason, now):
+        """Replace a broken worker and schedule its backoff"""
+        restart = self.restarts.setdefault(worker.worker_index, {"count": 0, "last_restart": 0, "next_allowed": 0})
+        restart["count"] += 1
+        backoff = min(self.BACKOFF_BASE * (2 ** (restart["count"] - 1)), self.BACKOFF_MAX)
+        restart["last_restart"] = now
+        restart["next_allowed"] = now + backoff
+
+        new_worker = self.reconciler.replace_worker(worker)
+        if new_worker is None:
+            # Query was removed in the meantime - nothing to restart
+            self.restarts.pop(worker.worker_index, None)
+            return
+
+        self.total_restarts += 1
+        self.events.append({
+            "time": datetime.now(timezone(timedelta(hours=3))).strftime('%Y-%m-%d %H:%M:%S'),
+            "worker_index": worker.worker_index,
+            "query_id": worker.query_id,
+            "reason": reason,
+            "restart_count": restart["count"],
+            "backoff_seconds": backoff,
+        })
+        logger.warning(f"[SUPERVISOR] 🔁 {worker.worker_name} {reason} - restarted "
+                       f"(restart #{restart['count']}, next allowed in {backoff}s)")
+
+    def start(self):
+        """Start the supervision loop"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, name="worker-supervisor", daemon=True)
+        self._thread.start()
+        logger.info("[SUPERVISOR] 🚀 Worker supervisor started")
+
+    def stop(self):
+        """Stop the supervision loop"""
+        self._running = False
+        self._stop.set()
+
+    def _loop(self):
+        while self._running:
+            interval = int(db.get_parameter("worker_supervisor_interval") or 15)
+            if self._stop.wait(timeout=interval):
+                return
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"[SUPERVISOR] Supervision pass failed: {e}", exc_info=True)
+
+    def get_stats(self):
+        """Get supervision statistics and recent restart events"""
+        return {
+            "running": self._running,
+            "active_workers": get_active_workers_count(),
+            "last_check": self.last_check,
+            "health": self.last_health,
+            "total_restarts": self.total_restarts,
+            "slots_in_backoff": sum(1 for r in self.restarts.values() if r["next_allowed"] > time.time()),
+            "events": list(self.events),
+        }
+
+
+# Global reconciler instance (created by start_continuous_workers)
+_worker_reconciler = None
+_worker_supervisor = None
+
+
+def get_worker_reconciler():
+    """Get the running worker reconciler (None if workers were not started)"""
+    return _worker_reconciler
+
+
+def get_worker_supervisor():
+    """Get the running worker supervisor (None if workers were not started)"""
+    return _worker_supervisor
+
+
+def request_worker_reconcile():
+    """Ask the reconciler to apply query changes NOW (no-op if workers are not running)"""
+    from worker_sharding import RECONCILE, get_shard_manager
+    invalidate_query_cache()
+    if _worker_reconciler is not None:
+        _worker_reconciler.request_reconcile()
+    # Sharded mode: the slots live in the worker processes
+    shard_manager = get_shard_manager()
+    if shard_manager is not None:
+        shard_manager.broadcast(RECONCILE)
+
+
+def start_continuous_workers(queue, restored_states=None):
     """
-    Start independent continuous workers for EACH query.
+    Start scan slots for EACH query on the central deadline scheduler.
     
     Architecture:
-    - N queries = N independent threads (e.g. 72 queries = 72 workers)
-    - Each worker has UNIQUE token & User-Agent from token pool
-    - Each thread scans its own query dynamically (reads delay from DB)
-    - All threads run in parallel forever
-    - Query Refresh Delay applies to EACH query independently
-    - Changes in Web UI apply IMMEDIATELY (no restart needed!)
-    - System automatically scales: add 100 queries → 100 workers + 100 tokens!
+    - N queries = N scan slots (e.g. 72 queries = 72 slots), 6 slots per priority query
+    - Each slot has UNIQUE token & User-Agent from token pool
+    - ONE scheduler keeps a min-heap of next-due deadlines for all slots
+    - Due scans run on a bounded executor (scan_max_concurrency)
+    - Period is fixed relative to the previous deadline - no drift from scan time
+    - Priority slots stay phase-locked 10s apart
+    - WorkerReconciler adds/removes/resizes slots when queries change (no restart needed!)
+    - WorkerSupervisor restarts dead or stalled slots with backoff
     
-    This is the TRUE parallel query processing with maximum diversification!
+    Args:
+        queue: Scan stage queue the slots put item batches into
+        restored_states: Shutdown snapshots taken by the coordinator (None = take them from the DB)
+    
+    Returns:
+        ScanScheduler or None if workers could not be started
     """
+    global _worker_reconciler, _worker_supervisor
     try:
-        logger.info(f"[WORKERS] 🚀 Starting INDEPENDENT workers for each query...")
+        logger.info(f"[WORKERS] 🚀 Starting scan slots for each query...")
+        
+        # Seen ids / arrival rates / throttle handed over by the previous process (no cold start)
+        from graceful_shutdown import restore_state_snapshots
+        restore_state_snapshots(restored_states)
         
         # Use get_queries_with_priority() - auto-fallback if migration not run
         all_queries = db.get_queries_with_priority()
+        owned = get_owned_query_ids()
+        if owned is not None:
+            # Cluster mode: only queries leased by this node
+            all_queries = [q for q in all_queries if q[0] in owned]
+            logger.info(f"[WORKERS] 🌐 Cluster mode: {len(all_queries)} queries leased by this node")
+        if _worker_shard is not None:
+            # Multi-process mode: size the token pool for this shard's slice only
+            all_queries = [q for q in all_queries if is_own_shard(q[0])]
+            logger.info(f"[WORKERS] 🧩 Shard {_worker_shard[0]}/{_worker_shard[1]}: {len(all_queries)} queries")
         num_queries = len(all_queries)
         
         if num_queries == 0:
-            logger.warning(f"[WORKERS] No queries found in database!")
-            return None
+            logger.warning(f"[WORKERS] No queries found in database - slots will be started when queries are added")
         
         # Count priority and normal queries
         priority_count = sum(1 for q in all_queries if len(q) > 5 and bool(q[5]))
@@ -614,7 +1426,7 @@ def start_continuous_workers(queue):
         logger.info(f"[WORKERS] Got {num_queries} queries ({normal_count} normal, {priority_count} priority)")
         logger.info(f"[WORKERS] 📊 ARCHITECTURE: {total_workers} workers ({normal_count}×1 + {priority_count}×6)")
         if priority_count > 0:
-            logger.info(f"[WORKERS] ⚡ Priority queries: 6 workers each, rotating every 10s")
+            logger.info(f"[WORKERS] ⚡ Priority queries: 6 workers each, phase-locked every 10s")
         logger.info(f"[WORKERS] 📊 Normal queries: 1 worker each, scanning at default interval")
         
         # Initialize token pool with size matching TOTAL number of workers
@@ -622,94 +1434,57 @@ def start_continuous_workers(queue):
         from token_pool import get_token_pool
         token_pool = get_token_pool(target_size=total_workers, prewarm=True)  # ПАРАЛЛЕЛЬНОЕ создание!
         logger.info(f"[WORKERS] 🎯 Token pool ready with {total_workers} tokens!")
-        logger.info(f"[WORKERS] ⚡ Tokens created IN PARALLEL (10 threads) - FAST startup!")
-        logger.info(f"[WORKERS] 🚀 All workers can start IMMEDIATELY with ready tokens!")
         
         # Get INITIAL configuration (for logging only)
         refresh_delay = int(db.get_parameter("query_refresh_delay") or 60)
         items_per_query = int(db.get_parameter("items_per_query") or 20)
+        max_concurrency = int(db.get_parameter("scan_max_concurrency") or 32)
         
         logger.info(f"[WORKERS] Initial config: {refresh_delay}s delay, {items_per_query} items per query")
-        logger.info(f"[WORKERS] Workers will read FRESH config from DB on each cycle (dynamic!)")
-        logger.info(f"[WORKERS] Changes in Web UI will apply IMMEDIATELY without restart! 🔥")
+        logger.info(f"[WORKERS] Workers will read FRESH config from DB on each scan (dynamic!)")
         
-        # Start ALL workers
-        executor = ThreadPoolExecutor(max_workers=total_workers)
+        from scan_scheduler import get_scan_scheduler
+        scheduler = get_scan_scheduler(max_concurrency=max_concurrency)
         
-        logger.info(f"[WORKERS] 🚀 Starting {total_workers} workers...")
+        logger.info(f"[WORKERS] 🚀 Scheduling {total_workers} scan slots (max {max_concurrency} concurrent scans)...")
         
         # Reset active workers counter
         global _active_workers_count
         with _active_workers_lock:
             _active_workers_count = 0
         
-        worker_index = 0  # Global worker index for token assignment
-        
-        # Legacy mode: if no priority queries, use simple logic
-        if priority_count == 0:
-            logger.info(f"[WORKERS] 🚀 Using legacy mode - creating 1 worker per query")
-            for query in all_queries:
-                executor.submit(
-                    continuous_query_worker, 
-                    query, 
-                    queue, 
-                    worker_index=worker_index,
-                    start_delay=0
-                )
-                worker_index += 1
-        else:
-            # Priority mode: create 6 workers for priority queries, 1 for normal
-            for query in all_queries:
-                query_id = query[0]
-                is_priority = len(query) > 5 and bool(query[5])
-                
-                if is_priority:
-                    # Create 6 workers for priority query with staggered start (every 10s)
-                    logger.info(f"[WORKERS] ⚡ Creating 6 priority workers for Query #{query_id}")
-                    for priority_idx in range(6):
-                        start_delay = priority_idx * 10  # 0s, 10s, 20s, 30s, 40s, 50s stagger
-                        executor.submit(
-                            continuous_query_worker, 
-                            query, 
-                            queue, 
-                            worker_index=worker_index,
-                            start_delay=start_delay,
-                            priority_worker_num=priority_idx + 1  # 1, 2, 3, 4, 5, 6
-                        )
-                        worker_index += 1
-                else:
-                    # Create 1 worker for normal query
-                    executor.submit(
-                        continuous_query_worker, 
-                        query, 
-                        queue, 
-                        worker_index=worker_index,
-                        start_delay=0
-                    )
-                    worker_index += 1
-        
-        logger.info(f"[WORKERS] ✅ {total_workers} independent workers SUBMITTED to executor!")
+        # Initial reconcile pass creates all slots with a common anchor - keeps priority slots phase-locked
+        _worker_reconciler = WorkerReconciler(scheduler, queue)
+        _worker_reconciler.reconcile(anchor=time.time())
+        
+        scheduler.start()
+        _worker_reconciler.start()
+        
+        # Supervisor restarts dead/stalled slots (heartbeat per worker)
+        _worker_supervisor = WorkerSupervisor(_worker_reconciler, scheduler)
+        _worker_supervisor.start()
+        
+        logger.info(f"[WORKERS] ✅ {total_workers} scan slots SCHEDULED!")
         logger.info(f"[WORKERS] ⏳ Waiting 15 seconds for workers to initialize and report...")
         
         # Wait for workers to initialize and report their status
         time.sleep(15)
         
         active_count = get_active_workers_count()
+        total_workers = _worker_reconciler.get_slots_count()
         logger.info(f"[WORKERS] 📊 FINAL COUNT: {active_count}/{total_workers} workers are ACTIVE!")
         
         if active_count < total_workers:
-            logger.error(f"[WORKERS] ⚠️ WARNING: {total_workers - active_count} workers FAILED TO START!")
-            logger.error(f"[WORKERS] ⚠️ Expected {total_workers} workers, but only {active_count} are running!")
+            logger.warning(f"[WORKERS] ⚠️ {total_workers - active_count} workers not active yet (later phases or retrying on next slot)")
         else:
             logger.info(f"[WORKERS] ✅ All {active_count} workers are running successfully!")
         
-        logger.info(f"[WORKERS] 🔥 All queries scanning in TRUE PARALLEL with DYNAMIC config!")
         if priority_count > 0:
-            logger.info(f"[WORKERS] ⚡ Priority queries: 6 workers rotate every 10s (60s cycle per worker)")
-        logger.info(f"[WORKERS] ⚡ Normal queries scan every {refresh_delay}s (1 worker each)")
+            logger.info(f"[WORKERS] ⚡ Priority queries: 6 slots phase-locked every 10s (60s period per slot)")
+        logger.info(f"[WORKERS] ⚡ Normal queries scan every {refresh_delay}s (1 slot each)")
         
-        # Keep executor alive
-        return executor
+        # Keep scheduler alive
+        return scheduler
         
     except Exception as e:
         logger.error(f"[WORKERS] CRITICAL ERROR starting workers: {e}")
@@ -727,104 +1502,285 @@ def process_items(queue):
     pass
 
 
+def _process_item_batch(data, query_id, query, new_items_queue):
+    """
+    Save the NEW items of one scanned batch and queue their Telegram messages.
+
+    Args:
+        data: Items of the batch (newest first, API order)
+        query_id: Query the batch belongs to
+        query: Query tuple from the database (for thread_id)
+        new_items_queue: Queue of Telegram messages
+
+    Returns:
+        int: Number of new items
+    """
+    new_count = 0
+    for item in reversed(data):
+        logger.debug(f"[QUEUE] Processing item {item.id}: {item.title[:50]}...")
+
+        # Check if item already exists in database
+        if db.is_item_in_db_by_id(item.id):
+            logger.debug(f"[QUEUE] Item {item.id} already exists in database, skipping...")
+            continue
+            
+        # TEMPORARILY DISABLE TIME FILTER - accept all items but check for duplicates
+        if True:  # Accept all items for now
+            logger.debug(f"[QUEUE] Creating message for item {item.id}...")
+            try:
+                # Calculate delay between publication and discovery
+                import time
+                found_at = time.time()  # Record when bot found this item
+                delay_str = calculate_delay(item.raw_timestamp, found_at)
+                
+                # Format price with delay
+                price_text = f"💶{str(item.price)} {item.currency}"
+                if delay_str:
+                    price_text += f" ({delay_str})"
+                
+                # We create the message with conditional size display
+                if item.size_title and item.size_title.strip():
+                    # Format message with size
+                    content = f"<b>{item.title}</b>\n<b>{price_text}</b>\n⛓️ {item.size_title}\n{item.brand_title}"
+                else:
+                    # Format message without size line
+                    content = f"<b>{item.title}</b>\n<b>{price_text}</b>\n{item.brand_title}"
+                
+                # Add invisible image link if photo exists
+                if item.photo:
+                    content += f"\n<a href='{item.photo}'>&#8205;</a>"
+                
+                # IMPORTANT: Save to DB FIRST, then send to Telegram
+                # This prevents items appearing in TG but not in Web UI if DB fails
+                
+                # Add the item to the db (found_at already calculated above for delay)
+                db_save_success = db.add_item_to_db(id=item.id, title=item.title, query_id=query_id, price=item.price, 
+                                  timestamp=item.raw_timestamp, photo_url=item.photo, currency=item.currency, 
+                                  brand_title=item.brand_title, found_at=found_at)
+                
+                if db_save_success is None:
+                    # Normal dedup: another query / worker / node saved it first
+                    logger.debug(f"[QUEUE] Item {item.id} already in database - skipping Telegram send")
+                    continue
+                if not db_save_success:
+                    logger.error(f"[QUEUE] ❌ FAILED to save item {item.id} to database! Skipping Telegram send.")
+                    continue  # Don't send to Telegram if DB save failed!
+                
+                logger.debug(f"[QUEUE] ✅ Item {item.id} saved to database successfully")
+                
+                # Update the query's last_found timestamp
+                db.update_query_last_found(query_id, item.raw_timestamp)
+                
+                # Get thread_id for this query from the CACHED query
+                thread_id = None
+                if len(query) > 4:
+                    thread_id = query[4]  # thread_id is the 5th element (index 4)
+                
+                # NOW add to Telegram queue (only after successful DB save)
+                new_items_queue.put((content, item.url, "Open Vinted", None, None, thread_id, item.photo))
+                
+                new_count += 1
+                logger.info(f"[QUEUE] ✅ NEW ITEM: {item.title} ({delay_str})")
+                
+            except Exception as e:
+                logger.error(f"[ERROR] Failed to process item {item.id}: {e}")
+                import traceback
+                logger.error(f"[ERROR] Traceback: {traceback.format_exc()}")
+    return new_count
+
+
+class QueryCache:
+    """
+    Queries by id for the item processor.
+
+    Reloaded from the DB only after invalidate() (query added/removed/edited),
+    when a batch references an unknown query id, or when older than max_age
+    (changes made by other nodes) - never while the pipeline is idle.
+    """
+
+    def __init__(self, max_age=60):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.queries = {}
+        self.loaded_at = 0
+        self.version = 0
+        self.loaded_version = -1
+        self.total_reloads = 0
+
+    def invalidate(self):
+        with self.lock:
+            self.version += 1
+
+    def _reload(self):
+        with self.lock:
+            version = self.version
+        queries = {q[0]: q for q in db.get_queries()}
+        with self.lock:
+            self.queries = queries
+            self.loaded_at = time.time()
+            self.loaded_version = version
+            self.total_reloads += 1
+        logger.debug(f"[QUEUE] Query cache reloaded ({len(queries)} queries)")
+
+    def get(self, query_id):
+        """Query tuple by id, or None if the query no longer exists"""
+        if self.loaded_version != self.version or time.time() - self.loaded_at > self.max_age:
+            self._reload()
+        query = self.queries.get(query_id)
+        if query is None and time.time() - self.loaded_at > 1:
+            # Maybe added after the last reload (e.g. by another node)
+            self._reload()
+            query = self.queries.get(query_id)
+        return query
+
+
+_query_cache = QueryCache()
+
+
+def invalidate_query_cache():
+    """Queries changed - the item processor reloads them (and their filter rules) on its next batch"""
+    _query_cache.invalidate()
+    get_filter_engine().invalidate()
+    _compiled_searches.invalidate()
+
+
+class ItemProcessor:
+    """
+    Dedicated consumer of the scan stage queue.
+
+    Blocks on the queue and processes every batch the moment it arrives
+    (no polling interval, no DB traffic while idle).
+    """
+
+    def __init__(self, items_queue, new_items_queue):
+        self.items_queue = items_queue
+        self.new_items_queue = new_items_queue
+        self._running = False
+        self._thread = None
+        self.busy = False
+
+        # Metrics
+        self.total_batches = 0
+        self.total_items = 0  # received, before the filters
+        self.total_passed_items = 0  # passed filter rules + seller country allowlist
+        self.total_new_items = 0
+        self.total_dropped_batches = 0
+        self.total_processing_seconds = 0.0
+        self.last_batch_at = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, name="item-processor", daemon=True)
+        self._thread.start()
+        logger.info("[QUEUE] 🚀 Item processor started (event-driven)")
+
+    def shutdown(self, wait=False):
+        self._running = False
+        if wait and self._thread:
+            self._thread.join(timeout=5)
+
+    @property
+    def running(self):
+        return self._running
+
+    def _loop(self):
+        while self._running:
+            try:
+                # Timeout only so shutdown() is noticed
+                self.busy = False
+                data, query_id = self.items_queue.get(timeout=1)
+                self.busy = True
+            except queue_module.Empty:
+                continue
+            except Exception as e:
+                logger.error(f"[QUEUE] Error reading queue: {e}")
+                time.sleep(1)
+                continue
+            self.process_batch(data, query_id)
+        self.busy = False
+
+    def process_batch(self, data, query_id):
+        start = time.perf_counter()
+        received = len(data)
+        try:
+            query = _query_cache.get(query_id)
+            if query is None:
+                # Batch scanned right before its query was removed - drop it
+                logger.debug(f"[QUEUE] Query #{query_id} no longer exists, dropping {len(data)} items")
+                self.total_dropped_batches += 1
+                return
+            # Per-query filter rules BEFORE the DB insert and the Telegram send
+            data = get_filter_engine().filter_batch(query_id, data)
+            # Seller-country allowlist - items of unresolved sellers are held and come back
+            # through this queue once the background lookup answers
+            data = get_seller_country_filter().filter_batch(data, query_id, self.items_queue)
+            self.total_passed_items += len(data)
+            self.total_new_items += _process_item_batch(data, query_id, query, self.new_items_queue)
+        except Exception as e:
+            logger.error(f"[QUEUE] Error processing queue batch: {e}", exc_info=True)
+        finally:
+            self.total_batches += 1
+            self.total_items += received
+            self.total_processing_seconds += time.perf_counter() - start
+            self.last_batch_at = time.time()
+
+    def get_stats(self):
+        """Get item processor statistics"""
+        return {
+            "running": self._running,
+            "total_batches": self.total_batches,
+            "total_items": self.total_items,
+            "total_passed_items": self.total_passed_items,
+            "total_new_items": self.total_new_items,
+            "total_dropped_batches": self.total_dropped_batches,
+            "avg_batch_ms": round(self.total_processing_seconds / self.total_batches * 1000, 2) if self.total_batches else 0.0,
+            "last_batch_at": self.last_batch_at,
+            "query_cache_reloads": _query_cache.total_reloads,
+        }
+
+
+# Global item processor instance
+_item_processor = None
+
+
+def start_item_processor(items_queue, new_items_queue):
+    """Start the event-driven item processor"""
+    global _item_processor
+    _item_processor = ItemProcessor(items_queue, new_items_queue)
+    _item_processor.start()
+    return _item_processor
+
+
+def get_item_processor():
+    """Get the item processor (None if not started)"""
+    return _item_processor
+
+
 def clear_item_queue(items_queue, new_items_queue):
     """
-    Process items from the items_queue.
-    This function is scheduled to run frequently.
-    
-    🔥 КРИТИЧНО: Обрабатывает ВСЕ элементы в очереди за один вызов!
-    Иначе при 72 воркерах очередь растет быстрее, чем обрабатывается!
+    Process items from the items_queue (polling variant, kept for the legacy
+    item_extractor process - the runtime uses ItemProcessor).
     """
     processed_count = 0
-    
-    # 🔥 КРИТИЧНО: Кешируем queries ОДИН РАЗ перед обработкой!
-    # Иначе db.get_queries() вызывается для КАЖДОЙ вещи (1440+ раз за цикл!)
-    all_queries_cache = db.get_queries()
-    logger.debug(f"[QUEUE] Cached {len(all_queries_cache)} queries for fast lookup")
-    
-    # Обрабатываем ВСЕ элементы в очереди (до 100 за раз для безопасности)
+
+    # Обрабатываем элементы в очереди (до 100 за раз для безопасности)
     while not items_queue.empty() and processed_count < 100:
         try:
             data, query_id = items_queue.get_nowait()
             processed_count += 1
-            
-            logger.debug(f"[QUEUE] Processing batch #{processed_count}: {len(data)} items from query #{query_id}")
-            
-            for item in reversed(data):
-                logger.debug(f"[QUEUE] Processing item {item.id}: {item.title[:50]}...")
 
-                # Check if item already exists in database
-                if db.is_item_in_db_by_id(item.id):
-                    logger.debug(f"[QUEUE] Item {item.id} already exists in database, skipping...")
-                    continue
-                    
-                # TEMPORARILY DISABLE TIME FILTER - accept all items but check for duplicates
-                if True:  # Accept all items for now
-                    logger.debug(f"[QUEUE] Creating message for item {item.id}...")
-                    try:
-                        # Calculate delay between publication and discovery
-                        import time
-                        found_at = time.time()  # Record when bot found this item
-                        delay_str = calculate_delay(item.raw_timestamp, found_at)
-                        
-                        # Format price with delay
-                        price_text = f"💶{str(item.price)} {item.currency}"
-                        if delay_str:
-                            price_text += f" ({delay_str})"
-                        
-                        # We create the message with conditional size display
-                        if item.size_title and item.size_title.strip():
-                            # Format message with size
-                            content = f"<b>{item.title}</b>\n<b>{price_text}</b>\n⛓️ {item.size_title}\n{item.brand_title}"
-                        else:
-                            # Format message without size line
-                            content = f"<b>{item.title}</b>\n<b>{price_text}</b>\n{item.brand_title}"
-                        
-                        # Add invisible image link if photo exists
-                        if item.photo:
-                            content += f"\n<a href='{item.photo}'>&#8205;</a>"
-                        
-                        # IMPORTANT: Save to DB FIRST, then send to Telegram
-                        # This prevents items appearing in TG but not in Web UI if DB fails
-                        
-                        # Add the item to the db (found_at already calculated above for delay)
-                        db_save_success = db.add_item_to_db(id=item.id, title=item.title, query_id=query_id, price=item.price, 
-                                          timestamp=item.raw_timestamp, photo_url=item.photo, currency=item.currency, 
-                                          brand_title=item.brand_title, found_at=found_at)
-                        
-                        if not db_save_success:
-                            logger.error(f"[QUEUE] ❌ FAILED to save item {item.id} to database! Skipping Telegram send.")
-                            continue  # Don't send to Telegram if DB save failed!
-                        
-                        logger.debug(f"[QUEUE] ✅ Item {item.id} saved to database successfully")
-                        
-                        # Update the query's last_found timestamp
-                        db.update_query_last_found(query_id, item.raw_timestamp)
-                        
-                        # Get thread_id for this query from CACHED queries
-                        thread_id = None
-                        try:
-                            # Use cached queries instead of calling db.get_queries() for EVERY item!
-                            current_query = next((q for q in all_queries_cache if q[0] == query_id), None)
-                            if current_query and len(current_query) > 4:
-                                thread_id = current_query[4]  # thread_id is the 5th element (index 4)
-                        except Exception as e:
-                            logger.warning(f"Could not get thread_id for query {query_id}: {e}")
-                        
-                        # NOW add to Telegram queue (only after successful DB save)
-                        new_items_queue.put((content, item.url, "Open Vinted", None, None, thread_id, item.photo))
-                        
-                        logger.info(f"[QUEUE] ✅ NEW ITEM: {item.title} ({delay_str})")
-                        
-                    except Exception as e:
-                        logger.error(f"[ERROR] Failed to process item {item.id}: {e}")
-                        import traceback
-                        logger.error(f"[ERROR] Traceback: {traceback.format_exc()}")
-        
+            query = _query_cache.get(query_id)
+            if query is None:
+                logger.debug(f"[QUEUE] Query #{query_id} no longer exists, dropping {len(data)} items")
+                continue
+            data = get_filter_engine().filter_batch(query_id, data)
+            data = get_seller_country_filter().filter_batch(data, query_id, items_queue)
+            _process_item_batch(data, query_id, query, new_items_queue)
+
         except Exception as e:
             logger.error(f"[QUEUE] Error processing queue batch: {e}")
             break
-    
+
     if processed_count > 0:
         logger.info(f"[QUEUE] ✅ Processed {processed_count} batches from queue")
 
@@ -315,6 +315,13 @@ def update_last_timestamp(query_id, timestamp):
 
 
 def add_item_to_db(id, title, query_id, price, timestamp, photo_url, currency="EUR", brand_title="", found_at=None):
+    """
+    Save a found item.
+
+    Returns:
+        True if the item was saved, None if it is already in the DB (dedup -
+        another query/worker/node saved it first), False if the insert failed
+    """
     from logger import get_logger
     logger = get_logger(__name__)
     
@@ -327,8 +334,8 @@ def add_item_to_db(id, title, query_id, price, timestamp, photo_url, currency="E
         
         # Check if item already exists in database
         if is_item_in_db_by_id(id):
-            logger.info(f"Item {id} already exists in database, skipping...")
-            return False
+            logger.debug(f"Item {id} already exists in database, skipping...")
+            return None
         else:
             logger.info(f"Item {id} is new, proceeding with database insertion...")
         
@@ -373,27 +380,38 @@ def add_item_to_db(id, title, query_id, price, timestamp, photo_url, currency="E
             # Insert WITH found_at column
             if db_type == 'postgresql':
                 cursor.execute(
-                    "INSERT INTO items (item, title, price, currency, timestamp, photo_url, brand_title, query_id, found_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                    "INSERT INTO items (item, title, price, currency, timestamp, photo_url, brand_title, query_id, found_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT DO NOTHING",
                     (id, title, price_decimal, currency, timestamp, photo_url, brand_title, query_id, found_at))
+                inserted = cursor.rowcount
                 cursor.execute("UPDATE queries SET last_item=%s WHERE id=%s", (timestamp, query_id))
             else:
                 cursor.execute(
-                    "INSERT INTO items (item, title, price, currency, timestamp, photo_url, brand_title, query_id, found_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    "INSERT INTO items (item, title, price, currency, timestamp, photo_url, brand_title, query_id, found_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING",
                     (id, title, price_decimal, currency, timestamp, photo_url, brand_title, query_id, found_at))
+                inserted = cursor.rowcount
                 cursor.execute("UPDATE queries SET last_item=? WHERE id=?", (timestamp, query_id))
         else:
             # Insert WITHOUT found_at column (backward compatibility)
             if db_type == 'postgresql':
                 cursor.execute(
-                    "INSERT INTO items (item, title, price, currency, timestamp, photo_url, brand_title, query_id) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                    "INSERT INTO items (item, title, price, currency, timestamp, photo_url, brand_title, query_id) VALUES (%s, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT DO NOTHING",
                     (id, title, price_decimal, currency, timestamp, photo_url, brand_title, query_id))
+                inserted = cursor.rowcount
                 cursor.execute("UPDATE queries SET last_item=%s WHERE id=%s", (timestamp, query_id))
             else:
                 cursor.execute(
-                    "INSERT INTO items (item, title, price, currency, timestamp, photo_url, brand_title, query_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    "INSERT INTO items (item, title, price, currency, timestamp, photo_url, brand_title, query_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING",
                     (id, title, price_decimal, currency, timestamp, photo_url, brand_title, query_id))
+                inserted = cursor.rowcount
                 cursor.execute("UPDATE queries SET last_item=? WHERE id=?", (timestamp, query_id))
             
+        # Cluster-wide dedup: another node may have inserted the same item in the meantime
+        # (unique index on items.item - see run_cluster_migration)
+        if inserted == 0:
+            conn.rollback()
+            logger.debug(f"Item {id} was already saved by another worker/node, skipping...")
+            return None
+            
         conn.commit()
         logger.info(f"Successfully added item {id} to database with price {price_decimal}")
         return True
@@ -509,6 +527,472 @@ def run_priority_migration():
             conn.close()
 
 
+def run_filter_rules_migration():
+    """
+    Run filter rules migration - adds filter_rules column (JSON) to queries.
+    Safe to run multiple times (IF NOT EXISTS).
+    
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    conn = None
+    try:
+        conn, db_type = get_db_connection()
+        cursor = conn.cursor()
+        
+        if db_type == 'postgresql':
+            cursor.execute("""
+                ALTER TABLE queries 
+                ADD COLUMN IF NOT EXISTS filter_rules TEXT
+            """)
+        else:
+            cursor.execute("PRAGMA table_info(queries)")
+            columns = [row[1] for row in cursor.fetchall()]
+            
+            if 'filter_rules' not in columns:
+                cursor.execute("""
+                    ALTER TABLE queries 
+                    ADD COLUMN filter_rules TEXT
+                """)
+        
+        conn.commit()
+        return True
+    except Exception as e:
+        if "duplicate column" in str(e).lower() or "already exists" in str(e).lower():
+            return True
+        print_exc()
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+def run_cluster_migration():
+    """
+    Run cluster mode migration - node registry, query leases and a unique key on items.item.
+    Safe to run multiple times (IF NOT EXISTS). Duplicate items are removed once
+    before the unique index is created.
+    
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    conn = None
+    try:
+        conn, db_type = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS cluster_nodes (
+                node_id        TEXT PRIMARY KEY,
+                hostname       TEXT,
+                started_at     NUMERIC,
+                last_heartbeat NUMERIC
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS query_leases (
+                query_id      INTEGER PRIMARY KEY,
+                node_id       TEXT,
+                lease_expires NUMERIC DEFAULT 0
+            )
+        """)
+        
+        # Unique key on items.item - makes dedup cluster-wide (INSERT ... ON CONFLICT DO NOTHING)
+        if db_type == 'postgresql':
+            cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s", ('idx_items_item_unique',))
+            if not cursor.fetchone():
+                cursor.execute("DELETE FROM items a USING items b WHERE a.ctid < b.ctid AND a.item = b.item")
+                cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_items_item_unique ON items(item)")
+        else:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = ?", ('idx_items_item_unique',))
+            if not cursor.fetchone():
+                cursor.execute("DELETE FROM items WHERE rowid NOT IN (SELECT MIN(rowid) FROM items GROUP BY item)")
+                cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_items_item_unique ON items(item)")
+        
+        conn.commit()
+        return True
+    except Exception:
+        print_exc()
+        if conn:
+            conn.rollback()
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+def cluster_heartbeat(node_id, hostname, started_at, now):
+    """Register a cluster node or refresh its heartbeat"""
+    conn = None
+    try:
+        conn, db_type = get_db_connection()
+        cursor = conn.cursor()
+        
+        if db_type == 'postgresql':
+            cursor.execute("""
+                INSERT INTO cluster_nodes (node_id, hostname, started_at, last_heartbeat)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (node_id) DO UPDATE SET last_heartbeat = EXCLUDED.last_heartbeat
+            """, (node_id, hostname, started_at, now))
+        else:
+            cursor.execute("""
+                INSERT INTO cluster_nodes (node_id, hostname, started_at, last_heartbeat)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (node_id) DO UPDATE SET last_heartbeat = excluded.last_heartbeat
+            """, (node_id, hostname, started_at, now))
+        
+        conn.commit()
+        return True
+    except Exception:
+        print_exc()
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_cluster_nodes():
+    """
+    Get all registered cluster nodes.
+    
+    Returns:
+        List of tuples: (node_id, hostname, started_at, last_heartbeat)
+    """
+    conn = None
+    try:
+        conn, db_type = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT node_id, hostname, started_at, last_heartbeat FROM cluster_nodes ORDER BY node_id")
+        return cursor.fetchall()
+    except Exception:
+        print_exc()
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
+def remove_cluster_node(node_id, cleanup_before=None):
+    """
+    Remove a node from the registry and release its leases (graceful leave).
+    Nodes silent since cleanup_before are removed as well.
+    """
+    conn = None
+    try:
+        conn, db_type = get_db_connection()
+        cursor = conn.cursor()
+        
+        if db_type == 'postgresql':
+            cursor.execute("UPDATE query_leases SET node_id = NULL, lease_expires = 0 WHERE node_id = %s", (node_id,))
+            cursor.execute("DELETE FROM cluster_nodes WHERE node_id = %s", (node_id,))
+            if cleanup_before:
+                cursor.execute("DELETE FROM cluster_nodes WHERE last_heartbeat < %s", (cleanup_before,))
+        else:
+            cursor.execute("UPDATE query_leases SET node_id = NULL, lease_expires = 0 WHERE node_id = ?", (node_id,))
+            cursor.execute("DELETE FROM cluster_nodes WHERE node_id = ?", (node_id,))
+            if cleanup_before:
+                cursor.execute("DELETE FROM cluster_nodes WHERE last_heartbeat < ?", (cleanup_before,))
+        
+        conn.commit()
+        return True
+    except Exception:
+        print_exc()
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+def sync_query_leases():
+    """Create lease rows for new queries and drop leases of removed queries"""
+    conn = None
+    try:
+        conn, db_type = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            INSERT INTO query_leases (query_id, node_id, lease_expires)
+            SELECT id, NULL, 0 FROM queries WHERE id NOT IN (SELECT query_id FROM query_leases)
+        """)
+        cursor.execute("DELETE FROM query_leases WHERE query_id NOT IN (SELECT id FROM queries)")
+        
+        conn.commit()
+        return True
+    except Exception:
+        print_exc()
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_query_leases():
+    """
+    Get all query leases.
+    
+    Returns:
+        List of tuples: (query_id, node_id, lease_expires)
+    """
+    conn = None
+    try:
+        conn, db_type = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT query_id, node_id, lease_expires FROM query_leases ORDER BY query_id")
+        return cursor.fetchall()
+    except Exception:
+        print_exc()
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
+def try_acquire_query_lease(query_id, node_id, lease_expires, now):
+    """
+    Atomically take a lease that is free, expired or already ours.
+    
+    Returns:
+        bool: True if this node holds the lease now
+    """
+    conn = None
+    try:
+        conn, db_type = get_db_connection()
+        cursor = conn.cursor()
+        
+        if db_type == 'postgresql':
+            cursor.execute("""
+                UPDATE query_leases SET node_id = %s, lease_expires = %s
+                WHERE query_id = %s AND (node_id IS NULL OR node_id = %s OR lease_expires < %s)
+            """, (node_id, lease_expires, query_id, node_id, now))
+        else:
+            cursor.execute("""
+                UPDATE query_leases SET node_id = ?, lease_expires = ?
+                WHERE query_id = ? AND (node_id IS NULL OR node_id = ? OR lease_expires < ?)
+            """, (node_id, lease_expires, query_id, node_id, now))
+        
+        acquired = cursor.rowcount == 1
+        conn.commit()
+        return acquired
+    except Exception:
+        print_exc()
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+def renew_query_leases(node_id, lease_expires, now):
+    """Extend all still-valid leases of a node (heartbeat)"""
+    conn = None
+    try:
+        conn, db_type = get_db_connection()
+        cursor = conn.cursor()
+        
+        if db_type == 'postgresql':
+            cursor.execute("UPDATE query_leases SET lease_expires = %s WHERE node_id = %s AND lease_expires >= %s",
+                           (lease_expires, node_id, now))
+        else:
+            cursor.execute("UPDATE query_leases SET lease_expires = ? WHERE node_id = ? AND lease_expires >= ?",
+                           (lease_expires, node_id, now))
+        
+        conn.commit()
+        return True
+    except Exception:
+        print_exc()
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+def release_query_lease(query_id, node_id):
+    """Give a lease back (rebalancing) - only if this node still holds it"""
+    conn = None
+    try:
+        conn, db_type = get_db_connection()
+        cursor = conn.cursor()
+        
+        if db_type == 'postgresql':
+            cursor.execute("UPDATE query_leases SET node_id = NULL, lease_expires = 0 WHERE query_id = %s AND node_id = %s",
+                           (query_id, node_id))
+        else:
+            cursor.execute("UPDATE query_leases SET node_id = NULL, lease_expires = 0 WHERE query_id = ? AND node_id = ?",
+                           (query_id, node_id))
+        
+        conn.commit()
+        return True
+    except Exception:
+        print_exc()
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_owned_query_ids(node_id, now):
+    """Get ids of queries leased by a node (valid leases only)"""
+    conn = None
+    try:
+        conn, db_type = get_db_connection()
+        cursor = conn.cursor()
+        
+        if db_type == 'postgresql':
+            cursor.execute("SELECT query_id FROM query_leases WHERE node_id = %s AND lease_expires >= %s", (node_id, now))
+        else:
+            cursor.execute("SELECT query_id FROM query_leases WHERE node_id = ? AND lease_expires >= ?", (node_id, now))
+        
+        return {row[0] for row in cursor.fetchall()}
+    except Exception:
+        print_exc()
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+
+def run_seller_country_migration():
+    """
+    Run seller country cache migration - seller id -> country table.
+    Safe to run multiple times (IF NOT EXISTS).
+    
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    conn = None
+    try:
+        conn, db_type = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS seller_countries (
+                user_id    TEXT PRIMARY KEY,
+                country    TEXT,
+                fetched_at NUMERIC
+            )
+        """)
+        conn.commit()
+        return True
+    except Exception:
+        print_exc()
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_seller_countries(user_ids):
+    """
+    Get cached countries of several sellers with ONE query.
+    
+    Args:
+        user_ids: Seller ids (strings)
+        
+    Returns:
+        dict: user_id -> (country, fetched_at) for the sellers found
+    """
+    if not user_ids:
+        return {}
+    conn = None
+    try:
+        conn, db_type = get_db_connection()
+        cursor = conn.cursor()
+        user_ids = list(user_ids)
+        placeholder = "%s" if db_type == 'postgresql' else "?"
+        placeholders = ", ".join([placeholder] * len(user_ids))
+        cursor.execute(f"SELECT user_id, country, fetched_at FROM seller_countries WHERE user_id IN ({placeholders})",
+                       user_ids)
+        return {row[0]: (row[1], float(row[2] or 0)) for row in cursor.fetchall()}
+    except Exception:
+        print_exc()
+        return {}
+    finally:
+        if conn:
+            conn.close()
+
+
+def save_seller_countries(rows):
+    """
+    Upsert looked-up seller countries in ONE transaction.
+    
+    Args:
+        rows: List of (user_id, country, fetched_at)
+    """
+    if not rows:
+        return
+    conn = None
+    try:
+        conn, db_type = get_db_connection()
+        cursor = conn.cursor()
+        if db_type == 'postgresql':
+            cursor.executemany("""
+                INSERT INTO seller_countries (user_id, country, fetched_at) VALUES (%s, %s, %s)
+                ON CONFLICT (user_id) DO UPDATE SET country = EXCLUDED.country, fetched_at = EXCLUDED.fetched_at
+            """, rows)
+        else:
+            cursor.executemany("""
+                INSERT INTO seller_countries (user_id, country, fetched_at) VALUES (?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET country = excluded.country, fetched_at = excluded.fetched_at
+            """, rows)
+        conn.commit()
+    except Exception:
+        print_exc()
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_query_filter_rules():
+    """
+    Get filter rules of all queries that have them.
+    
+    Returns:
+        dict: query_id -> rules JSON text (empty if the migration was not run)
+    """
+    conn = None
+    try:
+        conn, db_type = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, filter_rules FROM queries WHERE filter_rules IS NOT NULL AND filter_rules != ''")
+        return {row[0]: row[1] for row in cursor.fetchall()}
+    except Exception:
+        print_exc()
+        return {}
+    finally:
+        if conn:
+            conn.close()
+
+
+def set_query_filter_rules(query_id, rules_json):
+    """
+    Set filter rules of a query.
+    
+    Args:
+        query_id: ID of the query
+        rules_json: Rules as JSON text (None or empty to remove the rules)
+        
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    conn = None
+    try:
+        conn, db_type = get_db_connection()
+        cursor = conn.cursor()
+        
+        if db_type == 'postgresql':
+            cursor.execute("UPDATE queries SET filter_rules = %s WHERE id = %s", (rules_json or None, query_id))
+        else:
+            cursor.execute("UPDATE queries SET filter_rules = ? WHERE id = ?", (rules_json or None, query_id))
+        
+        conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error setting filter rules of query {query_id}: {e}")
+        print_exc()
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
 def set_query_priority(query_id, is_priority):
     """
     Set priority status for a query.
@@ -844,13 +1328,81 @@ def set_parameter(key, value):
             conn.close()
 
 
+def save_state_snapshot(name, payload):
+    """
+    Store a shutdown state snapshot (JSON) in the parameters table.
+    
+    Args:
+        name: Snapshot owner ("main" or "shard<N>")
+        payload: JSON text
+    """
+    conn = None
+    try:
+        conn, db_type = get_db_connection()
+        cursor = conn.cursor()
+        
+        if db_type == 'postgresql':
+            cursor.execute("""
+                INSERT INTO parameters (key, value) VALUES (%s, %s)
+                ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+            """, (f"state_snapshot:{name}", payload))
+        else:
+            cursor.execute("""
+                INSERT INTO parameters (key, value) VALUES (?, ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value
+            """, (f"state_snapshot:{name}", payload))
+        
+        conn.commit()
+        return True
+    except Exception:
+        print_exc()
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_state_snapshots():
+    """Get all shutdown state snapshots (JSON texts)"""
+    conn = None
+    try:
+        conn, db_type = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT value FROM parameters WHERE key LIKE 'state_snapshot:%'")
+        return [row[0] for row in cursor.fetchall() if row[0]]
+    except Exception:
+        print_exc()
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
+def delete_state_snapshots():
+    """Delete all shutdown state snapshots (a snapshot is restored only once)"""
+    conn = None
+    try:
+        conn, db_type = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM parameters WHERE key LIKE 'state_snapshot:%'")
+        conn.commit()
+        return True
+    except Exception:
+        print_exc()
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
 def get_all_parameters():
     conn = None
     try:
         conn, db_type = get_db_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT key, value FROM parameters")
-        params = {row[0]: row[1] for row in cursor.fetchall()}
+        # Shutdown state snapshots are not settings
+        params = {row[0]: row[1] for row in cursor.fetchall() if not row[0].startswith("state_snapshot:")}
         
         # Override with environment variables if available
         env_mapping = {
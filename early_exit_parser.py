@@ -0,0 +1,253 @@
+"""
+Early-exit parsing of catalog responses.
+
+A scan only cares about items the query hasn't seen yet, and on a quiet
+query that's none of them - yet every scan decoded the whole page (20+ items
+with photos, prices, users) only to drop everything in the seen items check.
+
+Catalog pages are newest first, so the new items are a prefix of the page.
+Instead of decoding the page, the parser walks the raw bytes of the items
+array: every item object starts with its "id" key, so one regex pass yields
+the item ids and where each item starts. Ids are checked against the query's
+seen items; only the bytes BEFORE the first seen item are decoded (the rest
+of the page is never materialised - on a quiet query nothing is decoded).
+
+Full parsing is used instead whenever an assumption doesn't hold:
+- baseline scan (nothing seen yet for the query)
+- an unseen item AFTER a seen one (ordering broken - bumped/promoted items)
+- the decoded prefix doesn't match the ids found by the walk (unexpected layout)
+- every early_exit_audit_interval-th scan of a query: full parse + check that
+  the walk found exactly the page's items; on a mismatch early exit is
+  disabled for that query for DISABLE_SECONDS
+"""
+import re
+import threading
+import time
+from collections import Counter
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Fast JSON decoder if available
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+ITEMS_ARRAY = re.compile(rb'"items"\s*:\s*\[')
+# Object whose first key is "id" (the API sends compact JSON; '"' can't be unescaped inside a
+# string). A literal prefix keeps the regex fast - it's an item if '[' or ',' precedes it.
+ID_OBJECT = re.compile(rb'\{"id":(\d+)')
+ITEM_SEPARATORS = b"[,"
+
+# How long early exit stays off for a query after a failed audit (seconds)
+DISABLE_SECONDS = 3600
+# How often the parameters are re-read (seconds)
+CONFIG_RELOAD_INTERVAL = 30
+
+# Defaults for the DB parameters
+DEFAULT_AUDIT_INTERVAL = 50
+
+
+class PartialPage(list):
+    """Decoded new items of a page; scanned = number of items on the page"""
+
+    def __init__(self, items, scanned):
+        super().__init__(items)
+        self.scanned = scanned
+
+
+def _walk_items(content):
+    """
+    Item ids and start offsets of the page's items array, without decoding it.
+
+    Returns:
+        tuple: (offset after '[', [(item_id, offset of the separator before the item)]) or (None, None)
+    """
+    array = ITEMS_ARRAY.search(content)
+    if array is None:
+        return None, None
+    start = array.end()
+    # Nested objects ("user":{"id":...}) are preceded by ':'
+    return start, [(int(m.group(1)), m.start() - 1) for m in ID_OBJECT.finditer(content, start)
+                   if content[m.start() - 1] in ITEM_SEPARATORS]
+
+
+def _full_items(content):
+    return _json_loads(content)["items"]
+
+
+class EarlyExitParser:
+    """
+    Early-exit parsing of catalog pages against the query's seen items.
+
+    Features:
+    - Only the new prefix of a page is decoded
+    - Fallback to full parsing when ordering / layout assumptions break
+    - Periodic audits (full parse) that switch early exit off per query on a mismatch
+    - Early exit / fallback counters and parse time per path
+    """
+
+    def __init__(self, config=None):
+        """
+        Args:
+            config: Fixed config ({"enabled", "audit_interval"}, benchmarks) - None = DB parameters
+        """
+        self.lock = threading.Lock()
+        self.config = dict(config) if config else {}
+        self.fixed_config = config is not None
+        self.config_loaded = 0
+        self.scan_counts = Counter()
+        self.disabled_until = {}
+
+        # Metrics
+        self.early_exits = 0
+        self.full_parses = Counter()  # reason -> count
+        self.items_decoded = 0
+        self.items_skipped = 0
+        self.audits = 0
+        self.audit_mismatches = 0
+        self.early_exit_seconds = 0.0
+        self.full_parse_seconds = 0.0
+
+    def _maybe_reload(self):
+        if self.fixed_config or self.config and time.time() - self.config_loaded < CONFIG_RELOAD_INTERVAL:
+            return
+        import db
+        try:
+            audit_interval = int(db.get_parameter("early_exit_audit_interval") or DEFAULT_AUDIT_INTERVAL)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"[EARLY_EXIT] Invalid early_exit_audit_interval, using default: {e}")
+            audit_interval = DEFAULT_AUDIT_INTERVAL
+        self.config = {
+            "enabled": str(db.get_parameter("early_exit_parsing_enabled") or "True").lower() == "true",
+            "audit_interval": audit_interval,
+        }
+        self.config_loaded = time.time()
+
+    def _full_parse(self, content, reason, started):
+        items = _full_items(content)
+        with self.lock:
+            self.full_parses[reason] += 1
+            self.items_decoded += len(items)
+            self.full_parse_seconds += time.perf_counter() - started
+        return items
+
+    def _audit(self, content, query_id, walked_ids, started):
+        """Full parse that checks the walk found exactly the page's items"""
+        items = _full_items(content)
+        ok = [item["id"] for item in items] == walked_ids
+        with self.lock:
+            self.audits += 1
+            self.items_decoded += len(items)
+            self.full_parse_seconds += time.perf_counter() - started
+            if not ok:
+                self.audit_mismatches += 1
+                self.disabled_until[query_id] = time.time() + DISABLE_SECONDS
+        if not ok:
+            logger.warning(f"[EARLY_EXIT] Query {query_id}: item walk doesn't match the page "
+                           f"({len(walked_ids)} walked vs {len(items)} items) - early exit off for "
+                           f"{DISABLE_SECONDS // 60} min")
+        return items
+
+    def parse(self, content, query_id):
+        """
+        Decode the items of a catalog page, skipping items the query has already seen.
+
+        Args:
+            content: Raw response body (bytes)
+            query_id: Query whose seen items are skipped (seen items tracker key)
+
+        Returns:
+            list: Raw item dicts - a PartialPage of the new items, or the full page
+                (fallbacks, audits, disabled) which the caller dedups as usual
+        """
+        from seen_items import get_seen_items_tracker
+        started = time.perf_counter()
+        self._maybe_reload()
+        if not self.config["enabled"]:
+            return _full_items(content)
+        if time.time() < self.disabled_until.get(query_id, 0):
+            return self._full_parse(content, "disabled", started)
+
+        start, walked = _walk_items(content)
+        if not walked or walked[0][1] != start - 1:
+            # No items, or the first item doesn't start with its id
+            return self._full_parse(content, "layout", started)
+        walked_ids = [item_id for item_id, _ in walked]
+
+        with self.lock:
+            self.scan_counts[query_id] += 1
+            interval = self.config["audit_interval"]
+            audit = interval > 0 and self.scan_counts[query_id] % interval == 0
+        if audit:
+            return self._audit(content, query_id, walked_ids, started)
+
+        seen = get_seen_items_tracker().seen_flags(query_id, walked_ids)
+        if seen is None:
+            return self._full_parse(content, "baseline", started)
+        if True not in seen:
+            return self._full_parse(content, "all_new", started)
+        first_seen = seen.index(True)
+        if False in seen[first_seen:]:
+            return self._full_parse(content, "ordering", started)
+
+        if first_seen:
+            try:
+                items = _json_loads(b"[" + content[start:walked[first_seen][1]] + b"]")
+                consistent = [item["id"] for item in items] == walked_ids[:first_seen]
+            except (ValueError, TypeError, KeyError):
+                consistent = False
+            if not consistent:
+                return self._full_parse(content, "layout", started)
+        else:
+            items = []
+
+        with self.lock:
+            self.early_exits += 1
+            self.items_decoded += len(items)
+            self.items_skipped += len(walked) - len(items)
+            self.early_exit_seconds += time.perf_counter() - started
+        return PartialPage(items, len(walked))
+
+    def forget(self, query_id):
+        """Drop per-query state (query removed)"""
+        with self.lock:
+            self.scan_counts.pop(query_id, None)
+            self.disabled_until.pop(query_id, None)
+
+    def get_stats(self):
+        """Get early-exit parsing statistics"""
+        with self.lock:
+            full_parses = sum(self.full_parses.values())
+            total = self.early_exits + full_parses + self.audits
+            decoded_total = self.items_decoded + self.items_skipped
+            return {
+                "enabled": self.config.get("enabled"),
+                "early_exits": self.early_exits,
+                "early_exit_rate": round(self.early_exits / total * 100, 1) if total else 0.0,
+                "full_parses": dict(self.full_parses),
+                "audits": self.audits,
+                "audit_mismatches": self.audit_mismatches,
+                "disabled_queries": sum(1 for until in self.disabled_until.values() if until > time.time()),
+                "items_decoded": self.items_decoded,
+                "items_skipped": self.items_skipped,
+                "skipped_rate": round(self.items_skipped / decoded_total * 100, 1) if decoded_total else 0.0,
+                "avg_early_exit_us": round(self.early_exit_seconds / self.early_exits * 1e6, 1) if self.early_exits else 0.0,
+                "avg_full_parse_us": round(self.full_parse_seconds / (full_parses + self.audits) * 1e6, 1)
+                                     if full_parses + self.audits else 0.0,
+            }
+
+
+# Global early-exit parser instance
+_global_parser = None
+_global_parser_lock = threading.Lock()
+
+
+def get_early_exit_parser():
+    """Get or create global early-exit parser"""
+    global _global_parser
+    with _global_parser_lock:
+        if _global_parser is None:
+            _global_parser = EarlyExitParser()
+        return _global_parser
@@ -0,0 +1,287 @@
+"""
+Per-query filter rules evaluated in memory on every scanned batch.
+
+Vinted's search only supports coarse filters, so finer rules meant noisy
+notifications or extra queries. Each query can now carry rules (JSON in
+queries.filter_rules) that are applied by the item processor BEFORE the DB
+insert and the Telegram send:
+
+    {
+        "price_min": 10, "price_max": 80,
+        "brand_allow": ["Nike", "Adidas"], "brand_deny": ["Shein"],
+        "size_allow": ["42", "43"], "size_deny": [],
+        "title_include": ["air max", "jordan"], "title_exclude": ["fake", "replica"],
+        "title_regex": false
+    }
+
+Rules are compiled once per query (and again only when they change):
+brand/size lists become casefolded sets, all include/exclude keywords become
+ONE prefix-trie regex each, so a title is scanned once no matter how many
+keywords a query has. title_regex=true treats the keywords as regexes.
+"""
+import json
+import re
+import threading
+import time
+from collections import deque
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+RULE_KEYS = ("price_min", "price_max", "brand_allow", "brand_deny", "size_allow", "size_deny",
+             "title_include", "title_exclude", "title_regex")
+# How many recent batch timings are kept for avg/p95 metrics
+TIMING_SAMPLES_WINDOW = 1000
+
+
+def _parse_price(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _name_set(values):
+    return frozenset(str(v).strip().casefold() for v in values or [] if str(v).strip())
+
+
+def _trie_regex(words):
+    """
+    Regex of a prefix trie of plain keywords - "air max|air force" becomes
+    "air\\ (?:max|force)", so the engine doesn't retry every keyword at every position.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        if "" in node and len(node) == 1:
+            return ""
+        optional = "" in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        pattern = "(?:" + "|".join(branches) + ")"
+        return pattern + "?" if optional else pattern
+
+    return build(trie)
+
+
+def _keyword_pattern(keywords, as_regex):
+    """ONE case-insensitive pattern for all keywords (None if there are none)"""
+    keywords = [str(k) for k in keywords or [] if str(k).strip()]
+    if not keywords:
+        return None
+    if as_regex:
+        return re.compile("|".join(f"(?:{k})" for k in keywords), re.IGNORECASE)
+    return re.compile(_trie_regex({k.strip().casefold() for k in keywords}), re.IGNORECASE)
+
+
+def parse_rules(rules):
+    """
+    Validate rules (dict or JSON string).
+
+    Returns:
+        dict: Normalized rules
+
+    Raises:
+        ValueError: Invalid JSON, unknown key, bad price or bad regex
+    """
+    if isinstance(rules, str):
+        try:
+            rules = json.loads(rules) if rules.strip() else {}
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid filter rules JSON: {e}")
+    if not isinstance(rules, dict):
+        raise ValueError("Filter rules must be a JSON object")
+    unknown = set(rules) - set(RULE_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown filter rule(s): {', '.join(sorted(unknown))}")
+    for key in ("price_min", "price_max"):
+        if rules.get(key) not in (None, "") and _parse_price(rules[key]) is None:
+            raise ValueError(f"{key} must be a number")
+    for key in ("brand_allow", "brand_deny", "size_allow", "size_deny", "title_include", "title_exclude"):
+        if not isinstance(rules.get(key) or [], list):
+            raise ValueError(f"{key} must be a list")
+    # Compiling validates the regexes
+    try:
+        CompiledFilter(rules)
+    except re.error as e:
+        raise ValueError(f"Invalid title regex: {e}")
+    return rules
+
+
+class CompiledFilter:
+    """Rules of ONE query, compiled for fast evaluation"""
+
+    def __init__(self, rules):
+        as_regex = bool(rules.get("title_regex"))
+        self.price_min = _parse_price(rules.get("price_min"))
+        self.price_max = _parse_price(rules.get("price_max"))
+        self.brand_allow = _name_set(rules.get("brand_allow"))
+        self.brand_deny = _name_set(rules.get("brand_deny"))
+        self.size_allow = _name_set(rules.get("size_allow"))
+        self.size_deny = _name_set(rules.get("size_deny"))
+        self.title_include = _keyword_pattern(rules.get("title_include"), as_regex)
+        self.title_exclude = _keyword_pattern(rules.get("title_exclude"), as_regex)
+        self.rule_count = sum(len(rules.get(k) or []) for k in RULE_KEYS[2:8]) + \
+            (self.price_min is not None) + (self.price_max is not None)
+
+    def check(self, item):
+        """
+        Evaluate the rules on one item (cheapest checks first).
+
+        Returns:
+            str or None: Name of the rule that rejected the item, None if it passes
+        """
+        if self.price_min is not None or self.price_max is not None:
+            price = _parse_price(item.price)
+            if price is None:
+                return "price"
+            if self.price_min is not None and price < self.price_min:
+                return "price_min"
+            if self.price_max is not None and price > self.price_max:
+                return "price_max"
+        if self.brand_allow or self.brand_deny:
+            brand = (item.brand_title or "").strip().casefold()
+            if self.brand_allow and brand not in self.brand_allow:
+                return "brand_allow"
+            if brand in self.brand_deny:
+                return "brand_deny"
+        if self.size_allow or self.size_deny:
+            size = (item.size_title or "").strip().casefold()
+            if self.size_allow and size not in self.size_allow:
+                return "size_allow"
+            if size in self.size_deny:
+                return "size_deny"
+        if self.title_include is not None and not self.title_include.search(item.title or ""):
+            return "title_include"
+        if self.title_exclude is not None and self.title_exclude.search(item.title or ""):
+            return "title_exclude"
+        return None
+
+
+class FilterEngine:
+    """
+    Compiled filters of all queries.
+
+    Features:
+    - Rules loaded from the DB only after invalidate() (never while idle)
+    - Recompiled only for queries whose rules text changed
+    - Per-rule rejection counters and batch evaluation timings
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.filters = {}
+        self.rules_text = {}
+        self.version = 0
+        self.loaded_version = -1
+
+        # Metrics
+        self._batch_samples = deque(maxlen=TIMING_SAMPLES_WINDOW)
+        self.total_batches = 0
+        self.total_items = 0
+        self.total_rejected = 0
+        self.total_eval_seconds = 0.0
+        self.rejected_by_rule = {}
+        self.compile_errors = 0
+
+    def invalidate(self):
+        with self.lock:
+            self.version += 1
+
+    def _reload(self):
+        import db
+        with self.lock:
+            version = self.version
+        rules_by_query = db.get_query_filter_rules()
+        filters = {}
+        for query_id, text in rules_by_query.items():
+            if self.rules_text.get(query_id) == text and query_id in self.filters:
+                filters[query_id] = self.filters[query_id]
+                continue
+            try:
+                filters[query_id] = CompiledFilter(parse_rules(text))
+            except ValueError as e:
+                self.compile_errors += 1
+                logger.warning(f"[FILTER] Invalid rules of query #{query_id} ignored: {e}")
+        with self.lock:
+            self.filters = filters
+            self.rules_text = rules_by_query
+            self.loaded_version = version
+        logger.debug(f"[FILTER] Filter rules loaded for {len(filters)} queries")
+
+    def filter_batch(self, query_id, items):
+        """
+        Keep only the items passing the query's rules.
+
+        Args:
+            query_id: Query the batch belongs to
+            items: Items of the batch
+
+        Returns:
+            list: Items that passed (the input list if the query has no rules)
+        """
+        if self.loaded_version != self.version:
+            self._reload()
+        compiled = self.filters.get(query_id)
+        if compiled is None or not items:
+            return items
+
+        start = time.perf_counter()
+        kept = []
+        rejected = {}
+        for item in items:
+            rule = compiled.check(item)
+            if rule is None:
+                kept.append(item)
+            else:
+                rejected[rule] = rejected.get(rule, 0) + 1
+        elapsed = time.perf_counter() - start
+
+        with self.lock:
+            self._batch_samples.append(elapsed)
+            self.total_batches += 1
+            self.total_items += len(items)
+            self.total_rejected += len(items) - len(kept)
+            self.total_eval_seconds += elapsed
+            for rule, count in rejected.items():
+                self.rejected_by_rule[rule] = self.rejected_by_rule.get(rule, 0) + count
+        if rejected:
+            logger.debug(f"[FILTER] Query #{query_id}: {len(items) - len(kept)}/{len(items)} items filtered out {rejected}")
+        return kept
+
+    def get_stats(self):
+        """Get filter engine statistics (rejections and evaluation timings)"""
+        with self.lock:
+            samples = sorted(self._batch_samples)
+            return {
+                "queries_with_rules": len(self.filters),
+                "total_rules": sum(f.rule_count for f in self.filters.values()),
+                "compile_errors": self.compile_errors,
+                "total_batches": self.total_batches,
+                "total_items": self.total_items,
+                "total_rejected": self.total_rejected,
+                "rejected_by_rule": dict(self.rejected_by_rule),
+                "avg_us_per_item": round(self.total_eval_seconds / self.total_items * 1e6, 2) if self.total_items else 0.0,
+                "batch_avg_ms": round(sum(samples) / len(samples) * 1000, 3) if samples else 0.0,
+                "batch_p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3) if samples else 0.0,
+            }
+
+
+# Global filter engine instance
+_global_engine = None
+_global_engine_lock = threading.Lock()
+
+
+def get_filter_engine():
+    """Get or create global filter engine"""
+    global _global_engine
+    with _global_engine_lock:
+        if _global_engine is None:
+            _global_engine = FilterEngine()
+        return _global_engine
@@ -0,0 +1,327 @@
+"""
+Graceful drain and state handoff on shutdown / self-redeploy.
+
+The self-redeploy used to os._exit() after 3 seconds: batches in the scan and
+notify queues were lost, in-flight Telegram sends were cut and everything the
+workers had learned (seen ids, arrival rates, throttle) started cold again.
+A shutdown (redeploy, SIGTERM, Ctrl+C) now runs this protocol:
+
+1. Stop scheduling: supervisor and reconciler stop, the scan scheduler
+   (or every shard process) stops dispatching new scans
+2. Drain in-flight scans - their items still reach the scan queue
+3. Drain the scan queue (item processor) and the notify queue (Telegram)
+4. Flush state: seen ids + watermarks, adaptive arrival rates, the rate
+   limiter throttle and the worker / item processor / Telegram counters go
+   to a DB snapshot; cluster leases are released
+5. Exit
+
+Everything runs within shutdown_drain_timeout seconds; a watchdog forces
+the exit if a step hangs. On the next start the coordinator takes the
+snapshots (take_state_snapshots() - they are deleted, so a crash-restart
+doesn't load the same old state again) and hands them to the scan slots
+(restore_state_snapshots()) and the pipeline (restore_pipeline_counters()):
+the first scan is not a baseline and page-overflow catch-up recovers the
+items published during the restart.
+"""
+import json
+import os
+import threading
+import time
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Default drain deadline (seconds) - Railway sends SIGKILL 30s after SIGTERM
+DEFAULT_DRAIN_TIMEOUT = 25
+# Snapshots older than this are ignored on start (seconds)
+SNAPSHOT_MAX_AGE = 3600
+# Extra time before the watchdog forces the exit (seconds)
+WATCHDOG_GRACE = 10
+
+# Counters handed over to the next process (added to its own counters on restore)
+ITEM_PROCESSOR_COUNTERS = ("total_batches", "total_items", "total_passed_items", "total_new_items",
+                           "total_dropped_batches")
+TELEGRAM_COUNTERS = ("total_sent", "total_failed")
+WORKER_COUNTERS = ("total_scans", "total_items", "total_errors")
+
+_pipeline = {}
+_shutdown_lock = threading.Lock()
+_shutdown_started = False
+
+
+def register_pipeline(items_queue=None, new_items_queue=None, item_processor=None, telegram_sender=None):
+    """Register the pipeline stages that must be drained before exit"""
+    for key, value in (("items_queue", items_queue), ("new_items_queue", new_items_queue),
+                       ("item_processor", item_processor), ("telegram_sender", telegram_sender)):
+        if value is not None:
+            _pipeline[key] = value
+
+
+def is_shutting_down():
+    return _shutdown_started
+
+
+def _get_drain_timeout():
+    import db
+    try:
+        return float(db.get_parameter("shutdown_drain_timeout") or DEFAULT_DRAIN_TIMEOUT)
+    except (ValueError, TypeError):
+        return DEFAULT_DRAIN_TIMEOUT
+
+
+def snapshot_name():
+    """Snapshot owner of THIS process: "main" or "shard<N>" """
+    import core
+    shard = core.get_worker_shard()
+    return f"shard{shard[0]}" if shard else "main"
+
+
+def _export_counters():
+    import core
+    counters = {
+        # JSON object keys are strings
+        "workers": {str(worker_id): {key: stats[key] for key in WORKER_COUNTERS}
+                    for worker_id, stats in core.get_worker_stats().items()},
+    }
+    item_processor = _pipeline.get("item_processor")
+    if item_processor:
+        counters["item_processor"] = {key: getattr(item_processor, key) for key in ITEM_PROCESSOR_COUNTERS}
+    telegram_sender = _pipeline.get("telegram_sender")
+    if telegram_sender:
+        counters["telegram"] = {key: getattr(telegram_sender, key) for key in TELEGRAM_COUNTERS}
+        counters["telegram"]["last_update_id"] = telegram_sender.last_update_id
+    return counters
+
+
+def export_state():
+    """State of THIS process worth keeping across a restart"""
+    from seen_items import get_seen_items_tracker
+    from adaptive_refresh import get_adaptive_refresh_controller
+    from rate_limiter import get_rate_limiter
+    return {
+        "name": snapshot_name(),
+        "saved_at": time.time(),
+        "seen": get_seen_items_tracker().export_state(),
+        "adaptive": get_adaptive_refresh_controller().export_state(),
+        "throttle_factor": get_rate_limiter().throttle_factor,
+        "counters": _export_counters(),
+    }
+
+
+def save_state_snapshot(name):
+    """Flush the state snapshot of this process to the DB"""
+    import db
+    try:
+        state = export_state()
+        if db.save_state_snapshot(name, json.dumps(state)):
+            logger.info(f"[SHUTDOWN] 💾 State snapshot '{name}' saved "
+                        f"({len(state['seen'])} queries, throttle {state['throttle_factor']:.2f})")
+            return True
+    except Exception as e:
+        logger.error(f"[SHUTDOWN] Failed to save state snapshot '{name}': {e}", exc_info=True)
+    return False
+
+
+def take_state_snapshots():
+    """
+    Load the recent shutdown snapshots and delete them from the DB - a snapshot
+    is restored once (the coordinator takes them on start and hands them on).
+
+    Returns:
+        list: Snapshot states (dicts), stale and invalid ones skipped
+    """
+    import db
+    states = []
+    for payload in db.get_state_snapshots():
+        try:
+            state = json.loads(payload)
+            if time.time() - state.get("saved_at", 0) > SNAPSHOT_MAX_AGE:
+                continue
+            states.append(state)
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.warning(f"[SHUTDOWN] Ignoring invalid state snapshot: {e}")
+    db.delete_state_snapshots()
+    return states
+
+
+def restore_state_snapshots(states=None):
+    """
+    Load shutdown snapshots into this process (before scan slots start).
+    Seen ids and arrival rates are keyed by query id, so every process loads
+    every snapshot; worker counters only come from the process's own snapshot.
+
+    Args:
+        states: Snapshots taken by the coordinator (None = take them from the DB now)
+
+    Returns:
+        int: Number of snapshots restored
+    """
+    import core
+    from seen_items import get_seen_items_tracker
+    from adaptive_refresh import get_adaptive_refresh_controller
+    from rate_limiter import get_rate_limiter
+    if states is None:
+        states = take_state_snapshots()
+    name = snapshot_name()
+    restored = 0
+    throttle = None
+    for state in states:
+        try:
+            # JSON object keys are strings - query ids / worker ids are ints
+            get_seen_items_tracker().import_state({int(k): v for k, v in state.get("seen", {}).items()})
+            get_adaptive_refresh_controller().import_state({int(k): v for k, v in state.get("adaptive", {}).items()})
+            if state.get("throttle_factor") is not None:
+                throttle = min(throttle or 1.0, state["throttle_factor"])
+            if state.get("name") == name:
+                workers = state.get("counters", {}).get("workers", {})
+                core.restore_worker_stats({int(k): v for k, v in workers.items()})
+            restored += 1
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.warning(f"[SHUTDOWN] Ignoring invalid state snapshot: {e}")
+    if throttle is not None:
+        get_rate_limiter().throttle_factor = throttle
+    if restored:
+        logger.info(f"[SHUTDOWN] ♻️ Restored {restored} state snapshot(s) - no cold start")
+    return restored
+
+
+def restore_pipeline_counters(states):
+    """Add the item processor / Telegram counters of the previous coordinator (after register_pipeline)"""
+    for state in states:
+        if state.get("name") != "main":
+            continue
+        counters = state.get("counters") or {}
+        item_processor = _pipeline.get("item_processor")
+        if item_processor:
+            for key, value in (counters.get("item_processor") or {}).items():
+                if key in ITEM_PROCESSOR_COUNTERS:
+                    setattr(item_processor, key, getattr(item_processor, key) + value)
+        telegram_sender = _pipeline.get("telegram_sender")
+        telegram = counters.get("telegram") or {}
+        if telegram_sender and telegram:
+            for key in TELEGRAM_COUNTERS:
+                setattr(telegram_sender, key, getattr(telegram_sender, key) + telegram.get(key, 0))
+            telegram_sender.last_update_id = max(telegram_sender.last_update_id, telegram.get("last_update_id") or 0)
+
+
+def _wait_until(condition, deadline, interval=0.1, settle=3):
+    """
+    Poll until condition() is true on `settle` consecutive polls (a consumer may be
+    between get() and marking itself busy) or the deadline passes.
+    """
+    streak = 0
+    while True:
+        streak = streak + 1 if condition() else 0
+        if streak >= settle:
+            return True
+        if time.time() >= deadline:
+            return False
+        time.sleep(interval)
+
+
+def drain_scans(deadline):
+    """Stop scheduling new scans and wait for in-flight scans (this process)"""
+    import core
+    from scan_scheduler import get_scan_scheduler
+    supervisor = core.get_worker_supervisor()
+    if supervisor:
+        supervisor.stop()
+    reconciler = core.get_worker_reconciler()
+    if reconciler:
+        reconciler.stop()
+    return get_scan_scheduler().drain(max(0.0, deadline - time.time()))
+
+
+def drain_and_exit(reason, exit_code=0):
+    """
+    Run the shutdown protocol and exit the process.
+
+    Args:
+        reason: What triggered the shutdown (for logs)
+        exit_code: Process exit code
+    """
+    from cluster import get_cluster_node
+    from worker_sharding import get_shard_manager
+    from seller_country import get_seller_country_filter
+    timeout = _get_drain_timeout()
+    started = time.time()
+    deadline = started + timeout
+
+    # Watchdog: never hang on exit
+    watchdog = threading.Timer(timeout + WATCHDOG_GRACE, lambda: os._exit(exit_code))
+    watchdog.daemon = True
+    watchdog.start()
+
+    logger.warning(f"[SHUTDOWN] 🛑 Graceful shutdown ({reason}) - draining within {timeout:.0f}s")
+    try:
+        # 1-2. Stop scheduling, drain in-flight scans
+        cluster_node = get_cluster_node()
+        shard_manager = get_shard_manager()
+        if shard_manager:
+            shard_manager.drain(max(0.0, deadline - time.time()))
+        else:
+            in_flight = drain_scans(deadline)
+            if in_flight:
+                logger.warning(f"[SHUTDOWN] ⚠️ {in_flight} scans did not finish in time")
+
+        # 3. Drain the scan queue, then the notify queue
+        items_queue = _pipeline.get("items_queue")
+        item_processor = _pipeline.get("item_processor")
+        if items_queue is not None:
+            # Items held for a seller country lookup come back through the scan queue
+            seller_filter = get_seller_country_filter()
+            drained = _wait_until(lambda: items_queue.empty() and not (item_processor and item_processor.busy)
+                                  and not seller_filter.pending_items(), deadline)
+            if not drained:
+                logger.warning(f"[SHUTDOWN] ⚠️ Scan queue not drained ({items_queue.qsize()} batches left)")
+        if item_processor:
+            item_processor.shutdown()
+
+        new_items_queue = _pipeline.get("new_items_queue")
+        telegram_sender = _pipeline.get("telegram_sender")
+        if new_items_queue is not None:
+            drained = _wait_until(lambda: new_items_queue.empty() and not (telegram_sender and telegram_sender.sending), deadline)
+            if not drained:
+                logger.warning(f"[SHUTDOWN] ⚠️ Notify queue not drained ({new_items_queue.qsize()} messages left)")
+        if telegram_sender:
+            telegram_sender.stop()
+
+        # 4. Flush state and counters (shard processes flushed their own snapshots)
+        save_state_snapshot("main")
+        if cluster_node:
+            cluster_node.leave()
+    except Exception as e:
+        logger.error(f"[SHUTDOWN] Error during graceful shutdown: {e}", exc_info=True)
+
+    logger.warning(f"[SHUTDOWN] ✅ Shutdown complete in {time.time() - started:.1f}s - exiting (code {exit_code})")
+    # 5. Flask's app.run() blocks the main thread - a hard exit is still needed, now AFTER the drain
+    os._exit(exit_code)
+
+
+def request_graceful_shutdown(reason, exit_code=0, wait=False):
+    """
+    Start the shutdown protocol (only the first call counts).
+
+    Args:
+        reason: What triggered the shutdown (for logs)
+        exit_code: Process exit code
+        wait: Run it in the calling thread (Ctrl+C in the main thread) - never returns,
+            also when another shutdown is already running (it exits the process)
+
+    Returns:
+        bool: True if this call started the shutdown (in the background)
+    """
+    global _shutdown_started
+    with _shutdown_lock:
+        started = not _shutdown_started
+        _shutdown_started = True
+    if wait:
+        if started:
+            drain_and_exit(reason, exit_code)
+        while True:
+            time.sleep(1)
+    if not started:
+        return False
+    threading.Thread(target=drain_and_exit, args=(reason, exit_code), name="graceful-shutdown",
+                     daemon=True).start()
+    return True
@@ -0,0 +1,259 @@
+"""
+Hedged catalog requests for priority queries.
+
+Priority queries exist to catch listings seconds after they appear, but one
+slow proxy (requests time out after 30s) can hold a priority scan for the
+whole timeout. For priority scans only, the catalog request is hedged:
+
+1. the primary request goes out on the slot's own Token+Proxy pair
+2. if it hasn't answered within the hedge threshold (p90 of recent primary
+   latencies, at least hedge_min_delay), an identical request goes out via
+   ANOTHER pair bound to a different proxy
+3. the first successful response wins; the other one is abandoned (sync HTTP
+   calls can't be aborted mid-flight - its result is simply dropped)
+
+Hedges are optional traffic: one is only sent while the rate limiter has
+spare capacity for the hedge pair's proxy and while hedges stay below
+hedge_max_rate of hedge-eligible requests.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# How many recent primary latencies are kept for the p90 threshold
+LATENCY_SAMPLES_WINDOW = 500
+# Threshold used until enough latencies were observed (seconds)
+INITIAL_HEDGE_DELAY = 2.0
+MIN_LATENCY_SAMPLES = 20
+# How often the parameters are re-read (seconds, only while scans run)
+CONFIG_RELOAD_INTERVAL = 30
+
+# Defaults for the DB parameters
+DEFAULT_MIN_DELAY = 0.5
+DEFAULT_MAX_RATE = 0.1
+
+
+def _start(func, *args, **kwargs):
+    """Run func in its own daemon thread, result in a Future"""
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="hedged-request", daemon=True).start()
+    return future
+
+
+def _succeeded(future):
+    """Items.search() returns a (response, status_code) tuple on HTTP errors"""
+    return future.exception() is None and not isinstance(future.result(), tuple)
+
+
+def _report_health(token_pool, session, future):
+    """Report the outcome of a finished request to its pair"""
+    error = future.exception()
+    if error is not None:
+        token_pool.report_error(session, error=error)
+    elif isinstance(future.result(), tuple):
+        token_pool.report_error(session, future.result()[1])
+    else:
+        token_pool.report_success(session)
+
+
+class HedgeController:
+    """
+    Hedging of priority catalog requests.
+
+    Features:
+    - p90-based hedge threshold from recent primary latencies
+    - Budget cap (rate limiter capacity + max hedge rate)
+    - Hedge rate, wins and skip counters
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.config = {}
+        self.config_loaded = 0
+        self._latencies = deque(maxlen=LATENCY_SAMPLES_WINDOW)
+
+        # Metrics
+        self.total_requests = 0
+        self.total_hedged = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+        self.both_failed = 0
+        self.rate_skips = 0
+        self.budget_skips = 0
+        self.no_pair_skips = 0
+        self.total_saved_seconds = 0.0
+        self.saved_samples = 0
+
+    def _maybe_reload(self):
+        import db
+        if self.config and time.time() - self.config_loaded < CONFIG_RELOAD_INTERVAL:
+            return
+        try:
+            config = {
+                "min_delay": float(db.get_parameter("hedge_min_delay") or DEFAULT_MIN_DELAY),
+                "max_rate": float(db.get_parameter("hedge_max_rate") or DEFAULT_MAX_RATE),
+            }
+        except (ValueError, TypeError) as e:
+            logger.warning(f"[HEDGE] Invalid hedging parameters, using defaults: {e}")
+            config = {"min_delay": DEFAULT_MIN_DELAY, "max_rate": DEFAULT_MAX_RATE}
+        config["enabled"] = str(db.get_parameter("hedged_requests_enabled") or "True").lower() == "true"
+        self.config = config
+        self.config_loaded = time.time()
+
+    def _record_latency(self, seconds):
+        with self.lock:
+            self._latencies.append(seconds)
+
+    def _record_saved(self, seconds):
+        with self.lock:
+            self.total_saved_seconds += seconds
+            self.saved_samples += 1
+
+    def get_threshold(self):
+        """Seconds to wait for the primary before hedging (p90 of primary latencies)"""
+        with self.lock:
+            samples = sorted(self._latencies)
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            threshold = INITIAL_HEDGE_DELAY
+        else:
+            threshold = samples[min(len(samples) - 1, int(len(samples) * 0.9))]
+        return max(self.config.get("min_delay", DEFAULT_MIN_DELAY), threshold)
+
+    def _pick_hedge_session(self, compiled, token_session, token_pool):
+        """Pair for the hedge, or None if the hedge is not allowed right now"""
+        from rate_limiter import get_rate_limiter
+        from circuit_breaker import get_circuit_breakers
+        with self.lock:
+            if self.total_hedged >= self.config["max_rate"] * self.total_requests:
+                self.rate_skips += 1
+                return None
+        hedge_session = token_pool.get_hedge_session(token_session)
+        if hedge_session is None:
+            with self.lock:
+                self.no_pair_skips += 1
+            return None
+        proxies = hedge_session.session.proxies
+        proxy = proxies.get("https") if proxies else None
+        if not get_rate_limiter().has_capacity(domain=compiled.locale, proxy=proxy):
+            with self.lock:
+                self.budget_skips += 1
+            return None
+        # Last check - in half-open state this takes the circuit's single probe
+        if not get_circuit_breakers().allow(hedge_session.proxy):
+            with self.lock:
+                self.no_pair_skips += 1
+            return None
+        return hedge_session
+
+    def search(self, items, compiled, token_session, token_pool, seen_key=None):
+        """
+        items.search(compiled, json=True, seen_key=seen_key), hedged if the primary is slow.
+
+        Args:
+            items: Items instance of the slot (its own Token+Proxy pair)
+            compiled: CompiledSearch of the query
+            token_session: The slot's TokenSession (the hedge uses another proxy)
+            token_pool: TokenPool to take the hedge pair from
+            seen_key: Query whose seen items are skipped while parsing (see Items.search)
+
+        Returns:
+            Same as Items.search(): raw items list, or (response, status_code)
+        """
+        from pyVintedVN.items.items import Items
+        self._maybe_reload()
+        if not self.config["enabled"]:
+            return items.search(compiled, json=True, seen_key=seen_key)
+
+        with self.lock:
+            self.total_requests += 1
+        started = time.perf_counter()
+        primary = _start(items.search, compiled, json=True, seen_key=seen_key)
+        primary.add_done_callback(lambda f: self._record_latency(time.perf_counter() - started))
+
+        threshold = self.get_threshold()
+        done, _ = wait([primary], timeout=threshold)
+        if done:
+            return primary.result()
+
+        hedge_session = self._pick_hedge_session(compiled, token_session, token_pool)
+        if hedge_session is None:
+            return primary.result()
+
+        with self.lock:
+            self.total_hedged += 1
+        logger.debug(f"[HEDGE] Primary slower than {threshold:.2f}s - hedging via session #{hedge_session.session_id}")
+        hedge = _start(Items(session=hedge_session.session).search, compiled, json=True, seen_key=seen_key)
+        # The hedge pair's health is reported even if its response arrives too late
+        hedge.add_done_callback(lambda f: _report_health(token_pool, hedge_session, f))
+
+        pending = {primary, hedge}
+        winner = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if _succeeded(future):
+                    winner = future
+                    break
+
+        with self.lock:
+            if winner is hedge:
+                self.hedge_wins += 1
+            elif winner is primary:
+                self.primary_wins += 1
+            else:
+                self.both_failed += 1
+        if winner is hedge:
+            won_at = time.perf_counter()
+            # Time saved = how much longer the primary still took (if it ever answers)
+            primary.add_done_callback(lambda f: self._record_saved(time.perf_counter() - won_at))
+            logger.info(f"[HEDGE] ⚡ Hedge won after {time.perf_counter() - started:.2f}s "
+                        f"(primary slower than {threshold:.2f}s)")
+            return hedge.result()
+        # Primary won, or both failed - the slot handles the primary's error as usual
+        return primary.result()
+
+    def get_stats(self):
+        """Get hedging statistics"""
+        threshold = self.get_threshold() if self.config else None
+        with self.lock:
+            hedged = self.total_hedged
+            return {
+                "enabled": self.config.get("enabled"),
+                "threshold_seconds": round(threshold, 3) if threshold is not None else None,
+                "total_requests": self.total_requests,
+                "total_hedged": hedged,
+                "hedge_rate": round(hedged / self.total_requests * 100, 1) if self.total_requests else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "primary_wins": self.primary_wins,
+                "both_failed": self.both_failed,
+                "win_rate": round(self.hedge_wins / hedged * 100, 1) if hedged else 0.0,
+                "rate_skips": self.rate_skips,
+                "budget_skips": self.budget_skips,
+                "no_pair_skips": self.no_pair_skips,
+                "avg_saved_seconds": round(self.total_saved_seconds / self.saved_samples, 2) if self.saved_samples else 0.0,
+            }
+
+
+# Global hedge controller instance
+_global_controller = None
+_global_controller_lock = threading.Lock()
+
+
+def get_hedge_controller():
+    """Get or create global hedge controller"""
+    global _global_controller
+    with _global_controller_lock:
+        if _global_controller is None:
+            _global_controller = HedgeController()
+        return _global_controller
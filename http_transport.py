@@ -0,0 +1,447 @@
+"""
+HTTP transport of the token sessions: HTTP/1.1 (requests) or HTTP/2 (httpx).
+
+Every TokenSession used to own a requests.Session - HTTP/1.1 only, so every
+worker kept its own TCP+TLS connection through its proxy and every new
+Token+Proxy pair paid a full handshake. With http2_enabled=True (and httpx[http2]
+installed) sessions are Http2Session objects instead:
+
+- ONE shared httpx transport (connection pool) per proxy - sessions bound to
+  the same proxy multiplex their requests over the same HTTP/2 connection
+- each session keeps its own headers and cookie jar (token, User-Agent)
+- the requests.Session subset used by TokenPool / Items.search is kept,
+  httpx errors are re-raised as requests exceptions
+
+HTTP/1.1 sessions no longer use default HTTPAdapter settings either: every
+proxy gets ONE shared TunedHTTPAdapter (explicit pool sizes, TCP_NODELAY +
+TCP keep-alive socket options, one retry on connect errors). A rotated
+session bound to the same proxy mounts the same adapter, so it reuses the
+warm keep-alive connection instead of paying TCP + proxy CONNECT + TLS
+again. (Python's ssl/urllib3 don't expose TLS session resumption - reusing
+the connection is how the handshake is avoided.)
+
+Both transports record the same metrics (get_transport_stats()): requests,
+new connections, handshake time (TCP + proxy CONNECT + TLS) and avg/p95
+latency of API and token (homepage) requests. Each session also keeps its
+own request/handshake counters (TokenPool.get_stats()).
+"""
+import importlib.util
+import socket
+import threading
+import time
+from collections import deque
+from http.cookiejar import CookieJar
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# httpx with the h2 package is optional (h2 is only needed by httpx for http2=True)
+try:
+    import httpx
+    HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP1 = "http1"
+HTTP2 = "http2"
+# How many recent latency / handshake samples are kept for avg/p95 metrics
+LATENCY_SAMPLES_WINDOW = 1000
+# Connection-specific headers are forbidden in HTTP/2 (h2 rejects them)
+HOP_BY_HOP_HEADERS = frozenset(("connection", "keep-alive", "proxy-connection", "transfer-encoding", "upgrade"))
+
+# Defaults for the DB parameters
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+# TCP keep-alive: first probe after 60s idle, then every 15s, give up after 4
+KEEPALIVE_IDLE = 60
+KEEPALIVE_INTERVAL = 15
+KEEPALIVE_COUNT = 4
+
+
+def _socket_options():
+    """TCP_NODELAY (urllib3 default) plus TCP keep-alive where the platform supports it"""
+    options = list(HTTPConnection.default_socket_options) + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    for name, value in (("TCP_KEEPIDLE", KEEPALIVE_IDLE), ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL),
+                        ("TCP_KEEPCNT", KEEPALIVE_COUNT)):
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    return options
+
+
+def _percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] if samples else 0.0
+
+
+class TransportStats:
+    """Request latency, connection and handshake counters per transport"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.transports = {}
+
+    def _get(self, transport):
+        stats = self.transports.get(transport)
+        if stats is None:
+            stats = {
+                "requests": 0,
+                "errors": 0,
+                "new_connections": 0,
+                "handshakes": deque(maxlen=LATENCY_SAMPLES_WINDOW),
+                "latency": {"api": deque(maxlen=LATENCY_SAMPLES_WINDOW),
+                            "token": deque(maxlen=LATENCY_SAMPLES_WINDOW)},
+            }
+            self.transports[transport] = stats
+        return stats
+
+    def record_request(self, transport, kind, seconds, ok=True):
+        with self.lock:
+            stats = self._get(transport)
+            stats["requests"] += 1
+            if not ok:
+                stats["errors"] += 1
+            stats["latency"][kind].append(seconds)
+
+    def record_connections(self, transport, count=1, handshake_seconds=None):
+        with self.lock:
+            stats = self._get(transport)
+            stats["new_connections"] += count
+            if handshake_seconds is not None:
+                stats["handshakes"].append(handshake_seconds)
+
+    def get_stats(self):
+        with self.lock:
+            result = {}
+            for transport, stats in self.transports.items():
+                handshakes = sorted(stats["handshakes"])
+                entry = {
+                    "requests": stats["requests"],
+                    "errors": stats["errors"],
+                    "new_connections": stats["new_connections"],
+                    "requests_per_connection": round(stats["requests"] / stats["new_connections"], 1)
+                    if stats["new_connections"] else None,
+                    "handshake_avg_ms": round(sum(handshakes) / len(handshakes) * 1000, 1) if handshakes else None,
+                    "handshake_p95_ms": round(_percentile(handshakes, 0.95) * 1000, 1) if handshakes else None,
+                }
+                for kind, samples in stats["latency"].items():
+                    samples = sorted(samples)
+                    entry[f"{kind}_avg_ms"] = round(sum(samples) / len(samples) * 1000, 1) if samples else 0.0
+                    entry[f"{kind}_p95_ms"] = round(_percentile(samples, 0.95) * 1000, 1)
+                result[transport] = entry
+            return result
+
+
+_transport_stats = TransportStats()
+
+
+def get_transport_stats():
+    """Get HTTP transport statistics (per transport: connections, handshakes, latency)"""
+    return {
+        "http2_available": HTTP2_AVAILABLE,
+        "http2_enabled": is_http2_enabled(),
+        "shared_http1_pools": len(_shared_adapters),
+        "shared_http2_pools": len(_shared_transports),
+        "transports": _transport_stats.get_stats(),
+    }
+
+
+def _request_kind(url):
+    return "api" if "/api/" in urlparse(url).path else "token"
+
+
+class SessionTransportStats:
+    """Request and handshake counters of ONE session"""
+
+    def __init__(self):
+        self.requests = 0
+        self.handshakes = 0
+        self.handshake_seconds = 0.0
+        self.last_handshake_seconds = None
+
+    def record_handshake(self, seconds):
+        self.handshakes += 1
+        self.handshake_seconds += seconds
+        self.last_handshake_seconds = seconds
+
+    def get_stats(self):
+        return {
+            "requests": self.requests,
+            "handshakes": self.handshakes,
+            "handshake_avg_ms": round(self.handshake_seconds / self.handshakes * 1000, 1) if self.handshakes else None,
+            "last_handshake_ms": round(self.last_handshake_seconds * 1000, 1)
+            if self.last_handshake_seconds is not None else None,
+        }
+
+
+# Session whose request is running on this thread - connections opened by
+# a SHARED adapter are attributed to it
+_current_request = threading.local()
+
+
+def _record_http1_handshake(seconds):
+    _transport_stats.record_connections(HTTP1, 1, seconds)
+    session_stats = getattr(_current_request, "stats", None)
+    if session_stats is not None:
+        session_stats.record_handshake(seconds)
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _record_http1_handshake(time.perf_counter() - start)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        # TCP connect + proxy CONNECT tunnel + TLS handshake
+        start = time.perf_counter()
+        super().connect()
+        _record_http1_handshake(time.perf_counter() - start)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+_TIMED_POOL_CLASSES = {"http": _TimedHTTPConnectionPool, "https": _TimedHTTPSConnectionPool}
+
+
+class TunedHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter with explicit pool sizes, keep-alive socket options, one retry
+    on connect errors and timed connection setup. Shared by all sessions
+    bound to the same proxy.
+    """
+
+    def __init__(self, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE):
+        # Connect errors happen before anything was sent - safe to retry once.
+        # Read errors and HTTP statuses are left to the scan path (pair rotation)
+        retries = Retry(total=1, connect=1, read=0, status=0, redirect=0, raise_on_status=False)
+        super().__init__(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retries)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs.setdefault("socket_options", _socket_options())
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = _TIMED_POOL_CLASSES
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        is_new = proxy not in self.proxy_manager
+        if not proxy.lower().startswith("socks"):
+            proxy_kwargs.setdefault("socket_options", _socket_options())
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        if is_new and not proxy.lower().startswith("socks"):
+            # SOCKS managers use their own connection classes - not timed
+            manager.pool_classes_by_scheme = _TIMED_POOL_CLASSES
+        return manager
+
+
+# proxy URL (None = direct) -> shared TunedHTTPAdapter
+_shared_adapters = {}
+_shared_adapters_lock = threading.Lock()
+
+
+def _pool_size_parameters():
+    import db
+    try:
+        return (int(db.get_parameter("http_pool_connections") or DEFAULT_POOL_CONNECTIONS),
+                int(db.get_parameter("http_pool_maxsize") or DEFAULT_POOL_MAXSIZE))
+    except (ValueError, TypeError):
+        return DEFAULT_POOL_CONNECTIONS, DEFAULT_POOL_MAXSIZE
+
+
+def _get_shared_adapter(proxy_url):
+    """Keep-alive connection pool shared by every HTTP/1.1 session bound to this proxy"""
+    with _shared_adapters_lock:
+        adapter = _shared_adapters.get(proxy_url)
+        if adapter is None:
+            pool_connections, pool_maxsize = _pool_size_parameters()
+            adapter = TunedHTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+            _shared_adapters[proxy_url] = adapter
+        return adapter
+
+
+class InstrumentedSession(requests.Session):
+    """requests.Session (HTTP/1.1) recording the same metrics as Http2Session"""
+
+    def __init__(self):
+        super().__init__()
+        self.transport_stats = SessionTransportStats()
+
+    def request(self, method, url, *args, **kwargs):
+        start = time.perf_counter()
+        ok = False
+        _current_request.stats = self.transport_stats
+        try:
+            response = super().request(method, url, *args, **kwargs)
+            ok = True
+            return response
+        finally:
+            _current_request.stats = None
+            self.transport_stats.requests += 1
+            _transport_stats.record_request(HTTP1, _request_kind(url), time.perf_counter() - start, ok)
+
+    def close(self):
+        # Adapters are shared with other sessions on the same proxy - don't close their pools
+        pass
+
+
+# proxy URL (None = direct) -> shared httpx.HTTPTransport
+_shared_transports = {}
+_shared_transports_lock = threading.Lock()
+
+
+def _get_shared_transport(proxy_url):
+    """HTTP/2 connection pool shared by every session bound to this proxy"""
+    with _shared_transports_lock:
+        transport = _shared_transports.get(proxy_url)
+        if transport is None:
+            transport = httpx.HTTPTransport(http2=True, proxy=proxy_url)
+            _shared_transports[proxy_url] = transport
+        return transport
+
+
+class Http2Response:
+    """httpx.Response with requests-compatible raise_for_status()"""
+
+    def __init__(self, response):
+        self._response = response
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    @property
+    def ok(self):
+        return self._response.status_code < 400
+
+    def raise_for_status(self):
+        if self._response.status_code >= 400:
+            raise requests.HTTPError(f"{self._response.status_code} Error for url: {self._response.url}",
+                                     response=self)
+
+
+class Http2Session:
+    """
+    The requests.Session subset used by token sessions, over a shared HTTP/2 pool.
+
+    headers / proxies / cookies behave like their requests counterparts:
+    headers is case-insensitive, proxies is a plain dict ({"http": ..., "https": ...})
+    and cookies is a CookieJar (iterating yields cookies with .name / .value).
+    """
+
+    def __init__(self):
+        self.headers = httpx.Headers()
+        self.proxies = {}
+        self.cookies = CookieJar()
+        self.transport_stats = SessionTransportStats()
+        self._client = None
+        self._client_proxy = None
+
+    def _get_client(self):
+        proxy_url = self.proxies.get("https") or self.proxies.get("http")
+        if self._client is None or proxy_url != self._client_proxy:
+            # Not closed on proxy change - closing a client closes the SHARED transport
+            self._client = httpx.Client(transport=_get_shared_transport(proxy_url), cookies=self.cookies)
+            self._client_proxy = proxy_url
+        return self._client
+
+    def request(self, method, url, params=None, data=None, json=None, timeout=30, allow_redirects=True,
+                stream=False):
+        headers = [(k, v) for k, v in self.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS]
+        if params:
+            # requests drops None params, httpx would send them empty
+            params = {k: v for k, v in params.items() if v is not None}
+
+        handshake = {"started": None, "finished": None}
+
+        def trace(event_name, info):
+            if event_name.endswith("connect_tcp.started"):
+                handshake["started"] = time.perf_counter()
+            elif event_name.endswith(("connect_tcp.complete", "start_tls.complete")):
+                handshake["finished"] = time.perf_counter()
+
+        start = time.perf_counter()
+        ok = False
+        try:
+            client = self._get_client()
+            request = client.build_request(method, url, params=params, data=data, json=json,
+                                           headers=headers, timeout=timeout, extensions={"trace": trace})
+            # stream=True: only the headers are read, the body is read (or skipped) by the caller
+            response = client.send(request, stream=stream, follow_redirects=allow_redirects)
+            ok = True
+            return Http2Response(response)
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(str(e)) from e
+        except httpx.ProxyError as e:
+            raise requests.exceptions.ProxyError(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(str(e)) from e
+        except httpx.HTTPError as e:
+            raise requests.RequestException(str(e)) from e
+        finally:
+            self.transport_stats.requests += 1
+            _transport_stats.record_request(HTTP2, _request_kind(url), time.perf_counter() - start, ok)
+            if handshake["started"] is not None:
+                seconds = (handshake["finished"] or time.perf_counter()) - handshake["started"]
+                self.transport_stats.record_handshake(seconds)
+                _transport_stats.record_connections(HTTP2, 1, seconds)
+
+    def get(self, url, params=None, **kwargs):
+        return self.request("GET", url, params=params, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault("allow_redirects", False)
+        return self.request("HEAD", url, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request("POST", url, data=data, json=json, **kwargs)
+
+    def close(self):
+        # The transport is shared with other sessions on the same proxy - only drop the client
+        self._client = None
+
+
+_http2_warning_logged = False
+
+
+def is_http2_enabled():
+    """http2_enabled parameter, False if httpx[http2] is not installed"""
+    global _http2_warning_logged
+    import db
+    if str(db.get_parameter("http2_enabled") or "False").lower() != "true":
+        return False
+    if not HTTP2_AVAILABLE:
+        if not _http2_warning_logged:
+            logger.warning("[HTTP] http2_enabled=True but httpx[http2] is not installed - using HTTP/1.1")
+            _http2_warning_logged = True
+        return False
+    return True
+
+
+def create_session(proxies=None):
+    """
+    New HTTP session for a token session (HTTP/2 if enabled, HTTP/1.1 otherwise).
+
+    Args:
+        proxies: requests-style proxy dict the session is bound to (None = direct)
+
+    Returns:
+        InstrumentedSession or Http2Session: Session on the shared pool of its proxy
+    """
+    session = Http2Session() if is_http2_enabled() else InstrumentedSession()
+    if proxies:
+        session.proxies.update(proxies)
+    if isinstance(session, InstrumentedSession):
+        adapter = _get_shared_adapter(session.proxies.get("https") or session.proxies.get("http"))
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+    return session
@@ -79,4 +79,53 @@ VALUES ('telegram_enabled', 'False'),
        ('max_http_errors', '5'),
        
        ('vinted_api_requests', '0'),
-       ('bot_start_time', '0');
+       ('bot_start_time', '0'),
+
+       ('scan_max_concurrency', '32'),
+       ('query_reconcile_interval', '10'),
+       ('worker_supervisor_interval', '15'),
+       ('worker_stall_timeout', '180'),
+       ('worker_max_session_failures', '3'),
+       ('rate_limit_enabled', 'True'),
+       ('rate_limit_global_rps', '5'),
+       ('rate_limit_global_burst', '10'),
+       ('rate_limit_domain_rps', '5'),
+       ('rate_limit_domain_burst', '10'),
+       ('rate_limit_proxy_rps', '0.5'),
+       ('rate_limit_proxy_burst', '2'),
+       ('circuit_breaker_enabled', 'True'),
+       ('circuit_failure_threshold', '3'),
+       ('circuit_cooldown', '60'),
+       ('circuit_max_cooldown', '600'),
+       ('query_coalescing_enabled', 'True'),
+       ('scan_worker_processes', '1'),
+       ('cluster_mode_enabled', 'False'),
+       ('cluster_heartbeat_interval', '10'),
+       ('cluster_lease_ttl', '30'),
+       ('cluster_node_timeout', '30'),
+       ('pipeline_scan_queue_size', '500'),
+       ('pipeline_scan_queue_policy', 'coalesce'),
+       ('pipeline_notify_queue_size', '1000'),
+       ('pipeline_notify_queue_policy', 'block'),
+       ('allowlist_unknown_action', 'allow'),
+       ('seller_country_ttl_days', '30'),
+       ('seller_lookup_rps', '0.5'),
+       ('seller_lookup_burst', '5'),
+       ('seller_lookups_per_batch', '10'),
+       ('catchup_max_pages', '3'),
+       ('shutdown_drain_timeout', '25'),
+       ('http2_enabled', 'False'),
+       ('http_pool_connections', '10'),
+       ('http_pool_maxsize', '10'),
+       ('hedged_requests_enabled', 'True'),
+       ('hedge_min_delay', '0.5'),
+       ('hedge_max_rate', '0.1'),
+       ('token_bootstrap_method', 'auto'),
+       ('token_bootstrap_path', '/'),
+       ('early_exit_parsing_enabled', 'True'),
+       ('early_exit_audit_interval', '50'),
+       ('adaptive_refresh_enabled', 'True'),
+       ('adaptive_min_refresh_delay', '15'),
+       ('adaptive_max_refresh_delay', '600'),
+       ('adaptive_request_budget', '0'),
+       ('adaptive_ewma_alpha', '0.3');
@@ -0,0 +1,130 @@
+"""
+Load test of the whole scan pipeline against the local Vinted stand-in.
+
+Starts mock_vinted_server in-process, creates a scratch SQLite database with
+N synthetic queries and runs the REAL pipeline on it: token pool, scan
+scheduler + slots, item processor (filters, dedup, DB inserts) and a
+notification consumer standing in for Telegram. Every request goes to the
+mock (VINTED_BASE_URL), so throughput, latency, ban storms and token expiry
+can be measured and reproduced without touching vinted.de.
+
+Usage:
+    python load_test.py --queries 500 --duration 120 --refresh-delay 10
+    python load_test.py --queries 50 --error-rate-403 0.05 --ban-every 60 --ban-duration 15
+    python load_test.py --queries 20 --replay recording.jsonl
+
+Any mock_vinted_server option (latency, error rates, ...) is accepted.
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def build_arg_parser():
+    from mock_vinted_server import build_arg_parser as build_mock_arg_parser
+    parser = build_mock_arg_parser()
+    parser.description = "Load test of the scan pipeline against the local Vinted stand-in"
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--priority-queries", type=int, default=0)
+    parser.add_argument("--duration", type=int, default=60, help="Seconds to measure after start-up")
+    parser.add_argument("--refresh-delay", type=int, default=10, help="query_refresh_delay (seconds)")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="scan_max_concurrency")
+    parser.add_argument("--rate-limit", action="store_true", help="Keep the client-side rate limiter on")
+    parser.add_argument("--workdir", help="Scratch directory for the SQLite DB (default: temp dir)")
+    return parser
+
+
+def prepare_database(args):
+    """Scratch DB with the schema, migrations, load test parameters and queries"""
+    import db
+    db.create_or_update_db(os.path.join(ROOT, "initial_db.sql"))
+    db.run_priority_migration()
+    db.run_filter_rules_migration()
+    db.run_seller_country_migration()
+    db.run_cluster_migration()
+    for key, value in (("query_refresh_delay", args.refresh_delay),
+                       ("scan_max_concurrency", args.max_concurrency),
+                       ("rate_limit_enabled", "True" if args.rate_limit else "False"),
+                       # Fixed intervals - adaptive refresh would make runs less comparable
+                       ("adaptive_refresh_enabled", "False"),
+                       ("query_coalescing_enabled", "False")):
+        db.set_parameter(key, str(value))
+    for i in range(args.queries):
+        db.add_query_to_db(f"https://www.vinted.de/catalog?search_text=loadtest{i}&order=newest_first",
+                           f"Load test {i}")
+    for query in db.get_queries()[:args.priority_queries]:
+        db.set_query_priority(query[0], True)
+
+
+def main():
+    args = build_arg_parser().parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="vinted-load-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    # Must be set before pyVintedVN is imported
+    os.environ["VINTED_BASE_URL"] = f"http://{args.host}:{args.port}"
+    sys.path.insert(0, ROOT)
+
+    from mock_vinted_server import start_mock_server, config_from_args
+    server, mock = start_mock_server(args.port, args.host, config_from_args(args), args.seed, args.replay)
+    prepare_database(args)
+
+    import core
+    from pipeline_queue import create_pipeline_queue
+    from http_transport import get_transport_stats
+    from scan_scheduler import get_scheduler_stats
+    from token_bootstrap import get_bootstrap_stats
+    from early_exit_parser import get_early_exit_parser
+
+    items_queue = create_pipeline_queue("scan")
+    new_items_queue = create_pipeline_queue("notify")
+    item_processor = core.start_item_processor(items_queue, new_items_queue)
+
+    # Telegram stand-in: count notifications
+    notifications = [0]
+
+    def consume_notifications():
+        while True:
+            new_items_queue.get()
+            notifications[0] += 1
+
+    threading.Thread(target=consume_notifications, name="notify-consumer", daemon=True).start()
+
+    started = time.time()
+    if core.start_continuous_workers(items_queue) is None:
+        print("Workers failed to start", file=sys.stderr)
+        os._exit(1)
+    startup_seconds = time.time() - started
+
+    # Measure over the steady-state window only
+    mock_before = dict(mock.get_stats()["counters"])
+    notified_before = notifications[0]
+    time.sleep(args.duration)
+    mock_after = mock.get_stats()["counters"]
+
+    requests_served = {key: mock_after.get(key, 0) - mock_before.get(key, 0) for key in mock_after}
+    report = {
+        "config": {"queries": args.queries, "priority_queries": args.priority_queries,
+                   "duration": args.duration, "refresh_delay": args.refresh_delay, "workdir": workdir},
+        "startup_seconds": round(startup_seconds, 1),
+        "catalog_requests_per_second": round(requests_served.get("catalog", 0) / args.duration, 2),
+        "notifications_per_second": round((notifications[0] - notified_before) / args.duration, 2),
+        "mock_counters": requests_served,
+        "http": get_transport_stats(),
+        "token_bootstrap": get_bootstrap_stats(),
+        "early_exit_parsing": get_early_exit_parser().get_stats(),
+        "scheduler": get_scheduler_stats(),
+        "item_processor": item_processor.get_stats(),
+    }
+    print(json.dumps(report, indent=2, default=str))
+    # Scan threads are not daemons - the measurement is done
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
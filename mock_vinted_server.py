@@ -0,0 +1,345 @@
+"""
+Local Vinted API stand-in for load tests and ban-storm reproduction.
+
+Emulates what the bot talks to:
+- GET|HEAD /                     homepage, sets the access_token_web cookie
+- GET /api/v2/catalog/items      catalog search (Bearer token required)
+- GET /api/v2/users/<id>         seller profile (country_iso_code)
+
+Catalog results are synthetic (every search gets a steady stream of new
+listings, --new-items-per-minute) or replayed from a vinted_recorder.py
+recording (--replay). Latency, 401/403/429 rates, token expiry and periodic
+ban storms (every request 403) are configurable on the command line or at
+runtime:
+
+    curl -X POST localhost:8765/__mock/config -d '{"error_rate_403": 0.2}'
+    curl -X POST localhost:8765/__mock/config -d '{"ban_now": 30}'
+    curl localhost:8765/__mock/stats
+
+Point the bot (or load_test.py) at it with VINTED_BASE_URL=http://127.0.0.1:8765.
+Random decisions use a seeded RNG (--seed), so a run is reproducible for a
+given request order.
+
+Usage:
+    python mock_vinted_server.py [--port 8765] [--latency-ms 80] [--jitter-ms 40] ...
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+from vinted_recorder import load_recording, replay_key
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_CONFIG = {
+    "latency_ms": 80.0,
+    "jitter_ms": 40.0,
+    "error_rate_401": 0.0,
+    "error_rate_403": 0.0,
+    "error_rate_429": 0.0,
+    "retry_after": 5,
+    # Requests a token survives before it expires (401), 0 = never
+    "token_max_requests": 0,
+    # Ban storm: every ban_every seconds, ban_duration seconds of 403 on everything
+    "ban_every": 0,
+    "ban_duration": 0,
+    "new_items_per_minute": 6.0,
+    # Size of the homepage body (what a full-GET token fetch downloads)
+    "homepage_kb": 300,
+    "seller_countries": ["DE", "FR", "IT", "ES", "PL", "NL"],
+}
+
+
+class MockVinted:
+    """State of the mock: config, issued tokens, item streams, replay cursors, stats"""
+
+    def __init__(self, config=None, seed=1, recording=None):
+        self.lock = threading.Lock()
+        self.config = dict(DEFAULT_CONFIG, **(config or {}))
+        self.rng = random.Random(seed)
+        self.started = time.time()
+        self.tokens = {}  # token -> requests served
+        self.token_seq = 0
+        self.ban_until = 0
+        self.recording = recording or {}
+        self.replay_cursors = Counter()
+        self.stats = Counter()
+
+    # --- behaviour -------------------------------------------------------
+
+    def update_config(self, changes):
+        with self.lock:
+            if "ban_now" in changes:
+                self.ban_until = time.time() + float(changes.pop("ban_now"))
+            unknown = set(changes) - set(self.config)
+            if unknown:
+                raise ValueError(f"Unknown config key(s): {', '.join(sorted(unknown))}")
+            self.config.update(changes)
+            return dict(self.config)
+
+    def is_banned(self, now):
+        if now < self.ban_until:
+            return True
+        every, duration = self.config["ban_every"], self.config["ban_duration"]
+        return bool(every and duration and (now - self.started) % every < duration)
+
+    def latency(self):
+        with self.lock:
+            jitter = self.rng.uniform(-1, 1) * self.config["jitter_ms"]
+        return max(0.0, self.config["latency_ms"] + jitter) / 1000
+
+    def injected_error(self):
+        """Random 401/403/429 according to the configured rates (None = serve normally)"""
+        with self.lock:
+            roll = self.rng.random()
+        for status in (403, 429, 401):
+            rate = self.config[f"error_rate_{status}"]
+            if roll < rate:
+                return status
+            roll -= rate
+        return None
+
+    def issue_token(self):
+        with self.lock:
+            self.token_seq += 1
+            token = f"mock-token-{self.token_seq}-{self.rng.getrandbits(64):016x}"
+            self.tokens[token] = 0
+            return token
+
+    def check_token(self, authorization):
+        """True if the Bearer token is known and not expired"""
+        token = (authorization or "").replace("Bearer ", "", 1)
+        with self.lock:
+            if token not in self.tokens:
+                return False
+            self.tokens[token] += 1
+            limit = self.config["token_max_requests"]
+            if limit and self.tokens[token] > limit:
+                del self.tokens[token]
+                return False
+            return True
+
+    # --- synthetic catalog -----------------------------------------------
+
+    def _item(self, stream, number, created_at, locale):
+        item_id = stream * 10_000_000 + number
+        seller_id = 100_000 + item_id % 50_000
+        countries = self.config["seller_countries"]
+        return {
+            "id": item_id,
+            "title": f"Mock item {number} of search {stream}",
+            "brand_title": ("Nike", "Adidas", "Zara", "H&M")[item_id % 4],
+            "size_title": ("S", "M", "L", "42")[item_id % 4],
+            "price": {"amount": f"{10 + item_id % 90}.0", "currency_code": "EUR"},
+            "url": f"https://{locale}/items/{item_id}-mock-item",
+            "photo": {"url": f"https://images.mock.local/{item_id}.jpeg",
+                      "high_resolution": {"timestamp": int(created_at)}},
+            "user": {"id": seller_id, "login": f"seller{seller_id}",
+                     "country_iso_code": countries[seller_id % len(countries)]},
+            "status": "Sehr gut",
+            "is_visible": True,
+        }
+
+    def catalog_page(self, params, locale):
+        """Newest-first page of the search's item stream - new items keep arriving"""
+        stream = zlib.crc32(replay_key("", params).encode()) % 1000 + 1
+        per_page = int(params.get("per_page") or 20)
+        page = int(params.get("page") or 1)
+        interval = 60.0 / max(self.config["new_items_per_minute"], 0.001)
+        # Every search starts with a 500 item back catalogue
+        newest = 500 + int((time.time() - self.started) / interval)
+        first = newest - (page - 1) * per_page
+        items = [self._item(stream, n, self.started + (n - 500) * interval, locale)
+                 for n in range(first, max(first - per_page, 0), -1)]
+        return {"items": items, "pagination": {"current_page": page, "per_page": per_page,
+                                               "total_entries": newest}}
+
+    def replay(self, path, params):
+        """Next recorded (status, body, elapsed) for this search, None if not recorded"""
+        entries = self.recording.get(replay_key(path, params))
+        if not entries:
+            return None
+        key = replay_key(path, params)
+        with self.lock:
+            entry = entries[self.replay_cursors[key] % len(entries)]
+            self.replay_cursors[key] += 1
+        return entry["status"], entry["body"], entry.get("elapsed")
+
+    def record(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def record_bytes(self, count):
+        with self.lock:
+            self.stats["body_bytes"] += count
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "uptime_seconds": round(time.time() - self.started, 1),
+                "banned": self.is_banned(time.time()),
+                "issued_tokens": self.token_seq,
+                "live_tokens": len(self.tokens),
+                "replay_keys": len(self.recording),
+                "counters": dict(self.stats),
+            }
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients closing mid-response (streamed token fetches) are expected
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+def make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body=b"", content_type="application/json", headers=None):
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            if self.command != "HEAD":
+                try:
+                    self.wfile.write(body)
+                    mock.record_bytes(len(body))
+                except (BrokenPipeError, ConnectionResetError):
+                    # Streamed token fetches close the connection after the headers
+                    mock.record("body_aborted")
+                    self.close_connection = True
+            mock.record(f"status_{status}")
+
+        def _send_json(self, status, payload, headers=None):
+            # Compact, like the real API
+            self._send(status, json.dumps(payload, separators=(",", ":")), headers=headers)
+
+        def _error(self, status):
+            headers = {"Retry-After": str(mock.config["retry_after"])} if status == 429 else None
+            self._send_json(status, {"code": status, "message": "mock error"}, headers)
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            params = dict(parse_qsl(parsed.query))
+            if parsed.path == "/__mock/stats":
+                return self._send_json(200, mock.get_stats())
+
+            locale = (self.headers.get("Host") or "www.vinted.de").split(":")[0]
+            time.sleep(mock.latency())
+            if mock.is_banned(time.time()):
+                mock.record("banned")
+                return self._error(403)
+
+            if parsed.path == "/":
+                mock.record("homepage_head" if self.command == "HEAD" else "homepage")
+                token = mock.issue_token()
+                body = "<html>mock vinted" + " " * int(mock.config["homepage_kb"] * 1024) + "</html>"
+                return self._send(200, body, "text/html",
+                                  {"Set-Cookie": f"access_token_web={token}; Path=/; HttpOnly"})
+
+            if not parsed.path.startswith("/api/v2/"):
+                return self._error(404)
+            if not mock.check_token(self.headers.get("Authorization")):
+                mock.record("unauthorized")
+                return self._error(401)
+            error = mock.injected_error()
+            if error:
+                mock.record(f"injected_{error}")
+                return self._error(error)
+
+            if parsed.path == "/api/v2/catalog/items":
+                mock.record("catalog")
+                replayed = mock.replay(parsed.path, params)
+                if replayed is not None:
+                    status, body, _ = replayed
+                    mock.record("replayed")
+                    return self._send(status, body)
+                return self._send_json(200, mock.catalog_page(params, locale))
+            if parsed.path.startswith("/api/v2/users/"):
+                mock.record("users")
+                user_id = parsed.path.rstrip("/").split("/")[4]
+                countries = mock.config["seller_countries"]
+                country = countries[int(user_id) % len(countries)] if user_id.isdigit() else "XX"
+                return self._send_json(200, {"user": {"id": user_id, "country_iso_code": country}})
+            return self._error(404)
+
+        do_HEAD = do_GET
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/__mock/config":
+                return self._error(404)
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                changes = json.loads(self.rfile.read(length) or b"{}")
+                config = mock.update_config(changes)
+            except ValueError as e:
+                return self._send_json(400, {"error": str(e)})
+            logger.info(f"[MOCK] Config updated: {changes}")
+            return self._send_json(200, config)
+
+    return Handler
+
+
+def start_mock_server(port=8765, host="127.0.0.1", config=None, seed=1, replay_file=None):
+    """
+    Start the mock server in a background thread.
+
+    Returns:
+        tuple: (MockServer, MockVinted)
+    """
+    recording = load_recording(replay_file) if replay_file else None
+    mock = MockVinted(config=config, seed=seed, recording=recording)
+    server = MockServer((host, port), make_handler(mock))
+    threading.Thread(target=server.serve_forever, name="mock-vinted", daemon=True).start()
+    logger.info(f"[MOCK] 🧪 Mock Vinted listening on http://{host}:{server.server_address[1]}"
+                + (f" (replaying {len(recording)} searches from {replay_file})" if recording else ""))
+    return server, mock
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Local Vinted API stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--replay", help="vinted_recorder.py recording to serve (JSONL)")
+    for key, value in DEFAULT_CONFIG.items():
+        if isinstance(value, (int, float)):
+            parser.add_argument("--" + key.replace("_", "-"), type=type(value), default=value)
+    return parser
+
+
+def config_from_args(args):
+    return {key: getattr(args, key) for key, value in DEFAULT_CONFIG.items() if isinstance(value, (int, float))}
+
+
+def main():
+    args = build_arg_parser().parse_args()
+    server, mock = start_mock_server(args.port, args.host, config_from_args(args), args.seed, args.replay)
+    try:
+        while True:
+            time.sleep(60)
+            logger.info(f"[MOCK] Stats: {mock.get_stats()}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
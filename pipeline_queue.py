@@ -0,0 +1,254 @@
+"""
+Bounded queues between the pipeline stages (scan -> process -> notify).
+
+The stage queues used to be unbounded Manager queues: when the item processor
+or Telegram fell behind, batches piled up in RAM and nobody could see it.
+Every stage queue now has a capacity and an explicit backpressure policy:
+
+- block: put() waits until there is room (the producer slows down)
+- drop_oldest: the oldest entry is dropped to make room (freshness over completeness)
+- coalesce: entries with the same key (query id) are merged into ONE pending
+  entry, so a slow processor sees the latest items of each query once;
+  a new key on a full queue waits like "block"
+
+Depth, enqueue wait and age of the oldest entry are exposed per queue, so
+overload shows up as a number instead of growing RAM.
+"""
+import queue as queue_module
+import threading
+import time
+from collections import deque
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+POLICIES = (BLOCK, DROP_OLDEST, COALESCE)
+
+# How many recent enqueue wait samples are kept for avg/p95 metrics
+WAIT_SAMPLES_WINDOW = 1000
+
+# Defaults for the DB parameters (capacity / policy per stage)
+DEFAULT_STAGE_CONFIG = {
+    "scan": (500, COALESCE),
+    "notify": (1000, BLOCK),
+}
+
+
+def merge_item_batches(old, new):
+    """
+    Merge two (items, query_id) batches of the same query.
+    Newest items first (API order), items of the older batch are kept if not rescanned.
+    """
+    new_items, query_id = new
+    seen = {item.id for item in new_items}
+    return (list(new_items) + [item for item in old[0] if item.id not in seen], query_id)
+
+
+class PipelineQueue:
+    """
+    Thread-safe bounded queue with a backpressure policy.
+
+    Drop-in for the queue.Queue subset used by the pipeline
+    (put / get / get_nowait / empty / qsize).
+
+    Features:
+    - Capacity with block / drop_oldest / coalesce policies
+    - Per-key coalescing with a merge function
+    - Depth, max depth, enqueue wait (avg/p95/max), age of oldest entry
+    - Dropped / coalesced counters
+    """
+
+    def __init__(self, name, maxsize, policy=BLOCK, key_func=None, merge_func=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        if policy == COALESCE and (key_func is None or merge_func is None):
+            raise ValueError("Coalesce policy needs key_func and merge_func")
+        self.name = name
+        self.maxsize = max(1, int(maxsize))
+        self.policy = policy
+        self.key_func = key_func
+        self.merge_func = merge_func
+
+        self._entries = deque()  # [enqueued_at, key, item]
+        self._by_key = {}
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+        # Metrics
+        self._wait_samples = deque(maxlen=WAIT_SAMPLES_WINDOW)
+        self.max_depth = 0
+        self.total_enqueued = 0
+        self.total_dequeued = 0
+        self.total_dropped = 0
+        self.total_coalesced = 0
+        self.total_blocked = 0
+        self.max_enqueue_wait = 0.0
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Enqueue an item according to the policy.
+
+        Raises:
+            queue.Full: Only for block/coalesce with block=False or an expired timeout
+        """
+        start = time.monotonic()
+        with self._lock:
+            key = self.key_func(item) if self.policy == COALESCE else None
+            if key is not None and key in self._by_key:
+                entry = self._by_key[key]
+                entry[2] = self.merge_func(entry[2], item)
+                self.total_coalesced += 1
+                self._record_wait(time.monotonic() - start)
+                return
+
+            if len(self._entries) >= self.maxsize:
+                if self.policy == DROP_OLDEST:
+                    self._drop_oldest()
+                else:
+                    self.total_blocked += 1
+                    if not block:
+                        raise queue_module.Full
+                    deadline = None if timeout is None else start + timeout
+                    while len(self._entries) >= self.maxsize:
+                        remaining = None if deadline is None else deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            raise queue_module.Full
+                        self._not_full.wait(remaining)
+                    # A same-key entry may have appeared while waiting
+                    if key is not None and key in self._by_key:
+                        entry = self._by_key[key]
+                        entry[2] = self.merge_func(entry[2], item)
+                        self.total_coalesced += 1
+                        self._record_wait(time.monotonic() - start)
+                        return
+
+            entry = [time.time(), key, item]
+            self._entries.append(entry)
+            if key is not None:
+                self._by_key[key] = entry
+            self.total_enqueued += 1
+            self.max_depth = max(self.max_depth, len(self._entries))
+            self._record_wait(time.monotonic() - start)
+            self._not_empty.notify()
+
+    def _drop_oldest(self):
+        """Drop the oldest entry (called under lock)"""
+        entry = self._entries.popleft()
+        if entry[1] is not None:
+            self._by_key.pop(entry[1], None)
+        self.total_dropped += 1
+        if self.total_dropped == 1 or self.total_dropped % 100 == 0:
+            logger.warning(f"[PIPELINE] ⚠️ Queue '{self.name}' full ({self.maxsize}) - "
+                           f"dropped oldest entry (total dropped: {self.total_dropped})")
+
+    def _record_wait(self, waited):
+        """Update enqueue wait metrics (called under lock)"""
+        self._wait_samples.append(waited)
+        self.max_enqueue_wait = max(self.max_enqueue_wait, waited)
+
+    def get(self, block=True, timeout=None):
+        """
+        Dequeue the oldest entry.
+
+        Raises:
+            queue.Empty: Nothing available (non-blocking or timeout)
+        """
+        with self._lock:
+            if not block:
+                if not self._entries:
+                    raise queue_module.Empty
+            else:
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while not self._entries:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise queue_module.Empty
+                    self._not_empty.wait(remaining)
+            entry = self._entries.popleft()
+            if entry[1] is not None:
+                self._by_key.pop(entry[1], None)
+            self.total_dequeued += 1
+            self._not_full.notify()
+            return entry[2]
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def empty(self):
+        with self._lock:
+            return not self._entries
+
+    def qsize(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get_stats(self):
+        """Get queue statistics (depth, enqueue wait, age of oldest entry)"""
+        with self._lock:
+            waits = sorted(self._wait_samples)
+            depth = len(self._entries)
+            return {
+                "policy": self.policy,
+                "maxsize": self.maxsize,
+                "depth": depth,
+                "fill_percent": round(depth / self.maxsize * 100, 1),
+                "max_depth": self.max_depth,
+                "oldest_age_seconds": round(time.time() - self._entries[0][0], 2) if depth else 0.0,
+                "total_enqueued": self.total_enqueued,
+                "total_dequeued": self.total_dequeued,
+                "total_dropped": self.total_dropped,
+                "total_coalesced": self.total_coalesced,
+                "total_blocked": self.total_blocked,
+                "enqueue_wait_avg_seconds": round(sum(waits) / len(waits), 4) if waits else 0.0,
+                "enqueue_wait_p95_seconds": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 4) if waits else 0.0,
+                "enqueue_wait_max_seconds": round(self.max_enqueue_wait, 4),
+            }
+
+
+# Global registry of stage queues (for metrics)
+_pipeline_queues = {}
+_pipeline_queues_lock = threading.Lock()
+
+
+def create_pipeline_queue(stage):
+    """
+    Create the queue of a pipeline stage from DB parameters
+    (pipeline_<stage>_queue_size / pipeline_<stage>_queue_policy).
+
+    Args:
+        stage: "scan" (scan -> process) or "notify" (process -> Telegram)
+
+    Returns:
+        PipelineQueue: Registered stage queue
+    """
+    import db
+    default_size, default_policy = DEFAULT_STAGE_CONFIG[stage]
+    try:
+        maxsize = int(db.get_parameter(f"pipeline_{stage}_queue_size") or default_size)
+    except (ValueError, TypeError):
+        maxsize = default_size
+    policy = db.get_parameter(f"pipeline_{stage}_queue_policy") or default_policy
+    if policy not in POLICIES or (policy == COALESCE and stage != "scan"):
+        logger.warning(f"[PIPELINE] Invalid policy '{policy}' for stage '{stage}', using '{default_policy}'")
+        policy = default_policy
+
+    if policy == COALESCE:
+        pipeline_queue = PipelineQueue(stage, maxsize, policy,
+                                       key_func=lambda batch: batch[1], merge_func=merge_item_batches)
+    else:
+        pipeline_queue = PipelineQueue(stage, maxsize, policy)
+    with _pipeline_queues_lock:
+        _pipeline_queues[stage] = pipeline_queue
+    logger.info(f"[PIPELINE] Queue '{stage}' created (maxsize {pipeline_queue.maxsize}, policy {policy})")
+    return pipeline_queue
+
+
+def get_pipeline_stats():
+    """Get statistics of all stage queues"""
+    with _pipeline_queues_lock:
+        queues = dict(_pipeline_queues)
+    return {stage: q.get_stats() for stage, q in queues.items()}
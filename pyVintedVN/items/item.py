@@ -1,5 +1,12 @@
+import sys
 from datetime import datetime, timezone
 
+
+def _intern(value):
+    """Intern short repeated strings (currency, brand, size) - one copy shared by all items"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
 class Item:
     """
     Represents a single item from Vinted.
@@ -7,8 +14,14 @@ class Item:
     This class parses and stores various attributes of a Vinted item,
     such as id, title, brand, size, price, etc.
 
+    Items sit in the pipeline queues (and are pickled to shard processes), so
+    the representation is compact: __slots__ instead of a __dict__, interned
+    currency/brand/size strings, a precomputed hash and NO copy of the API
+    payload unless keep_raw=True.
+
     Attributes:
-        raw_data (dict): The raw data of the item as received from the API.
+        raw_data (dict): The raw data of the item as received from the API
+            (None unless the item was created with keep_raw=True).
         id (str): The unique identifier of the item.
         title (str): The title of the item.
         brand_title (str): The brand of the item.
@@ -17,36 +30,64 @@ class Item:
         price (float): The price of the item.
         photo (str): The URL of the item's photo.
         url (str): The URL of the item on Vinted.
+        seller_id (str): The id of the seller, or None if not available.
+        seller_country (str): The seller's country code if the API included it, else None.
         created_at_ts (datetime): The timestamp when the item was created.
         raw_timestamp (int): The raw timestamp value from the API.
     """
-    def __init__(self, data):
+    __slots__ = ("id", "title", "brand_title", "size_title", "currency", "price", "photo", "url",
+                 "seller_id", "seller_country", "raw_timestamp", "raw_data", "_hash")
+
+    def __init__(self, data, keep_raw=False):
         """
         Initialize an Item with data from the Vinted API.
 
         Args:
             data (dict): The item data from the Vinted API.
+            keep_raw (bool, optional): Keep the whole API payload in raw_data.
+                Defaults to False.
         """
-        self.raw_data = data
+        self.raw_data = data if keep_raw else None
         self.id = data["id"]
         self.title = data["title"]
-        self.brand_title = data["brand_title"]
-        try:
-            self.size_title = data["size_title"]
-        except KeyError:
-            # If size_title is not available, set it to None
-            self.size_title = None
-        self.currency = data["price"]["currency_code"]
+        self.brand_title = _intern(data["brand_title"])
+        # size_title is not available for every category
+        self.size_title = _intern(data.get("size_title"))
+        self.currency = _intern(data["price"]["currency_code"])
         self.price = data["price"]["amount"]
         self.photo = data["photo"]["url"]
         self.url = data["url"]
-        # We keep everything before the "items"
-        self.buy_url = data["url"].split("items")[
-                           0] + "transaction/buy/new?source_screen=item&transaction%5Bitem_id%5D=" + str(data["id"])
-        self.created_at_ts = datetime.fromtimestamp(
-            data["photo"]["high_resolution"]["timestamp"], tz=timezone.utc
-        )
+        user = data.get("user") or {}
+        self.seller_id = str(user["id"]) if user.get("id") is not None else None
+        self.seller_country = _intern(user.get("country_iso_code"))
         self.raw_timestamp = data["photo"]["high_resolution"]["timestamp"]
+        self._hash = hash(('id', self.id))
+
+    @property
+    def buy_url(self):
+        """Checkout URL of the item (built on demand, rarely used)"""
+        # We keep everything before the "items"
+        return self.url.split("items")[0] + "transaction/buy/new?source_screen=item&transaction%5Bitem_id%5D=" + str(self.id)
+
+    @property
+    def created_at_ts(self):
+        """Creation time of the item as an aware UTC datetime (built on demand)"""
+        return datetime.fromtimestamp(self.raw_timestamp, tz=timezone.utc)
+
+    def __getstate__(self):
+        # Compact pickle: a plain tuple of the slot values
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+        # hash(str) is salted per process - recompute on the receiving side
+        self._hash = hash(('id', self.id))
+        # Strings are interned again on the receiving side
+        self.brand_title = _intern(self.brand_title)
+        self.size_title = _intern(self.size_title)
+        self.currency = _intern(self.currency)
+        self.seller_country = _intern(self.seller_country)
 
     def __eq__(self, other):
         """
@@ -69,12 +110,13 @@ class Item:
         Return a hash value for this item.
 
         The hash is based on the item's ID, which allows items to be used
-        as keys in dictionaries and elements in sets.
+        as keys in dictionaries and elements in sets. It is computed once,
+        in the constructor.
 
         Returns:
             int: A hash value for the item.
         """
-        return hash(('id', self.id))
+        return self._hash
 
     def is_new_item(self, minutes=20):
         """
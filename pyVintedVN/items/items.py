@@ -7,14 +7,46 @@ from pyVintedVN.settings import Urls
 import sys
 import os
 
+# Fast JSON decoder if available (catalog responses are decoded on every scan)
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
 # Add the parent directory to sys.path to import logger
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 from logger import get_logger
+from vinted_recorder import is_recording, record_response
+from early_exit_parser import get_early_exit_parser
 
 # Get logger for this module
 logger = get_logger(__name__)
 
 
+class CompiledSearch:
+    """
+    A search URL compiled once into everything the API request needs.
+
+    Query URLs don't change between scans, so workers compile them once
+    (see Items.compile_search) instead of re-parsing the URL on every scan.
+
+    Attributes:
+        url (str): The Vinted search URL it was compiled from.
+        locale (str): The Vinted domain (e.g. www.vinted.de).
+        api_url (str): The catalog API endpoint of that domain.
+        params (dict): The API query parameters.
+        headers (dict): The locale-specific session headers.
+    """
+    __slots__ = ("url", "locale", "api_url", "params", "headers")
+
+    def __init__(self, url, locale, api_url, params, headers):
+        self.url = url
+        self.locale = locale
+        self.api_url = api_url
+        self.params = params
+        self.headers = headers
+
+
 class Items:
     """
     A class for searching and retrieving items from Vinted.
@@ -40,45 +72,83 @@ class Items:
                      If not provided, uses global requester (legacy mode).
         """
         self.session = session
+        # Locale whose headers are already set on the session
+        self._header_locale = None
 
-    def search(self, url: str, nbr_items: int = 20, page: int = 1,
-               time: Optional[int] = None, json: bool = False):
+    def compile_search(self, url: str, nbr_items: int = 20, page: int = 1,
+                       time: Optional[int] = None) -> CompiledSearch:
         """
-        Retrieve items from a given search URL on Vinted.
+        Compile a search URL into the API URL, parameters and headers.
 
         Args:
             url (str): The URL of the search on Vinted.
             nbr_items (int, optional): Number of items to be returned. Defaults to 20.
             page (int, optional): Page number to be returned. Defaults to 1.
+            time (int, optional): Timestamp to filter items by time. Defaults to None.
+
+        Returns:
+            CompiledSearch: Reusable request description for search().
+        """
+        locale = urlparse(url).netloc
+        return CompiledSearch(
+            url=url,
+            locale=locale,
+            api_url=f"{Urls.base_url(locale)}{Urls.VINTED_API_URL}/{Urls.VINTED_PRODUCTS_ENDPOINT}",
+            params=self.parse_url(url, nbr_items, page, time),
+            headers={
+                "Host": locale,
+                "Referer": f"https://{locale}/",
+                "Origin": f"https://{locale}",
+            },
+        )
+
+    def search(self, url, nbr_items: int = 20, page: int = 1,
+               time: Optional[int] = None, json: bool = False, seen_key=None):
+        """
+        Retrieve items from a given search URL on Vinted.
+
+        Args:
+            url (str or CompiledSearch): The URL of the search on Vinted, or a search
+                compiled with compile_search() (nbr_items, page and time are then ignored).
+            nbr_items (int, optional): Number of items to be returned. Defaults to 20.
+            page (int, optional): Page number to be returned. Defaults to 1.
             time (int, optional): Timestamp to filter items by time. Defaults to None. Looks like it doesn't work though.
             json (bool, optional): Whether to return raw JSON data instead of Item objects.
-                Defaults to False.
+                Defaults to False. Workers use raw data to build Item objects only for
+                items that are new (see QueryScanWorker._process_scan_result).
+            seen_key (optional): Query id whose already seen items are not decoded
+                (early-exit parsing, json=True only). The result may then hold only
+                the page's new items - see early_exit_parser.
 
         Returns:
             List[Item] or tuple: A list of Item objects, or (response, status_code) tuple for HTTP errors.
         """
-        # Extract the domain from the URL and set the locale
-        locale = urlparse(url).netloc
+        # Workers pass a compiled search - plain URLs are compiled on the fly
+        compiled = url if isinstance(url, CompiledSearch) else self.compile_search(url, nbr_items, page, time)
+        locale = compiled.locale
         
         # Use dedicated session if provided, otherwise fall back to global requester
         if self.session:
             # Using dedicated session from token pool
-            # Update locale-specific headers
-            self.session.headers.update({
-                "Host": locale,
-                "Referer": f"https://{locale}/",
-                "Origin": f"https://{locale}",
-            })
+            # Update locale-specific headers (only when the locale changes)
+            if self._header_locale != locale:
+                self.session.headers.update(compiled.headers)
+                self._header_locale = locale
         else:
             # Legacy mode: use global requester instance
             from pyVintedVN.requester import requester as requester_instance
             requester_instance.set_locale(locale)
 
-        # Parse the URL to get the API parameters
-        params = self.parse_url(url, nbr_items, page, time)
+        params = compiled.params
+        api_url = compiled.api_url
 
-        # Construct the API URL
-        api_url = f"https://{locale}{Urls.VINTED_API_URL}/{Urls.VINTED_PRODUCTS_ENDPOINT}"
+        # Shared rate limiter: global + per domain + per proxy token buckets
+        from rate_limiter import get_rate_limiter
+        rate_limiter = get_rate_limiter()
+        proxy = self.session.proxies.get("https") if self.session and self.session.proxies else None
+        waited = rate_limiter.acquire(domain=locale, proxy=proxy)
+        if waited > 1:
+            logger.debug(f"[RATE_LIMIT] Waited {waited:.2f}s for a request slot ({locale})")
 
         try:
             # Make the request using dedicated session or global requester
@@ -103,6 +173,10 @@ class Items:
                 from pyVintedVN.requester import requester as requester_instance
                 response = requester_instance.get(url=api_url, params=params)
 
+            rate_limiter.report_response(response.status_code, domain=locale, proxy=proxy)
+            if is_recording():
+                record_response(api_url, params, response)
+
             # Check for HTTP errors before raising
             if response.status_code in (401, 403, 429):
                 # Don't raise_for_status here - let caller handle it
@@ -111,8 +185,12 @@ class Items:
 
             response.raise_for_status()
 
-            # Parse the response
-            response_data = response.json()
+            if json and seen_key is not None:
+                # Decode only the items the query hasn't seen yet
+                return get_early_exit_parser().parse(response.content, seen_key)
+
+            # Parse the response (raw bytes - no text decoding step, orjson if installed)
+            response_data = _json_loads(response.content)
             
             # Debug logs removed as requested
             
@@ -9,6 +9,7 @@ import time
 import sys
 import os
 from logger import get_logger
+from token_bootstrap import fetch_access_token
 
 # Добавляем путь для импорта модуля редеплоя
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -223,23 +224,22 @@ class requester:
             original_headers = dict(self.session.headers)
             self.session.headers.update(main_headers)
             
-            # Запрос к главной странице
-            response = self.session.get("https://www.vinted.de/", timeout=30)
-            
-            # Восстанавливаем API headers
-            self.session.headers.clear()
-            self.session.headers.update(original_headers)
+            # Запрос к главной странице (только заголовки - тело страницы не скачиваем)
+            try:
+                access_token, status_code = fetch_access_token(self.session, timeout=30)
+            finally:
+                # Восстанавливаем API headers
+                self.session.headers.clear()
+                self.session.headers.update(original_headers)
             
-            if response.status_code == 200:
-                # Извлекаем access_token_web из cookies
-                for cookie in self.session.cookies:
-                    if cookie.name == 'access_token_web':
-                        self.access_token = cookie.value
-                        # Добавляем Bearer authorization
-                        self.session.headers["Authorization"] = f"Bearer {self.access_token}"
-                        if self.debug:
-                            logger.info(f"[DEBUG] Bearer token obtained: {self.access_token[:50]}...")
-                        return True
+            if status_code == 200:
+                if access_token:
+                    self.access_token = access_token
+                    # Добавляем Bearer authorization
+                    self.session.headers["Authorization"] = f"Bearer {self.access_token}"
+                    if self.debug:
+                        logger.info(f"[DEBUG] Bearer token obtained: {self.access_token[:50]}...")
+                    return True
                 
                 if self.debug:
                     logger.info("[DEBUG] No access_token_web found in cookies")
@@ -1,3 +1,13 @@
+import os
+
+
 class Urls:
     VINTED_API_URL = f"/api/v2"
     VINTED_PRODUCTS_ENDPOINT = "catalog/items"
+    # Local Vinted stand-in for load tests (mock_vinted_server.py), e.g. http://127.0.0.1:8765
+    VINTED_BASE_URL_OVERRIDE = os.environ.get("VINTED_BASE_URL")
+
+    @staticmethod
+    def base_url(locale):
+        """Scheme + host requests for this Vinted domain go to (the mock server if configured)"""
+        return Urls.VINTED_BASE_URL_OVERRIDE or f"https://{locale}"
@@ -0,0 +1,166 @@
+"""
+Query coalescing: one API request serving several overlapping queries.
+
+Many queries are the same search with a different price range. Each of them
+used to cost its own request every cycle. The planner groups normal queries
+whose search params differ ONLY in filters we can evaluate locally, scans the
+group with ONE broader request and fans the items out to every member with
+client-side filtering.
+
+Locally evaluable filters: price_from / price_to (the catalog response has
+the item price). Brand and size can't be coalesced - the catalog response
+only carries brand_title / size_title, not the ids used by the filters.
+"""
+import threading
+from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Query params that are evaluated locally for coalesced groups
+LOCAL_FILTER_PARAMS = ("price_from", "price_to")
+# Vinted API maximum page size
+MAX_PER_PAGE = 96
+
+
+def _parse_price(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class GroupMember:
+    """One query served by a coalesced group"""
+    def __init__(self, query):
+        self.query = query
+        self.query_id = query[0]
+        self.url = query[1]
+        params = dict(parse_qsl(urlparse(self.url).query))
+        self.price_from = _parse_price(params.get("price_from"))
+        self.price_to = _parse_price(params.get("price_to"))
+
+    def matches(self, item):
+        """Client-side evaluation of the member's local filters"""
+        if self.price_from is None and self.price_to is None:
+            return True
+        price = _parse_price(item.price)
+        if price is None:
+            return False
+        if self.price_from is not None and price < self.price_from:
+            return False
+        if self.price_to is not None and price > self.price_to:
+            return False
+        return True
+
+    def filter_items(self, items):
+        return [item for item in items if self.matches(item)]
+
+
+class QueryGroup:
+    """Queries scanned together with ONE request"""
+    def __init__(self, members):
+        self.members = sorted(members, key=lambda m: m.query_id)
+        self.leader = self.members[0]
+        self.leader_id = self.leader.query_id
+        self.url = self._build_url()
+        # Reconciler restarts the group slot when membership or any URL changes
+        self.signature = tuple((m.query_id, m.url) for m in self.members)
+
+    def _build_url(self):
+        """Leader URL with the union of all member price ranges"""
+        parsed = urlparse(self.leader.url)
+        params = [(k, v) for k, v in parse_qsl(parsed.query) if k not in LOCAL_FILTER_PARAMS]
+        froms = [m.price_from for m in self.members]
+        tos = [m.price_to for m in self.members]
+        # A bound is kept only if EVERY member has one (otherwise the union is open)
+        if all(p is not None for p in froms):
+            params.append(("price_from", f"{min(froms):g}"))
+        if all(p is not None for p in tos):
+            params.append(("price_to", f"{max(tos):g}"))
+        return urlunparse((parsed.scheme, parsed.netloc, parsed.path, parsed.params,
+                           urlencode(params), parsed.fragment))
+
+    def per_page(self, items_per_query):
+        """Broader request returns more items so narrow members don't lose theirs"""
+        return min(MAX_PER_PAGE, items_per_query * len(self.members))
+
+    def __repr__(self):
+        return f"QueryGroup(leader={self.leader_id}, members={[m.query_id for m in self.members]})"
+
+
+def _group_key(url):
+    """Search identity without the locally evaluable filters"""
+    parsed = urlparse(url)
+    params = sorted((k, v) for k, v in parse_qsl(parsed.query) if k not in LOCAL_FILTER_PARAMS)
+    return (parsed.netloc, parsed.path, tuple(params))
+
+
+def plan_query_groups(queries):
+    """
+    Group queries that differ only in locally evaluable filters.
+
+    Args:
+        queries: Query tuples from the database (normal queries only)
+
+    Returns:
+        tuple: (groups, solo) - QueryGroup for every group of 2+ queries, query tuples left alone
+    """
+    buckets = {}
+    for query in queries:
+        buckets.setdefault(_group_key(query[1]), []).append(query)
+
+    groups = []
+    solo = []
+    for members in buckets.values():
+        if len(members) > 1:
+            groups.append(QueryGroup([GroupMember(q) for q in members]))
+        else:
+            solo.append(members[0])
+
+    get_coalescing_stats().set_plan(groups)
+    return groups, solo
+
+
+def is_query_coalescing_enabled():
+    """Coalescing is ON unless query_coalescing_enabled is set to False"""
+    import db
+    return (db.get_parameter("query_coalescing_enabled") or "True") == "True"
+
+
+class CoalescingStats:
+    """Requests saved by coalescing"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.groups = []
+        self.total_group_scans = 0
+        self.total_requests_saved = 0
+
+    def set_plan(self, groups):
+        with self.lock:
+            self.groups = [[m.query_id for m in g.members] for g in groups]
+
+    def record_group_scan(self, group):
+        with self.lock:
+            self.total_group_scans += 1
+            self.total_requests_saved += len(group.members) - 1
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "groups": len(self.groups),
+                "coalesced_queries": sum(len(g) for g in self.groups),
+                "requests_saved_per_cycle": sum(len(g) - 1 for g in self.groups),
+                "total_group_scans": self.total_group_scans,
+                "total_requests_saved": self.total_requests_saved,
+                "members": self.groups,
+            }
+
+
+# Global stats instance
+_global_stats = CoalescingStats()
+
+
+def get_coalescing_stats():
+    """Get global coalescing statistics"""
+    return _global_stats
@@ -0,0 +1,106 @@
+"""
+Benchmark: per-item cost of the scan -> process queue.
+
+Compares the queue types the runtime can use for item batches:
+- multiprocessing.Manager().Queue() - proxy queue, every call is an IPC round
+  trip to the manager process and every batch is pickled (old single-process mode)
+- spawn multiprocessing.Queue() - pipe, batches are pickled (multi-process mode)
+- queue.Queue() - plain in-process queue
+- PipelineQueue - bounded in-process stage queue (current single-process mode)
+
+Producer and consumer are threads of ONE process, like in single-process mode.
+
+Usage:
+    python queue_benchmark.py [batches] [items_per_batch]
+"""
+import multiprocessing
+import queue
+import sys
+import threading
+import time
+from pyVintedVN.items.item import Item
+from pipeline_queue import PipelineQueue, BLOCK
+
+
+def make_item_data(item_id):
+    """Realistic raw catalog API item payload"""
+    return {
+        "id": item_id,
+        "title": f"Nike Air Max 90 sneakers size 42 #{item_id}",
+        "brand_title": "Nike",
+        "size_title": "42",
+        "price": {"amount": "45.0", "currency_code": "EUR"},
+        "total_item_price": {"amount": "48.45", "currency_code": "EUR"},
+        "service_fee": {"amount": "3.45", "currency_code": "EUR"},
+        "url": f"https://www.vinted.de/items/{item_id}-nike-air-max-90",
+        "photo": {
+            "url": f"https://images1.vinted.net/t/{item_id}/f800/photo.jpeg",
+            "high_resolution": {"timestamp": 1760000000 + item_id},
+            "thumbnails": [{"type": t, "url": f"https://images1.vinted.net/t/{item_id}/{t}.jpeg"}
+                           for t in ("thumb70x100", "thumb150x210", "thumb310x430", "thumb428x624")],
+        },
+        "user": {"id": 1000 + item_id, "login": f"seller{item_id}", "business": False},
+        "favourite_count": 3,
+        "view_count": 0,
+        "status": "Sehr gut",
+        "is_visible": True,
+    }
+
+
+def make_item(item_id):
+    """Item built from a realistic catalog API payload"""
+    return Item(make_item_data(item_id))
+
+
+def run_case(name, q, batches):
+    """Push all batches through the queue (producer thread) and drain them (consumer)"""
+    received = [0]
+
+    def consumer():
+        while received[0] < len(batches):
+            try:
+                data, query_id = q.get(timeout=5)
+            except queue.Empty:
+                return
+            received[0] += 1
+
+    consumer_thread = threading.Thread(target=consumer)
+    start = time.perf_counter()
+    consumer_thread.start()
+    for batch in batches:
+        q.put(batch)
+    consumer_thread.join()
+    elapsed = time.perf_counter() - start
+
+    items = sum(len(batch[0]) for batch in batches)
+    print(f"{name:<28} {elapsed * 1000:9.1f} ms   {elapsed / items * 1e6:8.2f} us/item   "
+          f"{elapsed / len(batches) * 1e6:9.1f} us/batch")
+    return elapsed
+
+
+def main():
+    batch_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    items_per_batch = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    batches = [([make_item(b * items_per_batch + i) for i in range(items_per_batch)], b % 50)
+               for b in range(batch_count)]
+    print(f"{batch_count} batches x {items_per_batch} items\n")
+
+    manager = multiprocessing.Manager()
+    results = {
+        "Manager().Queue()": run_case("Manager().Queue()", manager.Queue(), batches),
+        "spawn Queue() (pipe)": run_case("spawn Queue() (pipe)",
+                                         multiprocessing.get_context("spawn").Queue(), batches),
+        "queue.Queue()": run_case("queue.Queue()", queue.Queue(), batches),
+        "PipelineQueue (block)": run_case("PipelineQueue (block)",
+                                          PipelineQueue("bench", batch_count, BLOCK), batches),
+    }
+    manager.shutdown()
+
+    baseline = results["Manager().Queue()"]
+    print()
+    for name, elapsed in results.items():
+        print(f"{name:<28} {baseline / elapsed:6.1f}x faster than Manager().Queue()")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,6 @@
 Модуль для автоматического редеплоя Railway при проблемах с подключением к Vinted
 """
 import os
-import time
 import threading
 import requests
 from datetime import datetime, timedelta, timezone
@@ -283,7 +282,7 @@ class RailwayRedeployManager:
         """
         logger.info("[REDEPLOY] 🔄 _perform_redeploy() called")
         logger.info("[REDEPLOY] ════════════════════════════════════════")
-        logger.info("[REDEPLOY] 🚀 Using os._exit(1) method (PROVEN TO WORK!)")
+        logger.info("[REDEPLOY] 🚀 Using process exit method (graceful drain first, PROVEN TO WORK!)")
         logger.info("[REDEPLOY] 💡 Railway will automatically restart container")
         logger.info("[REDEPLOY] ════════════════════════════════════════")
         
@@ -634,24 +633,16 @@ class RailwayRedeployManager:
             
             if allow_exit:
                 logger.critical("[REDEPLOY] ════════════════════════════════════════")
-                logger.critical("[REDEPLOY] 💣 METHOD 2: EMERGENCY EXIT (os._exit)")
+                logger.critical("[REDEPLOY] 💣 METHOD 2: EMERGENCY EXIT (graceful drain, then os._exit)")
                 logger.critical("[REDEPLOY] 🔄 Forcing app restart - Railway will auto-restart")
                 logger.critical("[REDEPLOY] ⏱️  Expected restart time: ~10-30 seconds")
                 logger.critical("[REDEPLOY] ════════════════════════════════════════")
                 
-                # Даем время на запись логов и БД
-                import threading
-                def delayed_exit():
-                    time.sleep(3)
-                    logger.critical("[REDEPLOY] 💥 FORCING EXIT NOW...")
-                    # Exit code 0 = нормальное завершение (Railway не будет блокировать)
-                    # Exit code 1 = ошибка (Railway может заблокировать после нескольких рестартов)
-                    # Railway автоматически перезапустит контейнер при любом exit code
-                    os._exit(0)
-                
-                thread = threading.Thread(target=delayed_exit)
-                thread.daemon = True
-                thread.start()
+                # Graceful drain: stop scans, drain queues, flush state snapshot, THEN exit
+                # Exit code 0 = нормальное завершение (Railway не будет блокировать)
+                # Railway автоматически перезапустит контейнер при любом exit code
+                from graceful_shutdown import request_graceful_shutdown
+                request_graceful_shutdown("redeploy", exit_code=0)
                 
                 return True
             else:
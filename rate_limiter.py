@@ -0,0 +1,380 @@
+"""
+Shared token-bucket rate limiter for Vinted API requests.
+
+403/429 storms come from bursts: at startup every slot fires at once and the
+403 retry loop adds immediate extra requests. Every Items.search() call now
+acquires ONE token from three buckets before hitting the API:
+
+- global bucket (all requests of this process)
+- per Vinted domain (www.vinted.de, www.vinted.fr, ...)
+- per proxy (each Token+Proxy pair)
+
+A request waits until all three buckets have a token, so the request rate
+never exceeds the configured rates (bursts are capped by the bucket size).
+On 429/403 the rates are cut multiplicatively and slowly grow back on success
+(AIMD), so throughput settles at the highest rate Vinted tolerates instead of
+oscillating into bans and redeploys. A throttled proxy only cuts its OWN
+bucket; the global and domain rates are cut on domain-level signals only -
+DOMAIN_SIGNAL_PROXIES different proxies throttled on the domain within
+DOMAIN_SIGNAL_WINDOW, or a throttled direct connection - so one bad proxy
+doesn't slow every query down.
+
+Budgets are per process. With scan worker shards (worker_sharding) every shard
+has its own limiter but scans through the same domains and proxies, so each
+shard gets 1/shard_count of every configured rate and burst (get_budget_share())
+and the shards together stay within the configured budget. The coordinator
+keeps the full budget - it only sends seller country lookups, which are capped
+by seller_lookup_rps on top.
+"""
+import threading
+import time
+from collections import deque
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Upper bounds (seconds) of the wait-time histogram buckets
+WAIT_HISTOGRAM_BUCKETS = [0.0, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30]
+# How many recent wait samples are kept for avg/p95 metrics
+WAIT_SAMPLES_WINDOW = 1000
+# How often rates/bursts are re-read from DB parameters (seconds)
+CONFIG_RELOAD_INTERVAL = 30
+
+# Defaults for the DB parameters (requests per second / bucket size)
+DEFAULT_GLOBAL_RATE = 5.0
+DEFAULT_GLOBAL_BURST = 10
+DEFAULT_DOMAIN_RATE = 5.0
+DEFAULT_DOMAIN_BURST = 10
+DEFAULT_PROXY_RATE = 0.5
+DEFAULT_PROXY_BURST = 2
+
+# AIMD: cut rate on throttling, grow it back on success
+THROTTLE_DECREASE = 0.7
+THROTTLE_INCREASE = 0.01
+THROTTLE_MIN_FACTOR = 0.2
+# Domain-level throttle signal: this many different proxies throttled within the window (seconds)
+DOMAIN_SIGNAL_PROXIES = 3
+DOMAIN_SIGNAL_WINDOW = 60
+
+
+def get_budget_share():
+    """Share of the configured budgets owned by this process (1/shard_count in a worker shard)"""
+    import core
+    shard = core.get_worker_shard()
+    return 1.0 / shard[1] if shard else 1.0
+
+
+class TokenBucket:
+    """Classic token bucket (not thread-safe - guarded by the RateLimiter lock)"""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.last_used = self.updated
+
+    def refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def time_until_token(self):
+        """Seconds until one token is available (after refill)"""
+        if self.tokens >= 1:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Global + per-domain + per-proxy token buckets.
+
+    Features:
+    - acquire() blocks until ALL buckets of a request have a token
+    - Tokens are taken atomically (no partial holds while waiting)
+    - Configurable rates and bursts (DB parameters, reloaded every 30s)
+    - AIMD throttle factors driven by 429/403 responses: per proxy, and
+      global/domain on domain-level signals
+    - Wait-time histogram and avg/p95 metrics
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.config = {}
+        self.config_loaded = 0
+        self.global_bucket = None
+        self.domain_buckets = {}
+        self.proxy_buckets = {}
+        self.throttle_factor = 1.0
+        self.proxy_factors = {}  # proxy -> AIMD factor of its bucket (missing = 1.0)
+        self.throttle_signals = {}  # domain -> deque of (time, proxy) of recent 429/403
+
+        # Metrics
+        self._wait_samples = deque(maxlen=WAIT_SAMPLES_WINDOW)
+        self.histogram = [0] * (len(WAIT_HISTOGRAM_BUCKETS) + 1)
+        self.total_acquired = 0
+        self.total_waited = 0
+        self.total_wait_seconds = 0.0
+        self.throttle_events = 0
+        self.proxy_throttle_events = 0
+
+    def _load_config(self):
+        """Read rates and bursts from DB parameters (with defaults)"""
+        import db
+        try:
+            config = {
+                "enabled": (db.get_parameter("rate_limit_enabled") or "True") == "True",
+                "global_rate": float(db.get_parameter("rate_limit_global_rps") or DEFAULT_GLOBAL_RATE),
+                "global_burst": float(db.get_parameter("rate_limit_global_burst") or DEFAULT_GLOBAL_BURST),
+                "domain_rate": float(db.get_parameter("rate_limit_domain_rps") or DEFAULT_DOMAIN_RATE),
+                "domain_burst": float(db.get_parameter("rate_limit_domain_burst") or DEFAULT_DOMAIN_BURST),
+                "proxy_rate": float(db.get_parameter("rate_limit_proxy_rps") or DEFAULT_PROXY_RATE),
+                "proxy_burst": float(db.get_parameter("rate_limit_proxy_burst") or DEFAULT_PROXY_BURST),
+            }
+        except (ValueError, TypeError) as e:
+            logger.warning(f"[RATE_LIMIT] Invalid rate limit parameters, using defaults: {e}")
+            config = {
+                "enabled": True,
+                "global_rate": DEFAULT_GLOBAL_RATE, "global_burst": DEFAULT_GLOBAL_BURST,
+                "domain_rate": DEFAULT_DOMAIN_RATE, "domain_burst": DEFAULT_DOMAIN_BURST,
+                "proxy_rate": DEFAULT_PROXY_RATE, "proxy_burst": DEFAULT_PROXY_BURST,
+            }
+        share = get_budget_share()
+        for key in ("global", "domain", "proxy"):
+            config[f"{key}_rate"] *= share
+            config[f"{key}_burst"] = max(1.0, config[f"{key}_burst"] * share)
+        config["budget_share"] = share
+        return config
+
+    def _maybe_reload(self):
+        """
+        Reload config if stale and apply it to existing buckets.
+        The DB is read OUTSIDE the lock (acquire() callers don't wait on it);
+        the new config is swapped in under the lock.
+        """
+        if self.config and time.time() - self.config_loaded < CONFIG_RELOAD_INTERVAL:
+            return
+        with self.lock:
+            if self.config and time.time() - self.config_loaded < CONFIG_RELOAD_INTERVAL:
+                return
+            # Claim the reload - other threads keep using the current config meanwhile
+            self.config_loaded = time.time()
+        config = self._load_config()
+        with self.lock:
+            self.config = config
+            if self.global_bucket is None:
+                self.global_bucket = TokenBucket(config["global_rate"], config["global_burst"])
+            self._apply_rates(time.monotonic())
+
+    def _apply_rates(self, now):
+        """Push configured rates (scaled by the throttle factor) into all buckets"""
+        factor = self.throttle_factor
+        self.global_bucket.refill(now)
+        self.global_bucket.rate = self.config["global_rate"] * factor
+        self.global_bucket.burst = self.config["global_burst"]
+        for bucket in self.domain_buckets.values():
+            bucket.refill(now)
+            bucket.rate = self.config["domain_rate"] * factor
+            bucket.burst = self.config["domain_burst"]
+        for proxy, bucket in self.proxy_buckets.items():
+            bucket.refill(now)
+            bucket.rate = self.config["proxy_rate"] * self.proxy_factors.get(proxy, 1.0)
+            bucket.burst = self.config["proxy_burst"]
+
+    def _get_buckets(self, domain, proxy, now):
+        """Buckets a request must take tokens from (called under lock)"""
+        buckets = [self.global_bucket]
+        if domain:
+            bucket = self.domain_buckets.get(domain)
+            if bucket is None:
+                bucket = TokenBucket(self.config["domain_rate"] * self.throttle_factor, self.config["domain_burst"])
+                self.domain_buckets[domain] = bucket
+            buckets.append(bucket)
+        if proxy:
+            bucket = self.proxy_buckets.get(proxy)
+            if bucket is None:
+                bucket = TokenBucket(self.config["proxy_rate"] * self.proxy_factors.get(proxy, 1.0),
+                                     self.config["proxy_burst"])
+                self.proxy_buckets[proxy] = bucket
+            buckets.append(bucket)
+        for bucket in buckets:
+            bucket.refill(now)
+            bucket.last_used = now
+        return buckets
+
+    def _cleanup_proxy_buckets(self, now):
+        """Drop buckets of proxies not used for 10 minutes (proxies rotate a lot)"""
+        stale = [key for key, bucket in self.proxy_buckets.items() if now - bucket.last_used > 600]
+        for key in stale:
+            del self.proxy_buckets[key]
+            self.proxy_factors.pop(key, None)
+
+    def acquire(self, domain=None, proxy=None):
+        """
+        Block until the request may be sent.
+
+        Args:
+            domain: Vinted domain of the request (e.g. www.vinted.de)
+            proxy: Proxy URL of the session (None for direct connection)
+
+        Returns:
+            float: Seconds waited
+        """
+        start = time.monotonic()
+        while True:
+            self._maybe_reload()
+            with self.lock:
+                now = time.monotonic()
+                if not self.config["enabled"]:
+                    return 0.0
+                buckets = self._get_buckets(domain, proxy, now)
+                wait = max(bucket.time_until_token() for bucket in buckets)
+                if wait <= 0:
+                    for bucket in buckets:
+                        bucket.tokens -= 1
+                    waited = now - start
+                    self._record_wait(waited)
+                    if self.total_acquired % 500 == 0:
+                        self._cleanup_proxy_buckets(now)
+                    return waited
+            # Sleep outside the lock; cap so config changes / new tokens are picked up
+            time.sleep(min(wait, 1.0))
+
+    def has_capacity(self, domain=None, proxy=None):
+        """
+        Check (without taking a token) if a request could be sent right now.
+        Used by optional requests (catch-up pages) that must not eat into the budget.
+        """
+        self._maybe_reload()
+        with self.lock:
+            now = time.monotonic()
+            if not self.config["enabled"]:
+                return True
+            buckets = self._get_buckets(domain, proxy, now)
+            return max(bucket.time_until_token() for bucket in buckets) <= 0
+
+    def _record_wait(self, waited):
+        """Update wait metrics (called under lock)"""
+        self.total_acquired += 1
+        self._wait_samples.append(waited)
+        if waited > 0.001:
+            self.total_waited += 1
+            self.total_wait_seconds += waited
+        for idx, bound in enumerate(WAIT_HISTOGRAM_BUCKETS):
+            if waited <= bound:
+                self.histogram[idx] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+
+    def _is_domain_signal(self, domain, proxy, now):
+        """
+        Record a throttled response and check if it is domain-level (called under lock):
+        DOMAIN_SIGNAL_PROXIES different proxies throttled on the domain within the window.
+        """
+        signals = self.throttle_signals.setdefault(domain, deque())
+        signals.append((now, proxy))
+        while signals and now - signals[0][0] > DOMAIN_SIGNAL_WINDOW:
+            signals.popleft()
+        if len({p for _, p in signals}) < DOMAIN_SIGNAL_PROXIES:
+            return False
+        # The next domain-level cut needs fresh evidence
+        signals.clear()
+        return True
+
+    def _set_proxy_factor(self, proxy, factor, now):
+        """Update the AIMD factor of a proxy bucket (called under lock)"""
+        if factor >= 1.0:
+            self.proxy_factors.pop(proxy, None)
+            factor = 1.0
+        else:
+            self.proxy_factors[proxy] = factor
+        bucket = self.proxy_buckets.get(proxy)
+        if bucket is not None:
+            bucket.refill(now)
+            bucket.rate = self.config["proxy_rate"] * factor
+
+    def report_response(self, status_code, domain=None, proxy=None):
+        """
+        Feed the AIMD throttle with the result of a request.
+
+        Args:
+            status_code: HTTP status of the Vinted API response
+            domain: Vinted domain of the request (same key as acquire())
+            proxy: Proxy URL of the session (None for direct connection)
+        """
+        throttled = status_code in (429, 403)
+        cut = None
+        with self.lock:
+            if not self.config:
+                return
+            now = time.monotonic()
+            if throttled and proxy is not None and not self._is_domain_signal(domain, proxy, now):
+                # One proxy throttled - only its own bucket slows down
+                factor = max(THROTTLE_MIN_FACTOR, self.proxy_factors.get(proxy, 1.0) * THROTTLE_DECREASE)
+                self._set_proxy_factor(proxy, factor, now)
+                self.proxy_throttle_events += 1
+                cut = ("proxy", factor)
+            elif throttled:
+                # Domain-level signal (or direct connection - the only egress): global + domain rates
+                old_factor = self.throttle_factor
+                self.throttle_factor = max(THROTTLE_MIN_FACTOR, old_factor * THROTTLE_DECREASE)
+                self.throttle_events += 1
+                if self.throttle_factor != old_factor:
+                    self._apply_rates(now)
+                    cut = ("domain", self.throttle_factor)
+            elif status_code < 400:
+                old_factor = self.throttle_factor
+                self.throttle_factor = min(1.0, old_factor + THROTTLE_INCREASE)
+                if proxy in self.proxy_factors:
+                    self._set_proxy_factor(proxy, self.proxy_factors[proxy] + THROTTLE_INCREASE, now)
+                if self.throttle_factor != old_factor:
+                    self._apply_rates(now)
+        if cut and cut[0] == "proxy":
+            logger.debug(f"[RATE_LIMIT] 🐢 HTTP {status_code} via {proxy} - its rate cut to {cut[1] * 100:.0f}%")
+        elif cut:
+            logger.warning(f"[RATE_LIMIT] 🐢 HTTP {status_code} on {domain or 'the API'} - request rate cut to "
+                           f"{cut[1] * 100:.0f}% of configured")
+
+    def get_stats(self):
+        """Get rate limiter statistics (wait-time histogram, buckets, throttle)"""
+        with self.lock:
+            waits = sorted(self._wait_samples)
+            histogram = {}
+            for idx, bound in enumerate(WAIT_HISTOGRAM_BUCKETS):
+                histogram[f"<={bound}s"] = self.histogram[idx]
+            histogram[f">{WAIT_HISTOGRAM_BUCKETS[-1]}s"] = self.histogram[-1]
+            return {
+                "enabled": self.config.get("enabled", True),
+                "config": dict(self.config),
+                "throttle_factor": round(self.throttle_factor, 3),
+                "throttle_events": self.throttle_events,
+                "proxy_throttle_events": self.proxy_throttle_events,
+                "throttled_proxies": len(self.proxy_factors),
+                "effective_global_rps": round(self.global_bucket.rate, 3) if self.global_bucket else None,
+                "total_acquired": self.total_acquired,
+                "total_waited": self.total_waited,
+                "total_wait_seconds": round(self.total_wait_seconds, 2),
+                "wait_avg_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "wait_p95_seconds": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+                "wait_histogram": histogram,
+                "domains": {domain: round(bucket.tokens, 2) for domain, bucket in self.domain_buckets.items()},
+                "proxy_buckets": len(self.proxy_buckets),
+            }
+
+
+# Global rate limiter instance
+_global_rate_limiter = None
+_global_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Get or create global rate limiter"""
+    global _global_rate_limiter
+    with _global_rate_limiter_lock:
+        if _global_rate_limiter is None:
+            _global_rate_limiter = RateLimiter()
+        return _global_rate_limiter
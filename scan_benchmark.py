@@ -0,0 +1,108 @@
+"""
+Benchmark: per-scan cost of decoding a catalog response and building items.
+
+Compares what a worker does with ONE page of catalog results:
+- old path: response.json() (bytes -> str -> stdlib json), an Item for every
+  result, dedup later
+- new path: fast decoder on the raw bytes (orjson if installed), dedup on
+  the raw ids with the seen items tracker, Item objects only for new listings
+- early exit: only the page's new items are decoded (early_exit_parser),
+  the already seen rest of the page is skipped
+
+Every simulated scan returns a full page where only a few items are new,
+like a busy query in steady state (new_per_scan=0: a quiet query).
+
+Usage:
+    python scan_benchmark.py [scans] [items_per_page] [new_per_scan]
+"""
+import json
+import sys
+import time
+from pyVintedVN.items.item import Item
+from pyVintedVN.items.items import _json_loads
+from seen_items import SeenItemsTracker, get_seen_items_tracker
+from early_exit_parser import EarlyExitParser, DEFAULT_AUDIT_INTERVAL
+from queue_benchmark import make_item_data
+
+
+def make_pages(scans, items_per_page, new_per_scan):
+    """Catalog responses (bytes) - each page shifts by new_per_scan items"""
+    pages = []
+    for scan in range(scans):
+        newest = 1000000 + scan * new_per_scan + items_per_page
+        items = [make_item_data(newest - i) for i in range(items_per_page)]
+        payload = {"items": items, "pagination": {"current_page": 1, "per_page": items_per_page}}
+        # Compact, like the API sends it
+        pages.append(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    return pages
+
+
+def old_path(pages):
+    created = 0
+    for page in pages:
+        # requests' response.json(): decode bytes to text, then stdlib json
+        items = [Item(data) for data in json.loads(page.decode("utf-8"))["items"]]
+        created += len(items)
+    return created
+
+
+def new_path(pages):
+    tracker = SeenItemsTracker()
+    created = 0
+    for page in pages:
+        raw_items = _json_loads(page)["items"]
+        new_ids = tracker.observe(1, [data["id"] for data in raw_items])
+        if new_ids is None:
+            items = [Item(data) for data in raw_items]
+        else:
+            new_ids = set(new_ids)
+            items = [Item(data) for data in raw_items if data["id"] in new_ids]
+        created += len(items)
+    return created
+
+
+def early_exit_path(pages):
+    parser = EarlyExitParser(config={"enabled": True, "audit_interval": DEFAULT_AUDIT_INTERVAL})
+    tracker = get_seen_items_tracker()
+    created = 0
+    for page in pages:
+        raw_items = parser.parse(page, "benchmark")
+        new_ids = tracker.observe("benchmark", [data["id"] for data in raw_items])
+        if new_ids is None:
+            items = [Item(data) for data in raw_items]
+        else:
+            new_ids = set(new_ids)
+            items = [Item(data) for data in raw_items if data["id"] in new_ids]
+        created += len(items)
+    stats = parser.get_stats()
+    print(f"{'':<36} early exits: {stats['early_exits']}, full parses: {stats['full_parses']}, "
+          f"audits: {stats['audits']}")
+    return created
+
+
+def run_case(name, func, pages):
+    start = time.perf_counter()
+    created = func(pages)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<36} {elapsed * 1000:9.1f} ms   {elapsed / len(pages) * 1e6:8.1f} us/scan   "
+          f"{created:7d} Item objects")
+    return elapsed
+
+
+def main():
+    scans = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    items_per_page = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    new_per_scan = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    pages = make_pages(scans, items_per_page, new_per_scan)
+    print(f"{scans} scans x {items_per_page} items, {new_per_scan} new per scan, "
+          f"decoder: {_json_loads.__module__}\n")
+
+    old = run_case("response.json() + Item for all", old_path, pages)
+    new = run_case("fast decode + dedup + lazy Item", new_path, pages)
+    early = run_case("early exit + dedup + lazy Item", early_exit_path, pages)
+    print(f"\nfast decode: {old / new:.1f}x faster, {(old - new) / scans * 1e6:.1f} us saved per scan")
+    print(f"early exit:  {old / early:.1f}x faster, {(old - early) / scans * 1e6:.1f} us saved per scan")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+Central deadline scheduler for query scans.
+
+Before: every worker thread did scan -> time.sleep(refresh_delay), so the real
+period was refresh_delay + scan time and the 10s stagger of priority workers
+slowly decayed.
+
+Now: all scan slots live in ONE min-heap ordered by next due time. A single
+dispatcher thread pops due slots and hands them to a bounded executor.
+The next deadline is computed from the PREVIOUS deadline (not from the end of
+the scan), so every slot keeps its phase forever.
+"""
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# How many recent lag samples are kept for avg/p95 metrics
+LAG_SAMPLES_WINDOW = 500
+# Shortest slot period (seconds) - query_refresh_delay / adaptive intervals of 0 would spin
+MIN_PERIOD = 1.0
+# Golden ratio fraction: consecutive keys land far apart on the period
+PHASE_SPREAD = 0.6180339887
+
+
+def spread_phase(key, period):
+    """Initial phase of a slot in [0, period), spread by its key (query id) so slots don't fire together"""
+    return (key * PHASE_SPREAD) % 1.0 * max(MIN_PERIOD, period)
+
+
+class ScanJob:
+    """
+    One schedulable scan slot.
+
+    The worker object must provide scan_once() which performs a single scan
+    and returns the period (seconds) until the next scan of this slot.
+    """
+    def __init__(self, job_id, worker, period, next_due):
+        self.job_id = job_id
+        self.worker = worker
+        self.period = period
+        self.next_due = next_due
+        self.cancelled = False
+        self.running = False
+        self.scans = 0
+        self.missed_deadlines = 0
+        self.last_lag = 0.0
+        # Original deadline of a slot pulled forward by run_all_now()
+        self.resume_due = None
+
+    def __repr__(self):
+        return f"ScanJob(id={self.job_id}, period={self.period}s, scans={self.scans}, missed={self.missed_deadlines})"
+
+
+class ScanScheduler:
+    """
+    Deadline-based scheduler for all query scans.
+
+    Features:
+    - Min-heap of next due deadlines (one entry per scan slot)
+    - Bounded executor (max_concurrency scans in flight)
+    - Phase-locked periods: next_due = previous_due + period
+    - Overrun slots skip missed deadlines instead of bursting to catch up
+    - Periods clamped to MIN_PERIOD
+    - Scheduling lag metric (actual scan start - deadline)
+    """
+
+    def __init__(self, max_concurrency=32):
+        self.max_concurrency = max_concurrency
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="scan")
+        self.jobs = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+        # Metrics
+        self._lag_samples = deque(maxlen=LAG_SAMPLES_WINDOW)
+        self.total_dispatched = 0
+        self.total_missed_deadlines = 0
+        self.max_lag = 0.0
+
+        logger.info(f"[SCHEDULER] Initialized with max_concurrency={max_concurrency}")
+
+    def add_job(self, job_id, worker, period, phase=0.0, anchor=None):
+        """
+        Register a scan slot.
+
+        Args:
+            job_id: Unique slot identifier (worker index)
+            worker: Object with scan_once() -> next period in seconds
+            period: Initial period in seconds
+            phase: Offset from anchor for the first deadline (e.g. 0, 10, 20... for priority workers)
+            anchor: Common time origin for phase-locked slots (default: now)
+        """
+        if anchor is None:
+            anchor = time.time()
+        job = ScanJob(job_id, worker, max(MIN_PERIOD, period), anchor + phase)
+        with self._cond:
+            old_job = self.jobs.get(job_id)
+            if old_job:
+                old_job.cancelled = True
+            self.jobs[job_id] = job
+            self._push(job)
+            self._cond.notify()
+        return job
+
+    def remove_job(self, job_id):
+        """Cancel a scan slot (lazy removal - heap entry is skipped when popped)"""
+        with self._cond:
+            job = self.jobs.pop(job_id, None)
+            if job:
+                job.cancelled = True
+                self._cond.notify()
+            return job
+
+    def run_all_now(self):
+        """
+        Make every slot due immediately (used by "force scan").
+        Slots return to their original deadlines afterwards, so phases are kept.
+        """
+        now = time.time()
+        with self._cond:
+            for job in self.jobs.values():
+                if not job.running and job.next_due > now:
+                    job.resume_due = job.next_due
+                    job.next_due = now
+                    self._push(job)
+            self._cond.notify()
+
+    def start(self):
+        """Start the dispatcher thread"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._dispatch_loop, name="scan-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"[SCHEDULER] 🚀 Dispatcher started with {len(self.jobs)} slots")
+
+    def shutdown(self, wait=False):
+        """Stop dispatching and shut the executor down"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self.executor.shutdown(wait=wait)
+        logger.info("[SCHEDULER] Dispatcher stopped")
+
+    def drain(self, timeout):
+        """
+        Stop dispatching new scans and wait for in-flight scans to finish.
+
+        Returns:
+            int: Scans still running when the timeout expired
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        deadline = time.time() + timeout
+        while True:
+            with self._cond:
+                in_flight = sum(1 for j in self.jobs.values() if j.running)
+            if in_flight == 0 or time.time() >= deadline:
+                break
+            time.sleep(0.1)
+        self.executor.shutdown(wait=False)
+        logger.info(f"[SCHEDULER] Drained ({in_flight} scans still in flight)")
+        return in_flight
+
+    def _push(self, job):
+        heapq.heappush(self._heap, (job.next_due, next(self._seq), job))
+
+    def _dispatch_loop(self):
+        """Pop due slots from the heap and submit them to the executor"""
+        while True:
+            with self._cond:
+                job = None
+                while self._running:
+                    if not self._heap:
+                        self._cond.wait(timeout=1.0)
+                        continue
+                    due, _, candidate = self._heap[0]
+                    # Skip cancelled slots and stale heap entries
+                    if candidate.cancelled or candidate.running or due != candidate.next_due:
+                        heapq.heappop(self._heap)
+                        continue
+                    wait_time = due - time.time()
+                    if wait_time <= 0:
+                        heapq.heappop(self._heap)
+                        job = candidate
+                        job.running = True
+                        break
+                    self._cond.wait(timeout=min(wait_time, 1.0))
+                if not self._running:
+                    return
+            try:
+                self.executor.submit(self._run_job, job, due)
+                self.total_dispatched += 1
+            except RuntimeError as e:
+                # Executor already shut down
+                logger.warning(f"[SCHEDULER] Could not dispatch {job}: {e}")
+                return
+
+    def _run_job(self, job, due):
+        """Run one scan and schedule the next deadline of the slot"""
+        lag = max(0.0, time.time() - due)
+        job.last_lag = lag
+        self._lag_samples.append(lag)
+        if lag > self.max_lag:
+            self.max_lag = lag
+
+        period = job.period
+        try:
+            next_period = job.worker.scan_once()
+            if next_period:
+                period = next_period
+        except Exception as e:
+            logger.error(f"[SCHEDULER] Scan slot #{job.job_id} raised: {e}", exc_info=True)
+        finally:
+            with self._cond:
+                job.running = False
+                job.scans += 1
+                if not job.cancelled:
+                    job.period = period = max(MIN_PERIOD, period)
+                    if job.resume_due is not None:
+                        next_due, job.resume_due = job.resume_due, None
+                    else:
+                        next_due = due + period
+                    now = time.time()
+                    if next_due <= now:
+                        # Scan overran its slot - skip missed deadlines to stay phase-locked
+                        missed = int((now - next_due) // period) + 1
+                        next_due += missed * period
+                        job.missed_deadlines += missed
+                        self.total_missed_deadlines += missed
+                    job.next_due = next_due
+                    self._push(job)
+                    self._cond.notify()
+
+    def get_stats(self):
+        """Get scheduler statistics (scheduling lag, backlog, slots)"""
+        lags = sorted(self._lag_samples)
+        now = time.time()
+        with self._cond:
+            running = sum(1 for j in self.jobs.values() if j.running)
+            overdue = sum(1 for j in self.jobs.values() if not j.running and j.next_due <= now)
+            total_jobs = len(self.jobs)
+        return {
+            "running": self._running,
+            "max_concurrency": self.max_concurrency,
+            "total_slots": total_jobs,
+            "in_flight": running,
+            "overdue": overdue,
+            "total_dispatched": self.total_dispatched,
+            "total_missed_deadlines": self.total_missed_deadlines,
+            "lag_avg_seconds": round(sum(lags) / len(lags), 3) if lags else 0.0,
+            "lag_p95_seconds": round(lags[min(len(lags) - 1, int(len(lags) * 0.95))], 3) if lags else 0.0,
+            "lag_max_seconds": round(self.max_lag, 3),
+        }
+
+
+# Global scheduler instance
+_global_scheduler = None
+
+
+def get_scan_scheduler(max_concurrency=32):
+    """Get or create global scan scheduler instance"""
+    global _global_scheduler
+    if _global_scheduler is None:
+        _global_scheduler = ScanScheduler(max_concurrency=max_concurrency)
+    return _global_scheduler
+
+
+def get_scheduler_stats():
+    """Get scheduler statistics, or None if the scheduler was not started"""
+    if _global_scheduler is None:
+        return None
+    return _global_scheduler.get_stats()
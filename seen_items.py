@@ -0,0 +1,135 @@
+"""
+Per-query memory of recently seen Vinted item ids.
+
+Workers use it to tell how many items of a scan are really NEW for the query
+(the items table dedup happens much later, in the item processor).
+"""
+import threading
+from collections import deque
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# How many recent item ids are remembered per query
+SEEN_WINDOW_SIZE = 500
+
+
+class _SeenState:
+    """Seen ids of ONE query (bounded FIFO window + max id watermark)"""
+    def __init__(self, window):
+        self.ids = set()
+        self.order = deque()
+        self.window = window
+        self.watermark = None
+
+    def add(self, item_id):
+        self.ids.add(item_id)
+        self.order.append(item_id)
+        if len(self.order) > self.window:
+            self.ids.discard(self.order.popleft())
+        if self.watermark is None or item_id > self.watermark:
+            self.watermark = item_id
+
+
+class SeenItemsTracker:
+    """
+    Thread-safe tracker of seen item ids per query.
+
+    The first observation of a query is a baseline: its items are remembered
+    but not reported as new (we can't know what was published before start).
+    """
+
+    def __init__(self, window=SEEN_WINDOW_SIZE):
+        self.window = window
+        self.states = {}
+        self.lock = threading.Lock()
+
+    def observe(self, key, item_ids):
+        """
+        Remember item ids of a scan.
+
+        Args:
+            key: Query identifier (query_id)
+            item_ids: Iterable of item ids returned by the scan
+
+        Returns:
+            list or None: Ids not seen before, or None for the baseline (first) scan
+        """
+        with self.lock:
+            state = self.states.get(key)
+            is_baseline = state is None
+            if is_baseline:
+                state = _SeenState(self.window)
+                self.states[key] = state
+            new_ids = []
+            for item_id in item_ids:
+                if item_id not in state.ids:
+                    new_ids.append(item_id)
+                    state.add(item_id)
+            return None if is_baseline else new_ids
+
+    def is_seen(self, key, item_id):
+        """Check if an item id was already seen for the query"""
+        with self.lock:
+            state = self.states.get(key)
+            return state is not None and item_id in state.ids
+
+    def seen_flags(self, key, item_ids):
+        """
+        Check many item ids at once (one lock round-trip).
+
+        Returns:
+            list or None: True/False per id, None if nothing was seen for the query yet
+        """
+        with self.lock:
+            state = self.states.get(key)
+            if state is None:
+                return None
+            return [item_id in state.ids for item_id in item_ids]
+
+    def get_watermark(self, key):
+        """Get the highest item id seen for the query (None if unknown)"""
+        with self.lock:
+            state = self.states.get(key)
+            return state.watermark if state else None
+
+    def export_state(self, max_ids=100):
+        """
+        Snapshot for a restart (graceful shutdown): watermark + most recent ids per query.
+
+        Returns:
+            dict: key -> {"watermark": int, "ids": [int]}
+        """
+        with self.lock:
+            return {key: {"watermark": state.watermark, "ids": list(state.order)[-max_ids:]}
+                    for key, state in self.states.items()}
+
+    def import_state(self, snapshot):
+        """Restore a snapshot - the first scan after a restart is then NOT a baseline"""
+        with self.lock:
+            for key, data in snapshot.items():
+                state = _SeenState(self.window)
+                for item_id in data.get("ids") or []:
+                    state.add(item_id)
+                if data.get("watermark") is not None:
+                    state.watermark = max(state.watermark or 0, data["watermark"])
+                self.states[key] = state
+
+    def forget(self, key):
+        """Drop everything known about a query (query removed)"""
+        with self.lock:
+            self.states.pop(key, None)
+
+
+# Global tracker instance
+_global_tracker = None
+_global_tracker_lock = threading.Lock()
+
+
+def get_seen_items_tracker():
+    """Get or create global seen items tracker"""
+    global _global_tracker
+    with _global_tracker_lock:
+        if _global_tracker is None:
+            _global_tracker = SeenItemsTracker()
+        return _global_tracker
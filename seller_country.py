@@ -0,0 +1,476 @@
+"""
+Seller-country allowlist filtering with a persistent seller -> country cache.
+
+The allowlist table existed but the pipeline never used it: enforcing it
+needs the seller's country, and /api/v2/users/{id} per item would multiply
+the request volume. Countries are now resolved in this order:
+
+1. in-memory LRU (seller id -> country, long TTL)
+2. seller_countries DB table - ONE query for all unknown sellers of a batch
+3. country_iso_code in the catalog item itself, when present (no request)
+4. users API lookup in a background resolver thread
+
+Items of sellers that are still unresolved are HELD (not passed, not
+dropped) until their lookup completes, then put back into the scan queue
+and filtered again - an empty budget can't let them slip past the allowlist.
+Lookups go through token pool sessions (token + proxy pairs, circuit
+breakers) and the shared rate limiter, on top of the seller_lookup_rps
+bucket; a round of lookups is written back with ONE upsert.
+
+Only real API answers are cached (a deleted account or a profile without a
+country is cached as unknown). Timeouts, 429s and other failures are retried
+with backoff; after MAX_LOOKUP_ATTEMPTS the held items follow
+allowlist_unknown_action ("allow" by default, or "deny") and the seller is
+looked up again after GIVE_UP_SECONDS.
+
+Sellers repeat a lot, so in steady state almost every batch is served from
+the cache.
+"""
+import threading
+import time
+from collections import OrderedDict
+from pyVintedVN.settings import Urls
+from rate_limiter import TokenBucket
+from logger import get_logger
+
+# Fast JSON decoder if available
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+logger = get_logger(__name__)
+
+UNKNOWN_COUNTRY = "XX"
+# In-memory LRU size
+LRU_MAX_SIZE = 50000
+# Unknown countries (deleted accounts, legacy failed lookups) are re-checked after this many seconds
+UNKNOWN_TTL = 3600
+# Users are shared between all Vinted platforms - use the locale the pool's tokens were issued for
+LOOKUP_LOCALE = "www.vinted.de"
+# Failed lookups are retried with a doubling backoff (seconds)
+LOOKUP_RETRY_BASE = 5
+LOOKUP_RETRY_MAX = 300
+# After this many failed lookups the held items follow allowlist_unknown_action
+MAX_LOOKUP_ATTEMPTS = 6
+# How long a seller whose lookup gave up is treated as unknown (seconds, nothing is cached)
+GIVE_UP_SECONDS = 600
+# How often the allowlist and parameters are re-read (seconds, only while items arrive)
+CONFIG_RELOAD_INTERVAL = 30
+
+# Defaults for the DB parameters
+DEFAULT_TTL_DAYS = 30
+DEFAULT_LOOKUP_RPS = 0.5
+DEFAULT_LOOKUP_BURST = 5
+DEFAULT_LOOKUPS_PER_BATCH = 10
+
+
+def get_seller_id(item):
+    """Seller id from the catalog item data (None if missing)"""
+    return getattr(item, "seller_id", None)
+
+
+def _embedded_country(item):
+    """Country already present in the catalog item (saves a users API request)"""
+    return getattr(item, "seller_country", None)
+
+
+class SellerCountryFilter:
+    """
+    Allowlist enforcement for the item pipeline.
+
+    Features:
+    - LRU + DB cache of seller countries with TTL
+    - Batched DB reads/writes per scanned batch and per lookup round
+    - Items of unresolved sellers held until the background resolver answers
+    - Lookups via token pool sessions + shared rate limiter, retried with backoff
+    - Hit/miss/lookup/hold/rejection counters
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.cache = OrderedDict()  # user_id -> (country, fetched_at)
+        self.config = {}
+        self.config_loaded = 0
+        self.allowlist = None
+        self.lookup_bucket = None
+
+        # Background resolver (guarded by self.lock)
+        self.held = {}  # user_id -> [(items_queue, query_id, item)]
+        self.pending = OrderedDict()  # user_id -> (failed attempts, retry_at)
+        self.given_up = {}  # user_id -> treated as unknown until
+        self.releasing = 0  # held items being put back into the scan queue
+        self.resolver = None
+        self.session = None  # token session used for lookups
+
+        # Metrics
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.embedded_hits = 0
+        self.api_lookups = 0
+        self.api_failures = 0
+        self.lookups_given_up = 0
+        self.items_held = 0
+        self.items_released = 0
+        self.total_checked = 0
+        self.total_rejected = 0
+        self.total_unknown = 0
+
+    def _load_config(self):
+        import db
+        try:
+            config = {
+                "ttl": float(db.get_parameter("seller_country_ttl_days") or DEFAULT_TTL_DAYS) * 86400,
+                "lookup_rps": float(db.get_parameter("seller_lookup_rps") or DEFAULT_LOOKUP_RPS),
+                "lookup_burst": max(1.0, float(db.get_parameter("seller_lookup_burst") or DEFAULT_LOOKUP_BURST)),
+                "lookups_per_batch": max(1, int(db.get_parameter("seller_lookups_per_batch") or DEFAULT_LOOKUPS_PER_BATCH)),
+            }
+        except (ValueError, TypeError) as e:
+            logger.warning(f"[COUNTRY] Invalid seller country parameters, using defaults: {e}")
+            config = {
+                "ttl": DEFAULT_TTL_DAYS * 86400,
+                "lookup_rps": DEFAULT_LOOKUP_RPS,
+                "lookup_burst": DEFAULT_LOOKUP_BURST,
+                "lookups_per_batch": DEFAULT_LOOKUPS_PER_BATCH,
+            }
+        config["deny_unknown"] = (db.get_parameter("allowlist_unknown_action") or "allow") == "deny"
+        return config
+
+    def _maybe_reload(self):
+        import db
+        if self.config and time.time() - self.config_loaded < CONFIG_RELOAD_INTERVAL:
+            return
+        self.config = self._load_config()
+        self.config_loaded = time.time()
+        countries = db.get_allowlist()
+        # get_allowlist() returns 0 when empty
+        self.allowlist = frozenset(c.upper() for c in countries) if countries else None
+        with self.lock:
+            if self.lookup_bucket is None:
+                self.lookup_bucket = TokenBucket(self.config["lookup_rps"], self.config["lookup_burst"])
+            else:
+                self.lookup_bucket.rate = self.config["lookup_rps"]
+                self.lookup_bucket.burst = self.config["lookup_burst"]
+
+    def invalidate(self):
+        """Allowlist changed - re-read it on the next batch"""
+        self.config_loaded = 0
+
+    def _cache_get(self, user_id, now):
+        entry = self.cache.get(user_id)
+        if entry is None:
+            return None
+        country, fetched_at = entry
+        ttl = UNKNOWN_TTL if country == UNKNOWN_COUNTRY else self.config["ttl"]
+        if now - fetched_at > ttl:
+            del self.cache[user_id]
+            return None
+        self.cache.move_to_end(user_id)
+        return country
+
+    def _cache_put(self, user_id, country, fetched_at):
+        self.cache[user_id] = (country, fetched_at)
+        self.cache.move_to_end(user_id)
+        while len(self.cache) > LRU_MAX_SIZE:
+            self.cache.popitem(last=False)
+
+    def resolve(self, items):
+        """
+        Countries of the sellers of a batch, from the caches and the item data (no requests).
+
+        Returns:
+            dict: seller id -> country code (sellers left unresolved are missing)
+        """
+        import db
+        now = time.time()
+        countries = {}
+        missing = {}
+        with self.lock:
+            for item in items:
+                user_id = get_seller_id(item)
+                if user_id is None or user_id in countries or user_id in missing:
+                    continue
+                country = self._cache_get(user_id, now)
+                if country is not None:
+                    countries[user_id] = country
+                    self.memory_hits += 1
+                else:
+                    missing[user_id] = item
+            # Sellers waiting for a lookup aren't in the DB either
+            unqueued = [user_id for user_id in missing if user_id not in self.pending]
+        if not missing:
+            return countries
+
+        # ONE DB query for every seller the LRU doesn't know
+        stored = db.get_seller_countries(unqueued) if unqueued else {}
+        for user_id, (country, fetched_at) in stored.items():
+            ttl = UNKNOWN_TTL if country == UNKNOWN_COUNTRY else self.config["ttl"]
+            if now - fetched_at <= ttl:
+                countries[user_id] = country
+                with self.lock:
+                    self.db_hits += 1
+                    self._cache_put(user_id, country, fetched_at)
+                del missing[user_id]
+
+        new_rows = []
+        for user_id, item in missing.items():
+            country = _embedded_country(item)
+            if country:
+                new_rows.append((user_id, country, now))
+                countries[user_id] = country
+
+        if new_rows:
+            with self.lock:
+                self.embedded_hits += len(new_rows)
+                for user_id, country, fetched_at in new_rows:
+                    self._cache_put(user_id, country, fetched_at)
+            db.save_seller_countries(new_rows)
+        return countries
+
+    def filter_batch(self, items, query_id=None, items_queue=None):
+        """
+        Keep only items from sellers in allowed countries.
+
+        Args:
+            items: Items of one scanned batch
+            query_id: Query of the batch
+            items_queue: Scan queue that held items are put back into once their seller
+                is resolved (None = unresolved sellers follow allowlist_unknown_action)
+
+        Returns:
+            list: Items that passed (the input list if the allowlist is empty)
+        """
+        self._maybe_reload()
+        if self.allowlist is None or not items:
+            return items
+
+        countries = self.resolve(items)
+        now = time.time()
+        kept = []
+        to_hold = {}
+        unknown = 0
+        for item in items:
+            user_id = get_seller_id(item)
+            country = countries.get(user_id)
+            if (country is None and user_id is not None and items_queue is not None
+                    and self.given_up.get(user_id, 0) < now):
+                to_hold.setdefault(user_id, []).append(item)
+            elif country is None or country == UNKNOWN_COUNTRY:
+                unknown += 1
+                if not self.config["deny_unknown"]:
+                    kept.append(item)
+            elif country.upper() in self.allowlist:
+                kept.append(item)
+        if to_hold:
+            self._hold(to_hold, query_id, items_queue)
+        checked = len(items) - sum(len(held) for held in to_hold.values())
+        with self.lock:
+            self.total_checked += checked
+            self.total_rejected += checked - len(kept)
+            self.total_unknown += unknown
+        return kept
+
+    def _hold(self, to_hold, query_id, items_queue):
+        """Hold items until their sellers are resolved and queue the lookups"""
+        now = time.time()
+        with self.lock:
+            for user_id, items in to_hold.items():
+                self.held.setdefault(user_id, []).extend((items_queue, query_id, item) for item in items)
+                self.items_held += len(items)
+                if user_id not in self.pending:
+                    self.pending[user_id] = (0, now)
+            if self.resolver is None or not self.resolver.is_alive():
+                self.resolver = threading.Thread(target=self._resolver_loop, name="seller-country-resolver", daemon=True)
+                self.resolver.start()
+            self.wakeup.notify()
+        logger.debug(f"[COUNTRY] Query #{query_id}: holding items of {len(to_hold)} unresolved sellers")
+
+    def _resolver_loop(self):
+        """Background resolver: looks up pending sellers and releases their held items"""
+        while True:
+            try:
+                self._resolve_round()
+            except Exception as e:
+                logger.error(f"[COUNTRY] Seller lookup round failed: {e}", exc_info=True)
+                time.sleep(LOOKUP_RETRY_BASE)
+
+    def _due_sellers(self, now):
+        """Sellers whose lookup is due, and seconds until the next retry (called under lock)"""
+        due = []
+        next_retry = None
+        for user_id, (_, retry_at) in self.pending.items():
+            if retry_at <= now:
+                due.append(user_id)
+                if len(due) >= self.config["lookups_per_batch"]:
+                    break
+            elif next_retry is None or retry_at < next_retry:
+                next_retry = retry_at
+        return due, None if next_retry is None else next_retry - now
+
+    def _resolve_round(self):
+        """Look up one round of due sellers; ONE upsert for the answers"""
+        import db
+        with self.lock:
+            due, wait = self._due_sellers(time.time())
+            if not due:
+                self.wakeup.wait(wait)
+                return
+
+        rows = []
+        failed = []
+        for user_id in due:
+            self._take_lookup_token()
+            country = self._lookup(user_id)
+            if country is None:
+                failed.append(user_id)
+            else:
+                rows.append((user_id, country, time.time()))
+        if rows:
+            db.save_seller_countries(rows)
+
+        released = []
+        now = time.time()
+        with self.lock:
+            for user_id, country, fetched_at in rows:
+                self._cache_put(user_id, country, fetched_at)
+                del self.pending[user_id]
+                released.extend(self.held.pop(user_id, ()))
+            for user_id in failed:
+                self.api_failures += 1
+                attempts = self.pending[user_id][0] + 1
+                if attempts < MAX_LOOKUP_ATTEMPTS:
+                    delay = min(LOOKUP_RETRY_BASE * 2 ** (attempts - 1), LOOKUP_RETRY_MAX)
+                    self.pending[user_id] = (attempts, now + delay)
+                    continue
+                # Nothing is cached - the seller is looked up again after GIVE_UP_SECONDS
+                del self.pending[user_id]
+                self.given_up = {uid: until for uid, until in self.given_up.items() if until > now}
+                self.given_up[user_id] = now + GIVE_UP_SECONDS
+                self.lookups_given_up += 1
+                released.extend(self.held.pop(user_id, ()))
+                logger.warning(f"[COUNTRY] Lookup of seller {user_id} failed {attempts} times - "
+                               f"its items follow allowlist_unknown_action")
+            self.releasing += len(released)
+        self._release(released)
+
+    def _take_lookup_token(self):
+        """Block until the seller_lookup_rps bucket has a token"""
+        while True:
+            with self.lock:
+                bucket = self.lookup_bucket
+                bucket.refill(time.monotonic())
+                wait = bucket.time_until_token()
+                if wait <= 0:
+                    bucket.tokens -= 1
+                    return
+            time.sleep(min(wait, 1.0))
+
+    def _lookup(self, user_id):
+        """
+        One users API request through a token pool session and the shared rate limiter.
+
+        Returns:
+            str: Country code (UNKNOWN_COUNTRY if the answer has none), None if the lookup failed
+        """
+        from token_pool import get_token_pool
+        from rate_limiter import get_rate_limiter
+        from circuit_breaker import get_circuit_breakers
+        pool = get_token_pool()
+        breakers = get_circuit_breakers()
+        session = self.session
+        if session is None or not session.is_valid or breakers.is_open(session.proxy):
+            session = self.session = pool.get_lookup_session()
+        if session is None or not breakers.allow(session.proxy):
+            logger.debug(f"[COUNTRY] No healthy token session for the lookup of seller {user_id}")
+            return None
+
+        http = session.session
+        # Same bucket key as Items.search()
+        proxy = http.proxies.get("https") if http.proxies else None
+        rate_limiter = get_rate_limiter()
+        rate_limiter.acquire(domain=LOOKUP_LOCALE, proxy=proxy)
+        with self.lock:
+            self.api_lookups += 1
+        url = f"{Urls.base_url(LOOKUP_LOCALE)}/api/v2/users/{user_id}?localize=false"
+        try:
+            response = http.get(url, timeout=30)
+        except Exception as e:
+            logger.debug(f"[COUNTRY] Lookup of seller {user_id} failed: {e}")
+            pool.report_error(session, error=e)
+            self.session = None
+            return None
+        rate_limiter.report_response(response.status_code, domain=LOOKUP_LOCALE, proxy=proxy)
+
+        if response.status_code == 404:
+            # Deleted account - a real answer
+            return UNKNOWN_COUNTRY
+        if response.status_code != 200:
+            logger.debug(f"[COUNTRY] Lookup of seller {user_id} failed with HTTP {response.status_code}")
+            pool.report_error(session, response.status_code)
+            if response.status_code in (401, 403, 429):
+                # Next lookup goes through another token + proxy pair
+                self.session = None
+            return None
+        pool.report_success(session)
+        try:
+            country = _json_loads(response.content)["user"].get("country_iso_code")
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.debug(f"[COUNTRY] Unexpected users API answer for seller {user_id}: {e}")
+            return None
+        return country.upper() if country else UNKNOWN_COUNTRY
+
+    def _release(self, released):
+        """Put held items back into their scan queue, one batch per query"""
+        batches = {}
+        for items_queue, query_id, item in released:
+            batches.setdefault((items_queue, query_id), []).append(item)
+        try:
+            for (items_queue, query_id), items in batches.items():
+                items_queue.put((items, query_id))
+        finally:
+            with self.lock:
+                self.releasing -= len(released)
+                self.items_released += len(released)
+
+    def pending_items(self):
+        """Held items not back in the scan queue yet (graceful shutdown waits for them)"""
+        with self.lock:
+            return sum(len(held) for held in self.held.values()) + self.releasing
+
+    def get_stats(self):
+        """Get seller country filter statistics"""
+        with self.lock:
+            resolved = self.memory_hits + self.db_hits + self.embedded_hits + self.api_lookups
+            return {
+                "allowlist": sorted(self.allowlist) if self.allowlist else [],
+                "cached_sellers": len(self.cache),
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "embedded_hits": self.embedded_hits,
+                "api_lookups": self.api_lookups,
+                "api_failures": self.api_failures,
+                "lookups_given_up": self.lookups_given_up,
+                "pending_sellers": len(self.pending),
+                "held_items": sum(len(held) for held in self.held.values()),
+                "items_held": self.items_held,
+                "items_released": self.items_released,
+                "cache_hit_rate": round((resolved - self.api_lookups) / resolved * 100, 1) if resolved else 0.0,
+                "total_checked": self.total_checked,
+                "total_rejected": self.total_rejected,
+                "total_unknown": self.total_unknown,
+            }
+
+
+# Global seller country filter instance
+_global_filter = None
+_global_filter_lock = threading.Lock()
+
+
+def get_seller_country_filter():
+    """Get or create global seller country filter"""
+    global _global_filter
+    with _global_filter_lock:
+        if _global_filter is None:
+            _global_filter = SellerCountryFilter()
+        return _global_filter
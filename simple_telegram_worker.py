@@ -19,7 +19,10 @@ class SimpleTelegramSender:
         self.token = db.get_parameter("telegram_token")
         self.chat_id = db.get_parameter("telegram_chat_id")
         self.running = False
+        self.sending = False  # Telegram request in flight (graceful shutdown waits for it)
         self.last_update_id = 0  # For processing Telegram updates
+        self.total_sent = 0
+        self.total_failed = 0
         
         logger.info("SimpleTelegramSender initialized with command handling")
         
@@ -124,11 +127,17 @@ class SimpleTelegramSender:
                         
                         # Send to Telegram with thread_id
                         logger.info(f"📱 Sending to Telegram: {content[:50]}... (thread_id: {thread_id})")
-                        success = self.send_message(content, url, photo_url, thread_id)
+                        self.sending = True
+                        try:
+                            success = self.send_message(content, url, photo_url, thread_id)
+                        finally:
+                            self.sending = False
                         
                         if success:
+                            self.total_sent += 1
                             logger.info("✅ Item sent to Telegram successfully!")
                         else:
+                            self.total_failed += 1
                             logger.error("❌ Failed to send item to Telegram")
                     else:
                         logger.warning(f"⚠️ Invalid queue item format: {queue_item}")
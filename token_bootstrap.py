@@ -0,0 +1,231 @@
+"""
+Access token bootstrap of token sessions.
+
+A token session needs the access_token_web cookie, which Vinted sets on its
+HTML pages. Fetching it used to be a full GET of https://www.vinted.de/ - the
+whole homepage (hundreds of KB through a paid proxy) downloaded just to read
+one Set-Cookie header, for every prewarmed token, every fresh pair and every
+rotation. The cookie is in the response headers, so the body is not needed:
+
+1. HEAD of the bootstrap page (token_bootstrap_path): headers only, no body
+   at all, and the keep-alive connection stays reusable for the API calls
+2. if HEAD doesn't set the cookie (or is rejected), a streamed GET: the
+   response headers are read, then the response is closed without
+   downloading the body (the connection is dropped instead of drained)
+
+In "auto" mode (token_bootstrap_method) a HEAD that doesn't yield the cookie
+switches to streamed GETs, and HEAD is probed again every HEAD_REPROBE_INTERVAL
+seconds. Bytes received and latency are measured per method
+(get_bootstrap_stats()).
+"""
+import threading
+import time
+from collections import deque
+from pyVintedVN.settings import Urls
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+TOKEN_COOKIE = "access_token_web"
+BOOTSTRAP_LOCALE = "www.vinted.de"
+METHODS = ("auto", "head", "get")
+# How long streamed GETs are used after a HEAD didn't set the cookie (seconds)
+HEAD_REPROBE_INTERVAL = 3600
+# How many recent samples are kept for avg/p95 metrics
+SAMPLES_WINDOW = 500
+# How often the parameters are re-read (seconds)
+CONFIG_RELOAD_INTERVAL = 30
+
+# Defaults for the DB parameters
+DEFAULT_PATH = "/"
+DEFAULT_METHOD = "auto"
+
+
+def _percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _header_bytes(response):
+    """Approximate size of the status line + response headers"""
+    return 15 + sum(len(name) + len(value) + 4 for name, value in response.headers.items())
+
+
+def _body_bytes(response):
+    """Body bytes actually received (compressed, as on the wire)"""
+    downloaded = getattr(response, "num_bytes_downloaded", None)  # httpx
+    if downloaded is not None:
+        return downloaded
+    raw = getattr(response, "raw", None)  # requests / urllib3
+    try:
+        return raw.tell() if raw is not None else 0
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+def _find_token(cookies):
+    for cookie in cookies:
+        if cookie.name == TOKEN_COOKIE:
+            return cookie.value
+    return None
+
+
+class TokenBootstrap:
+    """
+    Fetches access tokens with as little traffic as possible.
+
+    Features:
+    - HEAD / streamed GET instead of a full homepage download
+    - Automatic fallback to streamed GET if HEAD doesn't set the cookie
+    - Per method: attempts, failures, latency avg/p95, bytes avg/total
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.config = {}
+        self.config_loaded = 0
+        self.head_unsupported_until = 0
+        self.fallbacks = 0
+        self.methods = {}
+
+    def _maybe_reload(self):
+        import db
+        if self.config and time.time() - self.config_loaded < CONFIG_RELOAD_INTERVAL:
+            return
+        method = str(db.get_parameter("token_bootstrap_method") or DEFAULT_METHOD).lower()
+        if method not in METHODS:
+            logger.warning(f"[TOKEN_BOOTSTRAP] Invalid token_bootstrap_method '{method}', using '{DEFAULT_METHOD}'")
+            method = DEFAULT_METHOD
+        path = db.get_parameter("token_bootstrap_path") or DEFAULT_PATH
+        self.config = {"method": method, "path": path if path.startswith("/") else "/" + path}
+        self.config_loaded = time.time()
+
+    def _get_method_stats(self, method):
+        stats = self.methods.get(method)
+        if stats is None:
+            stats = self.methods[method] = {
+                "attempts": 0,
+                "tokens": 0,
+                "failures": 0,
+                "total_bytes": 0,
+                "latencies": deque(maxlen=SAMPLES_WINDOW),
+                "bytes": deque(maxlen=SAMPLES_WINDOW),
+            }
+        return stats
+
+    def _record(self, method, seconds, received, token):
+        with self.lock:
+            stats = self._get_method_stats(method)
+            stats["attempts"] += 1
+            stats["total_bytes"] += received
+            stats["latencies"].append(seconds)
+            stats["bytes"].append(received)
+            if token:
+                stats["tokens"] += 1
+            else:
+                stats["failures"] += 1
+
+    def _request(self, session, method, url, timeout):
+        """One bootstrap request. Returns (access_token, status_code)"""
+        start = time.perf_counter()
+        received = 0
+        token = None
+        try:
+            if method == "head":
+                response = session.head(url, timeout=timeout, allow_redirects=True)
+            else:
+                response = session.get(url, timeout=timeout, stream=True)
+            try:
+                received = _header_bytes(response) + _body_bytes(response)
+            finally:
+                # Streamed GET: the body is never downloaded
+                response.close()
+            if response.status_code == 200:
+                token = _find_token(session.cookies)
+            return token, response.status_code
+        finally:
+            self._record(method, time.perf_counter() - start, received, token)
+
+    def fetch(self, session, timeout=30):
+        """
+        Fetch the access token cookie into the session's cookie jar.
+
+        Args:
+            session: Token session (requests.Session / Http2Session)
+            timeout: Request timeout in seconds
+
+        Returns:
+            tuple: (access_token or None, status_code of the last request)
+
+        Raises:
+            requests.RequestException: Network / proxy errors, as a plain GET would
+        """
+        self._maybe_reload()
+        url = Urls.base_url(BOOTSTRAP_LOCALE) + self.config["path"]
+        method = self.config["method"]
+
+        if method == "get" or (method == "auto" and time.time() < self.head_unsupported_until):
+            return self._request(session, "get", url, timeout)
+
+        token, status_code = self._request(session, "head", url, timeout)
+        if token or method == "head" or status_code in (403, 429):
+            # 403/429 is the proxy's problem, not HEAD's - a GET would fail the same way
+            return token, status_code
+
+        with self.lock:
+            self.fallbacks += 1
+            if time.time() >= self.head_unsupported_until:
+                self.head_unsupported_until = time.time() + HEAD_REPROBE_INTERVAL
+                logger.info(f"[TOKEN_BOOTSTRAP] HEAD {self.config['path']} didn't set {TOKEN_COOKIE} "
+                            f"(status {status_code}) - using streamed GET for {HEAD_REPROBE_INTERVAL // 60} min")
+        return self._request(session, "get", url, timeout)
+
+    def get_stats(self):
+        """Get token bootstrap statistics"""
+        with self.lock:
+            methods = {}
+            for method, stats in self.methods.items():
+                latencies = list(stats["latencies"])
+                sizes = list(stats["bytes"])
+                methods[method] = {
+                    "attempts": stats["attempts"],
+                    "tokens": stats["tokens"],
+                    "failures": stats["failures"],
+                    "total_kb": round(stats["total_bytes"] / 1024, 1),
+                    "avg_bytes": round(sum(sizes) / len(sizes)) if sizes else 0,
+                    "avg_latency_ms": round(sum(latencies) / len(latencies) * 1000, 1) if latencies else 0.0,
+                    "p95_latency_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+                }
+            return {
+                "method": self.config.get("method"),
+                "path": self.config.get("path"),
+                "head_supported": time.time() >= self.head_unsupported_until,
+                "fallbacks": self.fallbacks,
+                "methods": methods,
+            }
+
+
+# Global token bootstrap instance
+_global_bootstrap = None
+_global_bootstrap_lock = threading.Lock()
+
+
+def get_token_bootstrap():
+    """Get or create global token bootstrap"""
+    global _global_bootstrap
+    with _global_bootstrap_lock:
+        if _global_bootstrap is None:
+            _global_bootstrap = TokenBootstrap()
+        return _global_bootstrap
+
+
+def fetch_access_token(session, timeout=30):
+    """Fetch the access_token_web cookie of a session. Returns (access_token or None, status_code)"""
+    return get_token_bootstrap().fetch(session, timeout)
+
+
+def get_bootstrap_stats():
+    """Get token bootstrap statistics"""
+    return get_token_bootstrap().get_stats()
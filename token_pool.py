@@ -8,10 +8,26 @@ import requests
 import random
 import threading
 import time
+from circuit_breaker import get_circuit_breakers
+from http_transport import create_session
+from token_bootstrap import fetch_access_token, get_bootstrap_stats
 from logger import get_logger
 
 logger = get_logger(__name__)
 
+# Failures that say something about the proxy (bans, rate limits, dead endpoints).
+# 401 (token), 404, other statuses and parse errors don't count against its circuit
+PROXY_FAILURE_STATUSES = (403, 429)
+PROXY_FAILURE_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+
+def is_proxy_failure(status_code=None, error=None):
+    """Check if a failed request counts as a circuit breaker failure of its proxy"""
+    if error is not None:
+        return isinstance(error, PROXY_FAILURE_ERRORS)
+    return status_code in PROXY_FAILURE_STATUSES
+
+
 # Pool of realistic User-Agents (Chrome, Firefox, Edge - latest versions)
 USER_AGENTS = [
     # Chrome variants
@@ -181,18 +197,24 @@ class TokenPool:
         Returns:
             TokenSession or None if creation failed
         """
+        # The bootstrap request goes through this proxy - in half-open state this takes the probe
+        if not get_circuit_breakers().allow(proxy_dict):
+            logger.debug("[TOKEN_POOL] Circuit of the picked proxy is open - no session created")
+            return None
+
         session_id = self.next_session_id
         self.next_session_id += 1
         
         try:
-            # Create new session
-            session = requests.Session()
-            
             # Configure proxy if provided
+            converted_proxy = None
             if proxy_dict:
                 import proxies
                 converted_proxy = proxies.convert_proxy_string_to_dict(proxy_dict)
-                session.proxies.update(converted_proxy)
+            
+            # Create new session on the shared connection pool of its proxy
+            # (HTTP/2 transport if http2_enabled) - a rotation to the same proxy reuses the connection
+            session = create_session(converted_proxy)
             
             # Select random User-Agent
             user_agent = random.choice(USER_AGENTS)
@@ -224,20 +246,15 @@ class TokenPool:
             
             session.headers.update(headers)
             
-            # Get access token from main page
+            # Get access token cookie (HEAD / streamed GET - the homepage body is not downloaded)
             logger.debug(f"[TOKEN_POOL] Creating session #{session_id}...")
-            response = session.get("https://www.vinted.de/", timeout=30)
+            access_token, status_code = fetch_access_token(session, timeout=30)
             
-            if response.status_code != 200:
-                logger.error(f"[TOKEN_POOL] Failed to get main page for session #{session_id}: {response.status_code}")
+            if status_code != 200:
+                logger.error(f"[TOKEN_POOL] Failed to get main page for session #{session_id}: {status_code}")
+                get_circuit_breakers().record_failure(proxy_dict)
                 return None
-            
-            # Extract access_token_web from cookies
-            access_token = None
-            for cookie in session.cookies:
-                if cookie.name == 'access_token_web':
-                    access_token = cookie.value
-                    break
+            get_circuit_breakers().record_success(proxy_dict)
             
             if not access_token:
                 logger.error(f"[TOKEN_POOL] No access_token_web found in cookies for session #{session_id}")
@@ -257,6 +274,8 @@ class TokenPool:
             
         except Exception as e:
             logger.error(f"[TOKEN_POOL] Error creating session #{session_id}: {e}")
+            if isinstance(e, requests.RequestException):
+                get_circuit_breakers().record_failure(proxy_dict)
             return None
     
     def _create_new_session(self):
@@ -270,8 +289,8 @@ class TokenPool:
         self.next_session_id += 1
         
         try:
-            # Create new session
-            session = requests.Session()
+            # Create new session (HTTP/2 transport if http2_enabled)
+            session = create_session()
             
             # Select random User-Agent
             user_agent = random.choice(USER_AGENTS)
@@ -305,19 +324,12 @@ class TokenPool:
             
             # Get access token from main page
             logger.info(f"[TOKEN_POOL] Creating session #{session_id} with UA: {user_agent[:50]}...")
-            response = session.get("https://www.vinted.de/", timeout=30)
+            access_token, status_code = fetch_access_token(session, timeout=30)
             
-            if response.status_code != 200:
-                logger.error(f"[TOKEN_POOL] Failed to get main page for session #{session_id}: {response.status_code}")
+            if status_code != 200:
+                logger.error(f"[TOKEN_POOL] Failed to get main page for session #{session_id}: {status_code}")
                 return None
             
-            # Extract access_token_web from cookies
-            access_token = None
-            for cookie in session.cookies:
-                if cookie.name == 'access_token_web':
-                    access_token = cookie.value
-                    break
-            
             if not access_token:
                 logger.error(f"[TOKEN_POOL] No access_token_web found in cookies for session #{session_id}")
                 return None
@@ -354,9 +366,9 @@ class TokenPool:
             while len(self.sessions) <= worker_id and len(self.sessions) < self.max_size:
                 logger.info(f"[TOKEN_POOL] Worker #{worker_id} needs token - creating session #{len(self.sessions) + 1}/{self.target_size}...")
                 # 🔥 ВАЖНО: Используем метод С ПРОКСИ, иначе ban!
-                import proxies
-                proxy_dict = proxies.get_random_proxy()
-                new_session = self._create_new_session_with_proxy(proxy_dict)
+                # Proxies with an open circuit are skipped (no homepage fetch through known-bad proxies)
+                ok, proxy_dict = self._pick_proxy()
+                new_session = self._create_new_session_with_proxy(proxy_dict) if ok else None
                 if new_session:
                     self.sessions.append(new_session)
                     logger.info(f"[TOKEN_POOL] ✅ Created session #{new_session.session_id} for worker #{worker_id}")
@@ -378,9 +390,8 @@ class TokenPool:
             # Это сохраняет привязку worker_id → session_idx
             if not session.is_valid:
                 logger.warning(f"[TOKEN_POOL] Worker #{worker_id} has INVALID token (session #{session.session_id}) - REPLACING on the spot!")
-                import proxies
-                proxy_dict = proxies.get_random_proxy()
-                new_session = self._create_new_session_with_proxy(proxy_dict)
+                ok, proxy_dict = self._pick_proxy()
+                new_session = self._create_new_session_with_proxy(proxy_dict) if ok else None
                 if new_session:
                     # Заменяем невалидный токен НОВЫМ на том же индексе
                     self.sessions[session_idx] = new_session
@@ -393,17 +404,96 @@ class TokenPool:
             logger.debug(f"[TOKEN_POOL] Worker #{worker_id} → Session #{session.session_id} (UA: {session.user_agent[:30]}...)")
             return session
     
+    def retire_session(self, session):
+        """
+        Take a session out of service (its worker was replaced).
+        Its index gets a fresh pair on the next get_session_for_worker().
+        """
+        with self.lock:
+            session.is_valid = False
+        logger.info(f"[TOKEN_POOL] Session #{session.session_id} retired - its slot gets a fresh pair")
+
     def report_success(self, session):
         """Report successful request for a session"""
         with self.lock:
             if session and session in self.sessions:
                 session.increment_request()
+        if session:
+            get_circuit_breakers().record_success(session.proxy)
     
-    def report_error(self, session):
-        """Report error for a session"""
+    def report_error(self, session, status_code=None, error=None):
+        """
+        Report error for a session.
+        Only proxy failures (403/429, connection errors, timeouts) feed its circuit breaker.
+        
+        Args:
+            session: TokenSession of the failed request
+            status_code: HTTP status of the response (None if the request raised)
+            error: Exception raised by the request
+        """
         with self.lock:
             if session and session in self.sessions:
                 session.increment_error()
+        if session and is_proxy_failure(status_code, error):
+            get_circuit_breakers().record_failure(session.proxy)
+    
+    def get_hedge_session(self, exclude):
+        """
+        Pick a valid session bound to a DIFFERENT proxy (hedged requests).
+        Selection only checks that the circuit isn't open (is_open) - the caller
+        takes breakers.allow() once it actually sends the hedge, so a half-open
+        probe isn't spent on a hedge that is skipped afterwards.
+        
+        Args:
+            exclude: TokenSession of the primary request
+            
+        Returns:
+            TokenSession or None if no such session is available
+        """
+        with self.lock:
+            candidates = [s for s in self.sessions
+                          if s.is_valid and s is not exclude and (s.proxy is None or s.proxy != exclude.proxy)]
+        random.shuffle(candidates)
+        breakers = get_circuit_breakers()
+        for session in candidates:
+            if not breakers.is_open(session.proxy):
+                return session
+        return None
+    
+    def get_lookup_session(self):
+        """
+        Pick a session for background API calls outside the scan slots (seller lookups).
+        Borrows a valid pool session whose circuit isn't open; a process without
+        sessions (sharded coordinator) gets a standalone pair that is NOT added to the pool.
+
+        Returns:
+            TokenSession or None if no healthy pair is available
+        """
+        with self.lock:
+            candidates = [s for s in self.sessions if s.is_valid]
+        breakers = get_circuit_breakers()
+        candidates = [s for s in candidates if not breakers.is_open(s.proxy)]
+        if candidates:
+            return random.choice(candidates)
+        ok, proxy_dict = self._pick_proxy()
+        return self._create_new_session_with_proxy(proxy_dict) if ok else None
+
+    def _pick_proxy(self, attempts=5):
+        """
+        Pick a random proxy whose circuit is not open.
+        Only peeks at the circuit (is_open) - the half-open probe is taken by
+        _create_new_session_with_proxy() when the bootstrap request is sent.
+        
+        Returns:
+            tuple: (ok, proxy) - ok is False if every picked proxy had an open circuit
+        """
+        import proxies
+        breakers = get_circuit_breakers()
+        for _ in range(attempts):
+            proxy_dict = proxies.get_random_proxy()
+            if not breakers.is_open(proxy_dict):
+                return True, proxy_dict
+        return False, None
     
     def get_stats(self):
         """Get pool statistics"""
@@ -418,9 +508,44 @@ class TokenPool:
                 "target_size": self.target_size,
                 "total_requests": total_requests,
                 "total_errors": total_errors,
-                "user_agents": list(set(s.user_agent for s in valid_sessions))
+                "user_agents": list(set(s.user_agent for s in valid_sessions)),
+                # Token fetches: method, bytes and latency
+                "token_bootstrap": get_bootstrap_stats(),
+                # Per session: requests and connection handshakes (count, durations)
+                "sessions": [
+                    dict(session_id=s.session_id, age_seconds=round(s.get_age_seconds()),
+                         **s.session.transport_stats.get_stats())
+                    for s in valid_sessions if hasattr(s.session, "transport_stats")
+                ]
             }
     
+    def resize(self, target_size):
+        """
+        Adjust pool capacity to the number of scan slots (queries added/removed at runtime).
+        Sessions above the new size are dropped; missing ones are created on demand
+        by get_session_for_worker().
+        
+        Args:
+            target_size: New number of tokens (= number of worker slots)
+            
+        Returns:
+            int: Number of sessions removed
+        """
+        with self.lock:
+            old_size = self.target_size
+            self.target_size = target_size
+            # Never cap slots below their own token index
+            if target_size > self.max_size:
+                self.max_size = target_size
+            removed = 0
+            if len(self.sessions) > target_size:
+                removed = len(self.sessions) - target_size
+                del self.sessions[target_size:]
+        
+        if old_size != target_size or removed:
+            logger.info(f"[TOKEN_POOL] 📐 Resized pool: target {old_size} → {target_size} (removed {removed} sessions)")
+        return removed
+    
     def refresh_invalid_sessions(self):
         """Remove invalid sessions and create new ones"""
         with self.lock:
@@ -456,7 +581,10 @@ class TokenPool:
             if recovered > 0:
                 logger.info(f"[TOKEN_POOL] 🎉 Recovered {recovered} proxies during periodic recheck!")
         
-        proxy_dict = proxies.get_random_proxy()
+        ok, proxy_dict = self._pick_proxy()
+        if not ok:
+            logger.warning(f"[TOKEN_POOL] ⛔ Worker #{worker_index}: all picked proxies have open circuits - skipping pair creation")
+            return None
         new_session = self._create_new_session_with_proxy(proxy_dict)
         
         if new_session:
@@ -1,4 +1,4 @@
-import multiprocessing, time, core, os, db, configuration_values
+import queue, signal, time, core, os, db, configuration_values
 from apscheduler.schedulers.background import BackgroundScheduler
 from logger import get_logger
 # RSS functionality removed
@@ -133,6 +133,13 @@ def monitor_processes(items_queue, telegram_queue):
     # Check if the query refresh delay has changed
     check_refresh_delay(items_queue)
 
+    # Overload shows up as queue depth - warn before the policy starts blocking/dropping
+    from pipeline_queue import get_pipeline_stats
+    for stage, stats in get_pipeline_stats().items():
+        if stats["fill_percent"] >= 80:
+            logger.warning(f"[PIPELINE] ⚠️ Queue '{stage}' at {stats['fill_percent']}% "
+                           f"({stats['depth']}/{stats['maxsize']}, oldest {stats['oldest_age_seconds']}s)")
+
     # Monitor processes are handled by the main scheduler now
     pass
 
@@ -209,6 +216,27 @@ if __name__ == "__main__":
         else:
             logger.warning("⚠️ Priority query system migration failed (may already exist)")
         
+        # Per-query filter rules column (safe to run multiple times)
+        logger.info("Running filter rules migration...")
+        if db.run_filter_rules_migration():
+            logger.info("✅ Filter rules migration completed successfully")
+        else:
+            logger.warning("⚠️ Filter rules migration failed - per-query filters unavailable")
+        
+        # Seller id -> country cache for the allowlist (safe to run multiple times)
+        logger.info("Running seller country cache migration...")
+        if db.run_seller_country_migration():
+            logger.info("✅ Seller country cache migration completed successfully")
+        else:
+            logger.warning("⚠️ Seller country cache migration failed - countries cached in memory only")
+        
+        # Cluster tables + unique key on items.item (safe to run multiple times)
+        logger.info("Running cluster mode migration...")
+        if db.run_cluster_migration():
+            logger.info("✅ Cluster mode migration completed successfully")
+        else:
+            logger.warning("⚠️ Cluster mode migration failed - cluster-wide dedup unavailable")
+        
         # Reset API requests counter on bot start
         logger.info("Resetting API requests counter...")
         db.reset_api_requests()
@@ -225,12 +253,18 @@ if __name__ == "__main__":
     plugin_checker()
 
     logger.info("[DEBUG] Starting to create queues...")
-    # Create a shared queue using Manager for better cross-platform compatibility
-    manager = multiprocessing.Manager()
-    items_queue = manager.Queue()
-    new_items_queue = manager.Queue()
+    # All stages that consume these queues run as threads of THIS process, so they are
+    # plain in-process queues (no Manager server process, no IPC round trip, no pickling).
+    # Only multi-process mode crosses a process boundary: the shards' bounded pipe (worker_sharding)
+    from worker_sharding import get_shard_count, start_worker_shards
+    from pipeline_queue import create_pipeline_queue
+    shard_count = get_shard_count()
+    # Bounded stage queues with backpressure: scan -> process -> notify
+    # (in multi-process mode the shards feed the scan queue through a pipe)
+    items_queue = create_pipeline_queue("scan")
+    new_items_queue = create_pipeline_queue("notify")
     # RSS queue removed
-    telegram_queue = manager.Queue()
+    telegram_queue = queue.Queue()
     logger.info("[DEBUG] Queues created successfully!")
 
     # RAILWAY FIX: Use single process with threads instead of multiprocessing
@@ -241,8 +275,8 @@ if __name__ == "__main__":
     current_query_refresh_delay = int(query_refresh_delay_param) if query_refresh_delay_param else 15
     logger.info(f"[DEBUG] Query refresh delay from Web UI: {current_query_refresh_delay} seconds")
     
-    # Start INDEPENDENT continuous workers for each query (NO SCHEDULER!)
-    logger.info("[DEBUG] Starting INDEPENDENT workers for each query...")
+    # Start scan slots for each query on the central deadline scheduler
+    logger.info("[DEBUG] Starting scan slots for each query (central deadline scheduler)...")
     logger.info(f"[DEBUG] Each query will scan every {current_query_refresh_delay} seconds in PARALLEL")
     
     # Get number of queries to show in logs
@@ -253,21 +287,32 @@ if __name__ == "__main__":
     logger.info(f"[DEBUG] 📊 Refresh delay: {current_query_refresh_delay}s")
     logger.info(f"[DEBUG] 📊 Expected requests per minute: ~{int(60 / current_query_refresh_delay * all_queries_count)}")
     
-    workers_executor = core.start_continuous_workers(items_queue)
+    # Cluster mode: join the cluster and take query leases BEFORE scan slots are created
+    from cluster import is_cluster_mode_enabled, start_cluster_node
+    if is_cluster_mode_enabled():
+        cluster_node = start_cluster_node()
+        logger.info(f"[DEBUG] 🌐 Cluster mode: node {cluster_node.node_id} holds {len(cluster_node.owned)} query leases")
+    
+    # State handed over by the previous process (taken once - deleted from the DB)
+    from graceful_shutdown import take_state_snapshots
+    restored_states = take_state_snapshots()
+    
+    if shard_count > 1:
+        # Scan slots in N worker processes, this process is the coordinator (dedup, DB, Telegram, Web UI)
+        logger.info(f"[DEBUG] 🧩 Multi-process mode: {shard_count} scan worker processes")
+        workers_executor = start_worker_shards(shard_count, items_queue, restored_states)
+    else:
+        workers_executor = core.start_continuous_workers(items_queue, restored_states)
     if workers_executor:
-        logger.info(f"[DEBUG] ✅ Independent workers started successfully!")
-        logger.info(f"[DEBUG] ✅ {all_queries_count} workers are now running in parallel!")
+        logger.info(f"[DEBUG] ✅ Scan scheduler started successfully!")
+        logger.info(f"[DEBUG] ✅ {all_queries_count} queries are now scheduled!")
     else:
         logger.error(f"[DEBUG] ❌ Failed to start independent workers!")
     
-    # Start item processor scheduler - THIS WAS MISSING!
-    logger.info("[DEBUG] Starting item processor scheduler...")
-    processor_scheduler = BackgroundScheduler()
-    # Ускоряем обработку очереди с 1 сек до 0.1 сек для мгновенной отправки
-    processor_scheduler.add_job(core.clear_item_queue, 'interval', seconds=0.1, 
-                               args=[items_queue, new_items_queue], name="item_processor")
-    processor_scheduler.start()
-    logger.info("[DEBUG] Item processor scheduler started (0.1s interval for instant processing)!")
+    # Start the event-driven item processor (blocks on the scan queue, no polling)
+    logger.info("[DEBUG] Starting item processor...")
+    item_processor = core.start_item_processor(items_queue, new_items_queue)
+    logger.info("[DEBUG] Item processor started (processes batches as soon as they arrive)!")
     
     # Start monitor scheduler  
     monitor_scheduler = BackgroundScheduler()
@@ -278,6 +323,7 @@ if __name__ == "__main__":
 
     # Start SIMPLE Telegram sender instead of complex LeRobot
     logger.info("[DEBUG] Starting SIMPLE Telegram sender...")
+    telegram_sender = None
     try:
         from simple_telegram_worker import start_simple_telegram_sender
         telegram_sender = start_simple_telegram_sender(new_items_queue)
@@ -290,6 +336,13 @@ if __name__ == "__main__":
         import traceback
         logger.error(f"[DEBUG] Traceback: {traceback.format_exc()}")
 
+    # Graceful shutdown: drain the pipeline and save state before exiting
+    from graceful_shutdown import register_pipeline, request_graceful_shutdown, restore_pipeline_counters
+    register_pipeline(items_queue=items_queue, new_items_queue=new_items_queue,
+                      item_processor=item_processor, telegram_sender=telegram_sender)
+    restore_pipeline_counters(restored_states)
+    signal.signal(signal.SIGTERM, lambda signum, frame: request_graceful_shutdown("SIGTERM"))
+
     # Start Web UI in the main process
     logger.info("[DEBUG] Starting Web UI in main process...")
     port = int(os.environ.get('PORT', configuration_values.WEB_UI_PORT))
@@ -303,7 +356,7 @@ if __name__ == "__main__":
         # Start schedulers in threads before starting Flask
         logger.info("[DEBUG] All systems started, now starting Flask server...")
         logger.info(f"[DEBUG] Independent workers: {workers_executor is not None}")
-        logger.info(f"[DEBUG] Processor scheduler running: {processor_scheduler.running}")
+        logger.info(f"[DEBUG] Item processor running: {item_processor.running}")
         logger.info(f"[DEBUG] Monitor scheduler running: {monitor_scheduler.running}")
         
         # This will block and serve the web UI
@@ -315,8 +368,7 @@ if __name__ == "__main__":
         app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
     except KeyboardInterrupt:
         logger.info("Main process interrupted")
-        if workers_executor:
-            workers_executor.shutdown(wait=False)
-        processor_scheduler.shutdown()
         monitor_scheduler.shutdown()
-        logger.info("All systems stopped")
+        # Drains scans (shard processes are stopped only after their drain) and queues,
+        # saves the state snapshot, leaves the cluster, exits
+        request_graceful_shutdown("KeyboardInterrupt", wait=True)
@@ -0,0 +1,79 @@
+"""
+Recorder of real catalog responses for replay by the local mock server.
+
+With VINTED_RECORD_FILE=/path/to/recording.jsonl every Items.search()
+response (status, latency, body) is appended as one JSON line. The file is
+replayed by mock_vinted_server.py --replay, so load tests and ban-storm
+reproductions run on real payloads without touching vinted.de.
+"""
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+RECORD_FILE = os.environ.get("VINTED_RECORD_FILE")
+# Params that differ between scans of the same search (not part of the replay key)
+VOLATILE_PARAMS = ("page", "per_page", "time")
+
+_record_lock = threading.Lock()
+_recorded = 0
+
+
+def is_recording():
+    return RECORD_FILE is not None
+
+
+def replay_key(path, params):
+    """Key of a search in a recording: path + params without paging/time"""
+    stable = sorted((k, str(v)) for k, v in (params or {}).items()
+                    if k not in VOLATILE_PARAMS and v not in (None, ""))
+    return path + "?" + "&".join(f"{k}={v}" for k, v in stable)
+
+
+def record_response(url, params, response):
+    """Append one response (called by Items.search when recording is enabled)"""
+    global _recorded
+    elapsed = getattr(response, "elapsed", None)
+    entry = {
+        "time": time.time(),
+        "path": urlparse(url).path,
+        "params": {k: v for k, v in (params or {}).items() if v is not None},
+        "status": response.status_code,
+        "elapsed": elapsed.total_seconds() if elapsed is not None else None,
+        "body": response.content.decode("utf-8", errors="replace"),
+    }
+    line = json.dumps(entry, ensure_ascii=False)
+    try:
+        with _record_lock:
+            with open(RECORD_FILE, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            _recorded += 1
+            if _recorded % 100 == 1:
+                logger.info(f"[RECORDER] 📼 {_recorded} responses recorded to {RECORD_FILE}")
+    except OSError as e:
+        logger.warning(f"[RECORDER] Failed to record response: {e}")
+
+
+def load_recording(path):
+    """
+    Load a recording for replay.
+
+    Returns:
+        dict: replay key -> list of entries (in recording order)
+    """
+    recording = {}
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"[RECORDER] Skipping invalid line {line_number} of {path}")
+                continue
+            recording.setdefault(replay_key(entry["path"], entry["params"]), []).append(entry)
+    return recording
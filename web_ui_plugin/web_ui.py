@@ -1,9 +1,10 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-import db, core, os, re
+import db, core, os, re, json
 from urllib.parse import urlparse, parse_qs
 from datetime import datetime, timezone, timedelta
 from logger import get_logger
 import configuration_values
+from seller_country import get_seller_country_filter
 
 # Импорт системы автоматического редеплоя
 try:
@@ -547,6 +548,7 @@ def update_thread_id():
         if db_query_id:
             success = db.update_query_thread_id(db_query_id, thread_id_int)
             if success:
+                core.invalidate_query_cache()
                 if thread_id_int:
                     flash(f'Thread ID updated to {thread_id_int}', 'success')
                 else:
@@ -627,6 +629,9 @@ def edit_query(query_id):
         conn.commit()
         conn.close()
         
+        # Restart the query's scan slots with the new URL
+        core.request_worker_reconcile()
+        
         flash(f'Query "{new_name or new_query}" updated successfully', 'success')
         logger.info(f"Query {query_id} updated: {new_query}")
         
@@ -637,6 +642,37 @@ def edit_query(query_id):
     return redirect(url_for('queries'))
 
 
+@app.route('/api/query/<int:query_id>/filters', methods=['GET', 'POST'])
+def query_filters_api(query_id):
+    """API endpoint to get/set per-query filter rules (price, brand/size allow/deny, title keywords)"""
+    from filter_engine import parse_rules
+    try:
+        if request.method == 'GET':
+            rules = db.get_query_filter_rules().get(query_id)
+            return jsonify({
+                'success': True,
+                'rules': json.loads(rules) if rules else {}
+            })
+        
+        data = request.get_json() or {}
+        try:
+            rules = parse_rules(data.get('rules') or {})
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        success = db.set_query_filter_rules(query_id, json.dumps(rules) if rules else None)
+        if success:
+            logger.info(f"Query {query_id} filter rules updated: {rules}")
+            # Recompile on the next batch
+            core.invalidate_query_cache()
+            return jsonify({'success': True, 'message': 'Filter rules updated', 'rules': rules})
+        return jsonify({'success': False, 'message': 'Failed to update filter rules'}), 500
+        
+    except Exception as e:
+        logger.error(f"Error in query {query_id} filters API: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
 @app.route('/api/query/<int:query_id>/priority', methods=['POST'])
 def set_query_priority_api(query_id):
     """API endpoint to set query priority (AJAX)"""
@@ -650,6 +686,8 @@ def set_query_priority_api(query_id):
         if success:
             status = "priority" if is_priority else "normal"
             logger.info(f"Query {query_id} priority set to: {status}")
+            # Resize the query's scan slots (1 <-> 6) right away
+            core.request_worker_reconcile()
             return jsonify({
                 'success': True,
                 'message': f'Query set to {status} mode',
@@ -930,6 +968,7 @@ def remove_country(country):
 @app.route('/clear_allowlist', methods=['POST'])
 def clear_allowlist():
     db.clear_allowlist()
+    get_seller_country_filter().invalidate()
     flash('Allowlist cleared', 'success')
 
     return redirect(url_for('config'))
@@ -1314,34 +1353,31 @@ def set_thread_ids():
 @app.route('/force_scan_all', methods=['POST'])
 def force_scan_all():
     """
-    Force scan all queries immediately by temporarily setting query_refresh_delay to 0.
+    Force scan all queries immediately.
     
-    With continuous workers architecture:
-    - Workers read config dynamically from DB
-    - Setting delay to 0 triggers immediate scans
-    - After 5 seconds, restore original delay
+    With the central scan scheduler:
+    - Every scan slot is made due right now
+    - After the forced scan each slot returns to its original deadline (phases are kept)
+    - Sharded mode: the command is forwarded to every scan worker process
     """
     try:
         logger.info("🚀 ПРИНУДИТЕЛЬНОЕ СКАНИРОВАНИЕ ВСЕХ ФИЛЬТРОВ ЗАПУЩЕНО!")
         
-        # Get current delay
-        current_delay = db.get_parameter("query_refresh_delay") or "15"
-        logger.info(f"[FORCE SCAN] Current delay: {current_delay}s")
-        
-        # Set delay to 1 second to trigger immediate scans in all workers
-        db.set_parameter("query_refresh_delay", "1")
-        logger.info(f"[FORCE SCAN] Delay set to 1s - all workers will scan immediately!")
-        
-        # Schedule restoration of original delay after 5 seconds
-        import threading
-        def restore_delay():
-            import time
-            time.sleep(5)
-            db.set_parameter("query_refresh_delay", current_delay)
-            logger.info(f"[FORCE SCAN] Delay restored to {current_delay}s")
-        
-        restore_thread = threading.Thread(target=restore_delay, daemon=True)
-        restore_thread.start()
+        from worker_sharding import FORCE_SCAN, get_shard_manager
+        shard_manager = get_shard_manager()
+        if shard_manager is not None:
+            sent = shard_manager.broadcast(FORCE_SCAN)
+            logger.info(f"[FORCE SCAN] Forwarded to {sent}/{shard_manager.shard_count} scan worker processes")
+            if not sent:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'No scan worker process is running'
+                })
+        else:
+            from scan_scheduler import get_scan_scheduler
+            scheduler = get_scan_scheduler()
+            scheduler.run_all_now()
+            logger.info(f"[FORCE SCAN] {len(scheduler.jobs)} scan slots made due immediately")
         
         # Get current stats for response
         queries = db.get_queries()
@@ -1349,10 +1385,10 @@ def force_scan_all():
         
         return jsonify({
             'status': 'success',
-            'message': f'Force scan triggered for {query_count} queries! All workers will scan within 1 second.',
+            'message': f'Force scan triggered for {query_count} queries! All scan slots are due now.',
             'queries_scanned': query_count,
-            'note': f'Delay temporarily set to 1s, will restore to {current_delay}s in 5 seconds.',
-            'current_delay': current_delay
+            'note': 'Slots return to their regular deadlines after this scan.',
+            'current_delay': db.get_parameter("query_refresh_delay") or "60"
         })
         
     except Exception as e:
@@ -2066,12 +2102,14 @@ def api_token_pool_stats():
     """API endpoint for token pool statistics - shows unique tokens & User-Agents"""
     try:
         from token_pool import get_token_pool
+        from circuit_breaker import get_circuit_breakers
         token_pool = get_token_pool()
         stats = token_pool.get_stats()
         
         return jsonify({
             'status': 'success',
-            'stats': stats
+            'stats': stats,
+            'circuit_breakers': get_circuit_breakers().get_stats()
         })
     except Exception as e:
         logger.error(f"Error in api_token_pool_stats: {e}")
@@ -2108,9 +2146,19 @@ def api_worker_stats():
                         scan['time'] = scan['time'].strftime('%H:%M:%S')
                     # else: already a string, keep as is
         
+        from scan_scheduler import get_scheduler_stats
+        from worker_sharding import get_shard_manager
+        reconciler = core.get_worker_reconciler()
+        supervisor = core.get_worker_supervisor()
+        shard_manager = get_shard_manager()
+        
         return jsonify({
             'status': 'success',
-            'workers': worker_stats
+            'workers': worker_stats,
+            'scheduler': get_scheduler_stats(),
+            'reconciler': reconciler.get_stats() if reconciler else None,
+            'supervisor': supervisor.get_stats() if supervisor else None,
+            'shards': shard_manager.get_stats() if shard_manager else None
         })
     except Exception as e:
         logger.error(f"Error in api_worker_stats: {e}")
@@ -2119,6 +2167,106 @@ def api_worker_stats():
         return jsonify({'status': 'error', 'error': str(e)}), 500
 
 
+@app.route('/api/scheduler_stats')
+def api_scheduler_stats():
+    """API endpoint for scan scheduler statistics - scheduling lag, overdue slots"""
+    try:
+        from scan_scheduler import get_scheduler_stats
+        from adaptive_refresh import get_adaptive_refresh_controller
+        from query_coalescing import get_coalescing_stats
+        from hedged_requests import get_hedge_controller
+        from early_exit_parser import get_early_exit_parser
+        stats = get_scheduler_stats()
+        if stats is None:
+            return jsonify({'status': 'error', 'error': 'Scan scheduler not started'}), 503
+        
+        return jsonify({
+            'status': 'success',
+            'stats': stats,
+            'adaptive_refresh': get_adaptive_refresh_controller().get_stats(),
+            'coalescing': get_coalescing_stats().get_stats(),
+            'catchup': core.get_catchup_stats(),
+            'compiled_searches': core.get_compiled_search_stats(),
+            'hedging': get_hedge_controller().get_stats(),
+            'early_exit_parsing': get_early_exit_parser().get_stats()
+        })
+    except Exception as e:
+        logger.error(f"Error in api_scheduler_stats: {e}")
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
+@app.route('/api/rate_limiter_stats')
+def api_rate_limiter_stats():
+    """API endpoint for rate limiter statistics - wait-time histogram, throttle factor"""
+    try:
+        from rate_limiter import get_rate_limiter
+        return jsonify({
+            'status': 'success',
+            'stats': get_rate_limiter().get_stats()
+        })
+    except Exception as e:
+        logger.error(f"Error in api_rate_limiter_stats: {e}")
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
+@app.route('/api/http_stats')
+def api_http_stats():
+    """API endpoint for HTTP transport statistics - connections, handshakes, p95 latency"""
+    try:
+        from http_transport import get_transport_stats
+        return jsonify({
+            'status': 'success',
+            'stats': get_transport_stats()
+        })
+    except Exception as e:
+        logger.error(f"Error in api_http_stats: {e}")
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
+@app.route('/api/pipeline_stats')
+def api_pipeline_stats():
+    """API endpoint for pipeline stage queues - depth, enqueue wait, age of oldest entry"""
+    try:
+        from pipeline_queue import get_pipeline_stats
+        from filter_engine import get_filter_engine
+        item_processor = core.get_item_processor()
+        return jsonify({
+            'status': 'success',
+            'queues': get_pipeline_stats(),
+            'item_processor': item_processor.get_stats() if item_processor else None,
+            'filters': get_filter_engine().get_stats(),
+            'seller_countries': get_seller_country_filter().get_stats()
+        })
+    except Exception as e:
+        logger.error(f"Error in api_pipeline_stats: {e}")
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
+@app.route('/api/cluster_stats')
+def api_cluster_stats():
+    """API endpoint for cluster mode - nodes, fair share and query leases"""
+    try:
+        from cluster import get_cluster_node
+        node = get_cluster_node()
+        if node is None:
+            return jsonify({'status': 'error', 'error': 'Cluster mode is disabled'}), 503
+        
+        leases = {}
+        for query_id, node_id, lease_expires in db.get_query_leases():
+            leases.setdefault(node_id or 'unassigned', []).append(query_id)
+        
+        return jsonify({
+            'status': 'success',
+            'node': node.get_stats(),
+            'nodes': [{'node_id': n[0], 'hostname': n[1], 'started_at': n[2], 'last_heartbeat': n[3]}
+                      for n in db.get_cluster_nodes()],
+            'leases': leases
+        })
+    except Exception as e:
+        logger.error(f"Error in api_cluster_stats: {e}")
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
 def web_ui_process():
     logger.info("Web UI process started")
     
@@ -0,0 +1,297 @@
+"""
+Multi-process sharding of scan slots.
+
+In single-process mode scanning threads, JSON parsing, item processing,
+Telegram sending and Flask all share one GIL. With scan_worker_processes > 1
+(or SCAN_WORKER_PROCESSES env) the scan slots are split over N worker
+processes:
+
+- Shard i runs the slots whose key (query id / group leader id) % N == i,
+  with its own scheduler, reconciler, supervisor and token pool slice
+- Scanned items go to the coordinator over ONE bounded multiprocessing.Queue
+  (pipe); a pump thread moves them into the coordinator's scan stage queue
+- The coordinator (main process) keeps dedup, DB writes, Telegram and Web UI
+- Every shard pushes a stats snapshot every few seconds; dead shards are restarted
+- Web UI / Telegram commands that act on the scan slots (force scan, reconcile
+  after query changes) are forwarded to every shard over a control queue
+- Rate limits and circuit breaker thresholds are split: each shard gets
+  1/N of the configured budget (rate_limiter.get_budget_share())
+"""
+import multiprocessing
+import os
+import queue as queue_module
+import signal
+import threading
+import time
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# How often shards push their stats snapshot (seconds)
+STATS_INTERVAL = 10
+# How often the coordinator checks that shard processes are alive (seconds)
+MONITOR_INTERVAL = 5
+# How long a shard waits for its in-flight scans on graceful shutdown (seconds)
+DRAIN_TIMEOUT = 15
+
+# Commands the coordinator forwards to the shards (ShardManager.broadcast())
+FORCE_SCAN = "force_scan"
+RECONCILE = "reconcile"
+
+
+def get_shard_count():
+    """Number of scan worker processes (1 = classic single-process mode)"""
+    import db
+    try:
+        value = os.environ.get("SCAN_WORKER_PROCESSES") or db.get_parameter("scan_worker_processes") or 1
+        return max(1, int(value))
+    except (ValueError, TypeError):
+        return 1
+
+
+def get_multiprocessing_context():
+    """Spawn context - no forked DB connections/locks in the children"""
+    return multiprocessing.get_context("spawn")
+
+
+def _shard_stats_snapshot(shard_index):
+    """Collect picklable stats of THIS shard process"""
+    import core
+    from scan_scheduler import get_scheduler_stats
+    from token_pool import get_token_pool
+    reconciler = core.get_worker_reconciler()
+    supervisor = core.get_worker_supervisor()
+    token_stats = get_token_pool().get_stats()
+    token_stats.pop("user_agents", None)
+    token_stats.pop("sessions", None)
+    return {
+        "shard": shard_index,
+        "pid": os.getpid(),
+        "time": time.time(),
+        "active_workers": core.get_active_workers_count(),
+        "workers": core.get_worker_stats(),
+        "scheduler": get_scheduler_stats(),
+        "reconciler": reconciler.get_stats() if reconciler else None,
+        "supervisor": supervisor.get_stats() if supervisor else None,
+        "token_pool": token_stats,
+    }
+
+
+def _run_shard_command(command, scheduler):
+    """Apply a command forwarded by the coordinator to THIS shard's slots"""
+    import core
+    if command == FORCE_SCAN:
+        scheduler.run_all_now()
+        logger.info(f"[FORCE SCAN] {len(scheduler.jobs)} scan slots made due immediately")
+    elif command == RECONCILE:
+        core.request_worker_reconcile()
+    else:
+        logger.warning(f"[SHARDING] Unknown shard command: {command!r}")
+
+
+def shard_process_main(shard_index, shard_count, items_queue, stats_queue, stop_event, restored_states=None,
+                       control_queue=None):
+    """Entry point of ONE scan worker process"""
+    import core
+    from graceful_shutdown import drain_scans, save_state_snapshot
+    # Ctrl+C reaches the whole process group - the coordinator drives the shutdown via stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logger.info(f"[SHARD {shard_index}/{shard_count}] 🚀 Worker process started (pid {os.getpid()})")
+    core.set_worker_shard(shard_index, shard_count)
+    scheduler = core.start_continuous_workers(items_queue, restored_states)
+    if scheduler is None:
+        logger.error(f"[SHARD {shard_index}/{shard_count}] ❌ Failed to start scan slots")
+        return
+
+    try:
+        next_stats = time.time()
+        while not stop_event.is_set():
+            if time.time() >= next_stats:
+                next_stats = time.time() + STATS_INTERVAL
+                try:
+                    stats_queue.put_nowait(_shard_stats_snapshot(shard_index))
+                except Exception as e:
+                    logger.debug(f"[SHARD {shard_index}/{shard_count}] Failed to push stats: {e}")
+            # Coordinator commands; the short timeout keeps stop_event responsive
+            try:
+                command = control_queue.get(timeout=min(1.0, max(0.0, next_stats - time.time())))
+            except queue_module.Empty:
+                continue
+            _run_shard_command(command, scheduler)
+        # Graceful shutdown: finish in-flight scans, hand the state over, exit
+        drain_scans(time.time() + DRAIN_TIMEOUT)
+        save_state_snapshot(f"shard{shard_index}")
+        # Flush the pipe feeder thread before the process exits
+        items_queue.close()
+        items_queue.join_thread()
+        logger.info(f"[SHARD {shard_index}/{shard_count}] Worker process drained and stopped")
+    except (KeyboardInterrupt, SystemExit):
+        scheduler.shutdown(wait=False)
+        logger.info(f"[SHARD {shard_index}/{shard_count}] Worker process stopped")
+
+
+class ShardManager:
+    """
+    Coordinator side of multi-process sharding.
+
+    Features:
+    - Starts N spawn processes running shard_process_main()
+    - Restarts shard processes that died
+    - Collects per-shard stats snapshots for the Web UI
+    - Forwards slot commands (force scan, reconcile) to every shard
+    """
+
+    def __init__(self, shard_count, items_queue, restored_states=None):
+        self.shard_count = shard_count
+        self.items_queue = items_queue
+        # Shutdown snapshots for the first start of the shards (restarted shards start cold)
+        self.restored_states = restored_states or []
+        self.context = get_multiprocessing_context()
+        # Bounded pipe: shards block on put() when the coordinator falls behind
+        self.transport_queue = self.context.Queue(maxsize=getattr(items_queue, "maxsize", 0) or 0)
+        self.stats_queue = self.context.Queue()
+        # One control queue per shard (kept across restarts of that shard)
+        self.control_queues = {i: self.context.Queue() for i in range(shard_count)}
+        self.stop_event = self.context.Event()
+        self._draining = False
+        self.processes = {}
+        self.restarts = {}
+        self.shard_stats = {}
+        self.lock = threading.Lock()
+        self._running = False
+
+    def _start_shard(self, shard_index, restored_states=()):
+        process = self.context.Process(
+            target=shard_process_main,
+            args=(shard_index, self.shard_count, self.transport_queue, self.stats_queue, self.stop_event,
+                  list(restored_states), self.control_queues[shard_index]),
+            name=f"scan-shard-{shard_index}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[shard_index] = process
+        logger.info(f"[SHARDING] ✅ Shard {shard_index}/{self.shard_count} started (pid {process.pid})")
+
+    def start(self):
+        """Start all shard processes plus the monitor and stats threads"""
+        self._running = True
+        for shard_index in range(self.shard_count):
+            self._start_shard(shard_index, self.restored_states)
+        self.restored_states = []
+        threading.Thread(target=self._monitor_loop, name="shard-monitor", daemon=True).start()
+        threading.Thread(target=self._stats_loop, name="shard-stats", daemon=True).start()
+        threading.Thread(target=self._pump_loop, name="shard-items-pump", daemon=True).start()
+        logger.info(f"[SHARDING] 🚀 {self.shard_count} scan worker processes started")
+
+    def _monitor_loop(self):
+        while self._running:
+            time.sleep(MONITOR_INTERVAL)
+            for shard_index, process in list(self.processes.items()):
+                if self._running and not self._draining and not process.is_alive():
+                    self.restarts[shard_index] = self.restarts.get(shard_index, 0) + 1
+                    logger.error(f"[SHARDING] ❌ Shard {shard_index} died (exit code {process.exitcode}) - "
+                                 f"restarting (restart #{self.restarts[shard_index]})")
+                    self._start_shard(shard_index)
+
+    def _stats_loop(self):
+        while self._running:
+            try:
+                snapshot = self.stats_queue.get(timeout=1)
+            except queue_module.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            with self.lock:
+                self.shard_stats[snapshot["shard"]] = snapshot
+
+    def _pump_loop(self):
+        """Move item batches from the shard pipe into the scan stage queue (applies its policy)"""
+        while self._running:
+            try:
+                batch = self.transport_queue.get(timeout=1)
+            except queue_module.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            self.items_queue.put(batch)
+
+    def broadcast(self, command):
+        """
+        Forward a command (FORCE_SCAN / RECONCILE) to every running shard.
+
+        Returns:
+            int: Number of shards the command was sent to
+        """
+        sent = 0
+        for shard_index, process in self.processes.items():
+            if not process.is_alive():
+                # A restarted shard builds its slots from the DB anyway
+                continue
+            self.control_queues[shard_index].put(command)
+            sent += 1
+        return sent
+
+    def drain(self, timeout):
+        """
+        Graceful shutdown: every shard stops dispatching, finishes its in-flight
+        scans and saves its state snapshot; the pump keeps moving their items
+        into the scan queue until the pipe is empty.
+        """
+        self._draining = True
+        self.stop_event.set()
+        deadline = time.time() + timeout
+        for process in self.processes.values():
+            process.join(timeout=max(0.0, deadline - time.time()))
+        while not self.transport_queue.empty() and time.time() < deadline:
+            time.sleep(0.1)
+        # Give the pump a moment to hand over the last batch it took
+        time.sleep(0.2)
+        alive = [i for i, p in self.processes.items() if p.is_alive()]
+        if alive:
+            logger.warning(f"[SHARDING] ⚠️ Shards {alive} did not drain in time - terminating")
+        self.shutdown()
+
+    def shutdown(self, wait=False):
+        """Stop all shard processes"""
+        self._running = False
+        for process in self.processes.values():
+            process.terminate()
+        if wait:
+            for process in self.processes.values():
+                process.join(timeout=10)
+        logger.info("[SHARDING] All shard processes stopped")
+
+    def get_stats(self):
+        """Per-shard process state and latest stats snapshot"""
+        with self.lock:
+            shards = {}
+            for shard_index, process in self.processes.items():
+                snapshot = self.shard_stats.get(shard_index)
+                shards[shard_index] = {
+                    "pid": process.pid,
+                    "alive": process.is_alive(),
+                    "restarts": self.restarts.get(shard_index, 0),
+                    "stats": snapshot,
+                }
+            return {
+                "shard_count": self.shard_count,
+                "active_workers": sum((s["stats"] or {}).get("active_workers", 0) for s in shards.values()),
+                "shards": shards,
+            }
+
+
+# Global shard manager (coordinator process only)
+_shard_manager = None
+
+
+def start_worker_shards(shard_count, items_queue, restored_states=None):
+    """Start scan worker processes (coordinator side)"""
+    global _shard_manager
+    _shard_manager = ShardManager(shard_count, items_queue, restored_states)
+    _shard_manager.start()
+    return _shard_manager
+
+
+def get_shard_manager():
+    """Get the shard manager, or None in single-process mode"""
+    return _shard_manager